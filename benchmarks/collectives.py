@@ -0,0 +1,159 @@
+"""
+Time of the collective operations of ``mead.Group()`` across a range of sizes.
+
+Runs every rank as a ``mead.Process``, on the loopback worker started by
+``benchmarks/transport.py`` or, with ``--local``, on this machine over
+shared memory, and writes the results as JSON::
+
+    python benchmarks/collectives.py --ranks 4 --output collectives.json
+    python benchmarks/collectives.py --local --ranks 8 --ops allreduce
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+from typing import Any, Dict, List
+
+import mead
+from mead.collectives import LARGE
+from mead.initialization import stop_clients
+
+from transport import ROOT, CHANNEL, TRANSPORT, launch, percentile
+
+# Array sizes in bytes, from 8 B to 16 MB.
+SIZES = [8 * 16 ** i for i in range(6)] + [16 * 2 ** 20]
+OPS = ("bcast", "scatter", "gather", "reduce", "allreduce")
+
+# Operations which split large arrays into segments.
+PIPELINED = ("bcast", "reduce", "allreduce")
+
+# Repetitions per measurement: enough to move ``BUDGET`` bytes, within bounds.
+BUDGET = 64 * 2 ** 20
+MIN_COUNT = 3
+MAX_COUNT = 200
+
+
+def rank(comm: mead.Comm, spout: mead.Spout, funnel: mead.Funnel) -> None:
+    """ Runs the collectives the head asks for, and reports their times. """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    while True:
+        command = spout.recv()
+        if command is None:
+            return
+        op, size, count = command
+        array = np.ones(max(size // 8, 1))
+        samples = []
+        for _ in range(count):
+            comm.allreduce(0)
+            start = time.perf_counter()
+            if op == "bcast":
+                comm.bcast(array if comm.rank == 0 else None)
+            elif op == "scatter":
+                comm.scatter([array] * comm.size if comm.rank == 0 else None)
+            elif op == "gather":
+                comm.gather(array)
+            elif op == "reduce":
+                comm.reduce(array)
+            else:
+                comm.allreduce(array)
+            samples.append(time.perf_counter() - start)
+        funnel.send(samples)
+
+
+def run(
+    ranks: int, sizes: List[int], ops: List[str], local: bool
+) -> List[Dict[str, Any]]:
+    """ Runs the sweep on fresh ranks and returns one result per case. """
+    children = [] if local else launch(TRANSPORT)
+    hostname = "localhost" if local else CHANNEL
+    comms = mead.Group(ranks)
+    commands = [mead.Pipe() for _ in comms]
+    reports = [mead.Pipe() for _ in comms]
+    processes = [
+        mead.Process(target=rank, hostname=hostname, args=(comm, command[1], report[0]))
+        for comm, command, report in zip(comms, commands, reports)
+    ]
+    for process in processes:
+        process.start()
+
+    results: List[Dict[str, Any]] = []
+    try:
+        for op in ops:
+            for size in sizes:
+                count = max(MIN_COUNT, min(MAX_COUNT, BUDGET // (size * ranks)))
+                print("%s %d B x %d" % (op, size, count), file=sys.stderr)
+                for command in commands:
+                    command[0].send((op, size, count))
+
+                # An operation takes as long as its slowest rank.
+                samples = [report[1].recv() for report in reports]
+                seconds = [max(each) for each in zip(*samples)]
+                results.append(
+                    {
+                        "op": op,
+                        "size": size,
+                        "ranks": ranks,
+                        "pipelined": op in PIPELINED and ranks > 2 and size >= LARGE,
+                        "count": count,
+                        "p50_us": percentile(seconds, 50) * 1e6,
+                        "p99_us": percentile(seconds, 99) * 1e6,
+                        "mb_per_s": size / percentile(seconds, 50) / 1e6,
+                    }
+                )
+        for command in commands:
+            command[0].send(None)
+        for process in processes:
+            process.join()
+    finally:
+        if not local:
+            stop_clients()
+        for child in children:
+            child.terminate()
+            child.wait()
+    return results
+
+
+def main() -> None:
+    """ Parses arguments, runs the benchmark and writes the JSON report. """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--ranks", type=int, default=4)
+    parser.add_argument("--sizes", default=",".join(str(size) for size in SIZES))
+    parser.add_argument("--max-size", type=int, default=max(SIZES))
+    parser.add_argument("--ops", default=",".join(OPS))
+    parser.add_argument("--local", action="store_true")
+    parser.add_argument("--output", default="-")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    sizes = [size for size in sizes if size <= args.max_size]
+    ops = args.ops.split(",")
+
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ""
+    report = {
+        "benchmark": "collectives",
+        "commit": commit,
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "transport": None if args.local else TRANSPORT,
+        "results": run(args.ranks, sizes, ops, args.local),
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
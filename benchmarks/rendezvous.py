@@ -0,0 +1,272 @@
+"""
+Pairings per second and pairing latency of the rendezvous server under load.
+
+Starts ``server.py`` and load-generating processes on loopback, each running
+many client pairs at once through the same handshake as ``mead.Client``, and
+writes the results as JSON::
+
+    python benchmarks/rendezvous.py --pairs 20000 --output rendezvous.json
+    python benchmarks/rendezvous.py --half-open 200000 --max-entries 50000
+
+With ``--half-open``, that many clients which never find a partner are left
+on the server first, to show that its memory stays bounded and that pairing
+is no slower for them.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import selectors
+import subprocess
+import multiprocessing as mp
+from typing import Any, Dict, List, Tuple, Optional
+
+from mead.utils import bytes2addr
+
+from transport import ROOT, free_port, percentile
+
+# Pairs each load-generating process keeps in progress at once.
+CONCURRENCY = 256
+
+# Seconds after which a pair which has not been introduced counts as failed.
+TIMEOUT = 5.0
+
+# Half-open clients sent per socket, since each may request one channel after
+# another.
+HALF_OPEN_PER_SOCKET = 1000
+
+
+class _Pair:
+    """ Two clients asking for the same channel, and when they started. """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.start = time.perf_counter()
+        self.socks = [_client_socket(), _client_socket()]
+        self.ports = [sock.getsockname()[1] for sock in self.socks]
+        self.done = [False, False]
+        self.confirmed = [False, False]
+
+
+def _client_socket() -> socket.socket:
+    """ Returns a non-blocking UDP socket on loopback. """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.setblocking(False)
+    return sock
+
+
+def generate(
+    port: int, pairs: int, concurrency: int, prefix: str
+) -> Tuple[List[float], int]:
+    """
+    Runs ``pairs`` pairings, ``concurrency`` at a time, returning the seconds
+    each completed one took and the number which failed.
+    """
+    server = ("127.0.0.1", port)
+    selector = selectors.DefaultSelector()
+    todo = pairs
+    active: Dict[str, _Pair] = {}
+    seconds: List[float] = []
+    failed = 0
+
+    def finish(pair: _Pair) -> None:
+        """ Closes the sockets of a pair. """
+        for sock in pair.socks:
+            selector.unregister(sock)
+            sock.close()
+
+    while todo or active:
+        while todo and len(active) < concurrency:
+            pair = _Pair("%s-%d" % (prefix, todo))
+            todo -= 1
+            for side, sock in enumerate(pair.socks):
+                selector.register(sock, selectors.EVENT_READ, (pair, side))
+                sock.sendto(("%s 0" % pair.channel).encode("ascii"), server)
+            active[pair.channel] = pair
+
+        for key, _ in selector.select(0.1):
+            pair, side = key.data
+            sock = pair.socks[side]
+            try:
+                data = sock.recv(64)
+            except BlockingIOError:
+                continue
+            if not pair.confirmed[side]:
+                assert data == ("ok %s" % pair.channel).encode("ascii")
+                pair.confirmed[side] = True
+                sock.sendto(b"ok", server)
+                continue
+
+            # Each client must be told the address of the other.
+            (_, peer_port), _ = bytes2addr(data)
+            assert peer_port == pair.ports[1 - side]
+            pair.done[side] = True
+            if all(pair.done):
+                seconds.append(time.perf_counter() - pair.start)
+                finish(active.pop(pair.channel))
+
+        # Pairs start in order, so late ones are found from the front.
+        now = time.perf_counter()
+        while active and now - next(iter(active.values())).start > TIMEOUT:
+            finish(active.pop(next(iter(active))))
+            failed += 1
+    return seconds, failed
+
+
+def _generate(
+    port: int, pairs: int, concurrency: int, prefix: str, results: Any
+) -> None:
+    """ Runs ``generate()`` in a child process, and reports back. """
+    results.put(generate(port, pairs, concurrency, prefix))
+
+
+def half_open(port: int, count: int) -> None:
+    """
+    Leaves ``count`` clients waiting on channels no partner asks for, from
+    a few sockets each requesting one channel after another.
+    """
+    server = ("127.0.0.1", port)
+    sent = 0
+    while sent < count:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(1.0)
+            for _ in range(min(HALF_OPEN_PER_SOCKET, count - sent)):
+                channel = "half-open-%d" % sent
+                sock.sendto(("%s 0" % channel).encode("ascii"), server)
+                sock.recv(64)
+                sock.sendto(b"ok", server)
+                sent += 1
+
+
+def server_stats(port: int) -> Dict[str, int]:
+    """ Returns the counters of the server. """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(1.0)
+        sock.sendto(b"STATS", ("127.0.0.1", port))
+        stats: Dict[str, int] = json.loads(sock.recv(4096))
+        return stats
+
+
+def rss_kb(pid: int) -> Optional[int]:
+    """ Returns the resident memory of a process, where ``/proc`` has it. """
+    try:
+        with open("/proc/%d/status" % pid) as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def run(
+    pairs: int, processes: int, concurrency: int, half: int, max_entries: int
+) -> Dict[str, Any]:
+    """ Runs the load against a fresh server and returns the result. """
+    port = free_port()
+    command = [sys.executable, "-u", os.path.join(ROOT, "server.py"), str(port)]
+    server = subprocess.Popen(
+        command + ["--max-entries", str(max_entries)],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    assert server.stdout is not None
+    server.stdout.readline()
+
+    try:
+        idle_kb = rss_kb(server.pid)
+        start = time.perf_counter()
+        half_open(port, half)
+        half_open_seconds = time.perf_counter() - start
+        loaded_kb = rss_kb(server.pid)
+
+        results: Any = mp.Queue()
+        shares = [
+            pairs // processes + (i < pairs % processes) for i in range(processes)
+        ]
+        children = [
+            mp.Process(
+                target=_generate, args=(port, share, concurrency, "p%d" % i, results)
+            )
+            for i, share in enumerate(shares)
+        ]
+        start = time.perf_counter()
+        for child in children:
+            child.start()
+        seconds: List[float] = []
+        failed = 0
+        for _ in children:
+            each, lost = results.get()
+            seconds.extend(each)
+            failed += lost
+        elapsed = time.perf_counter() - start
+        for child in children:
+            child.join()
+        stats = server_stats(port)
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        "pairs": pairs,
+        "processes": processes,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "pairs_per_s": len(seconds) / elapsed,
+        "failed": failed,
+        "p50_ms": percentile(seconds, 50) * 1e3 if seconds else None,
+        "p99_ms": percentile(seconds, 99) * 1e3 if seconds else None,
+        "half_open": half,
+        "half_open_per_s": half / half_open_seconds if half else None,
+        "max_entries": max_entries,
+        "server_rss_kb": {"idle": idle_kb, "half_open": loaded_kb},
+        "server": stats,
+    }
+
+
+def main() -> None:
+    """ Parses arguments, runs the benchmark and writes the JSON report. """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--pairs", type=int, default=20000)
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--half-open", type=int, default=0)
+    parser.add_argument("--max-entries", type=int, default=100000)
+    parser.add_argument("--output", default="-")
+    args = parser.parse_args()
+
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ""
+    report = {
+        "benchmark": "rendezvous",
+        "commit": commit,
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": run(
+            args.pairs,
+            args.processes,
+            args.concurrency,
+            args.half_open,
+            args.max_entries,
+        ),
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
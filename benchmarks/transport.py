@@ -0,0 +1,244 @@
+"""
+Round-trip latency and one-way throughput of the UDP transport on loopback.
+
+Starts ``server.py``, a local ``meadclient`` and the head side, then sweeps a
+range of payload types and sizes, and writes the results as JSON::
+
+    python benchmarks/transport.py --output transport.json
+    python benchmarks/transport.py --types bytes --max-size 1048576
+    python benchmarks/transport.py --transport '{"reliable": true}'
+"""
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+from typing import Any, Dict, List
+
+import mead
+from mead import cellar
+from mead.serialization import dumps
+from mead.initialization import start_clients, stop_clients
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Payload sizes in bytes, from 8 B to 64 MB.
+SIZES = [8 * 8 ** i for i in range(8)] + [64 * 2 ** 20]
+TYPES = ("ints", "bytes", "numpy", "dicts")
+
+# The worker's channel, which must not resolve to this machine, or the
+# process would take the shared-memory path instead of the network.
+CHANNEL = "mead-benchmark"
+
+# The engine and reliable delivery, since large messages over an unreliable
+# link would mostly measure loss. The worker skips STUN on loopback.
+TRANSPORT = {"engine": True, "reliable": True, "stun": False}
+
+# Messages per measurement: enough to move ``BUDGET`` bytes, within bounds.
+BUDGET = 64 * 2 ** 20
+MIN_COUNT = 3
+MAX_COUNT = 1000
+
+
+def worker(spout: mead.Spout, funnel: mead.Funnel) -> None:
+    """ Echoes or swallows messages from the head, as told. """
+    while True:
+        command = spout.recv()
+        if command is None:
+            return
+        mode, count = command
+        for _ in range(count):
+            message = spout.recv()
+            if mode == "echo":
+                funnel.send(message)
+        if mode == "sink":
+            funnel.send(count)
+
+
+def payload(kind: str, size: int) -> Any:
+    """ Returns an object of roughly ``size`` bytes of the given kind. """
+    if kind == "ints":
+        return list(range(size // 8)) if size > 8 else 2 ** 62
+    if kind == "bytes":
+        return os.urandom(size)
+    if kind == "numpy":
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        return np.random.default_rng(0).random(max(size // 8, 1))
+
+    # Nested dictionaries of 8 records of about 64 bytes each.
+    groups = max(size // 512, 1)
+    record = {"id": 0, "tag": "x" * 32, "values": [1.0, 2.0]}
+    return {
+        "group%d" % g: {"item%d" % i: dict(record, id=i) for i in range(8)}
+        for g in range(groups)
+    }
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """ Returns the ``q``-th percentile of ``samples`` by nearest rank. """
+    ordered = sorted(samples)
+    return ordered[min(int(q / 100 * len(ordered)), len(ordered) - 1)]
+
+
+def latency(
+    funnel: mead.Funnel, spout: mead.Spout, obj: Any, count: int
+) -> Dict[str, float]:
+    """ Measures round trips of ``obj`` through the worker. """
+    funnel.send(("echo", count))
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        funnel.send(obj)
+        spout.recv()
+        samples.append(time.perf_counter() - start)
+    return {
+        "count": count,
+        "p50_us": percentile(samples, 50) * 1e6,
+        "p99_us": percentile(samples, 99) * 1e6,
+        "mean_us": sum(samples) / count * 1e6,
+    }
+
+
+def throughput(
+    funnel: mead.Funnel, spout: mead.Spout, obj: Any, count: int, size: int
+) -> Dict[str, float]:
+    """ Measures sending ``obj`` to the worker back to back. """
+    funnel.send(("sink", count))
+    start = time.perf_counter()
+    for _ in range(count):
+        funnel.send(obj)
+    spout.recv()
+    seconds = time.perf_counter() - start
+    return {
+        "count": count,
+        "seconds": seconds,
+        "messages_per_s": count / seconds,
+        "mb_per_s": count * size / seconds / 1e6,
+    }
+
+
+def free_port() -> int:
+    """ Returns a UDP port that is free right now. """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+    return port
+
+
+def launch(transport: Dict[str, Any]) -> List[subprocess.Popen]:
+    """ Starts the rendezvous server, the worker and the head side. """
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-u", os.path.join(ROOT, "server.py"), str(port)],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    assert server.stdout is not None
+    server.stdout.readline()
+
+    # The worker logs to its working directory, so keep that out of the tree.
+    options = base64.urlsafe_b64encode(json.dumps(transport).encode()).decode()
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([ROOT, env.get("PYTHONPATH", "")])
+    meadclient = os.path.join(ROOT, "bin", "meadclient")
+    client = subprocess.Popen(
+        [sys.executable, meadclient, "127.0.0.1", str(port), CHANNEL, options],
+        cwd=tempfile.gettempdir(),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    cellar.HOSTNAMES = [CHANNEL]
+    start_clients("127.0.0.1", port, [CHANNEL], transport)
+    return [server, client]
+
+
+def run(
+    sizes: List[int], types: List[str], transport: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """ Runs the sweep against a fresh worker and returns one result per case. """
+    children = launch(transport)
+    to_worker, worker_spout = mead.Pipe()
+    worker_funnel, from_worker = mead.Pipe()
+    process = mead.Process(
+        target=worker, hostname=CHANNEL, args=(worker_spout, worker_funnel)
+    )
+    process.start()
+
+    results: List[Dict[str, Any]] = []
+    cases = [(kind, size) for kind in types for size in sizes]
+    try:
+        for kind, size in cases:
+            obj = payload(kind, size)
+            count = max(MIN_COUNT, min(MAX_COUNT, BUDGET // size))
+            print("%s %d B x %d" % (kind, size, count), file=sys.stderr)
+
+            # Warm up the pipes and the congestion window first.
+            latency(to_worker, from_worker, obj, 1)
+            results.append(
+                {
+                    "type": kind,
+                    "size": size,
+                    "wire_bytes": sum(memoryview(s).nbytes for s in dumps(obj)),
+                    "latency": latency(to_worker, from_worker, obj, count),
+                    "throughput": throughput(to_worker, from_worker, obj, count, size),
+                }
+            )
+        to_worker.send(None)
+        process.join()
+    finally:
+        stop_clients()
+        for child in children:
+            child.terminate()
+            child.wait()
+    return results
+
+
+def main() -> None:
+    """ Parses arguments, runs the benchmark and writes the JSON report. """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", default=",".join(str(size) for size in SIZES))
+    parser.add_argument("--max-size", type=int, default=max(SIZES))
+    parser.add_argument("--types", default=",".join(TYPES))
+    parser.add_argument("--transport", default=json.dumps(TRANSPORT))
+    parser.add_argument("--output", default="-")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    sizes = [size for size in sizes if size <= args.max_size]
+    types = args.types.split(",")
+    transport = json.loads(args.transport)
+
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ""
+    report = {
+        "benchmark": "transport",
+        "commit": commit,
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "transport": transport,
+        "results": run(sizes, types, transport),
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
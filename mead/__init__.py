@@ -2,4 +2,8 @@
 from mead.remote import remote
 from mead.classes import Pipe, Spout, Funnel, Parcel
 from mead.process import Process
-from mead.initialization import init, kill
+from mead.executor import Executor, as_completed
+from mead.collectives import Comm, Group
+from mead.metrics import stats, dump_stats
+from mead.initialization import init, kill, peer_stats, init_timings
+from mead.serialization import Codec, register_codec
@@ -1,6 +1,6 @@
 """ Storage for ``mead``. """
 import multiprocessing as mp
-from typing import Set, Dict, List
+from typing import Any, Set, Dict, List, Tuple
 from multiprocessing.connection import Connection
 
 from pssh.clients import ParallelSSHClient
@@ -10,11 +10,28 @@ from pssh.clients import ParallelSSHClient
 # ``mead.Process``.
 
 PIPE_COUNTER = 0
+PROCESS_COUNTER = 0
 HOSTNAMES: List[str] = []
 SSHCLIENT: ParallelSSHClient
 USED_PIPE_IDS: Set[str] = set()
+NO_COALESCE: Set[str] = set()
 HEAD_QUEUES: Dict[str, mp.Queue] = {}
 HEAD_SPOUTS: Dict[str, Connection] = {}
 HEAD_PROCESSES: Dict[str, mp.Process] = {}
+HEAD_CLIENTS: Dict[str, Any] = {}
+SERVER: Tuple[str, int] = ("", 0)
+FUNNEL_HOSTS: Dict[str, str] = {}
+SPOUT_HOSTS: Dict[str, str] = {}
+ENGINE: Any = None
+SERIALIZE_ONCE = False
 INTERNAL_FUNNELS: Dict[str, Connection] = {}
 INTERNAL_SPOUTS: Dict[str, Connection] = {}
+FUNNELS: Dict[str, Any] = {}
+SPOUTS: Dict[str, Any] = {}
+RINGS: Dict[str, Any] = {}
+REMOTE_PIPES: Set[str] = set()
+STUN_CACHE: Dict[int, Tuple[float, str, int]] = {}
+TIMINGS: Dict[str, float] = {}
+PIPE_METRICS: Dict[str, List[Any]] = {}
+REMOTE_STATS: Dict[str, Dict[str, Any]] = {}
+STATS_QUEUE: Any = None
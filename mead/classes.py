@@ -1,10 +1,24 @@
 """ Classes for node-to-node communication over UDP. """
-import logging
+import time
+import pickle
 import multiprocessing as mp
-from typing import Any, Dict, Tuple, Union, Callable, Optional
+from typing import Any, Set, Dict, Tuple, Union, Callable, Optional
 from multiprocessing.connection import Connection
+from multiprocessing.reduction import ForkingPickler
 
 from mead import cellar
+from mead.shm import SharedRing
+from mead.metrics import (
+    SENT,
+    RECEIVED,
+    SERIALIZE,
+    SENT_BYTES,
+    DESERIALIZE,
+    RECEIVED_BYTES,
+    register,
+)
+from mead.tracing import TRACER
+from mead.serialization import dumps, loads
 
 # pylint: disable=too-few-public-methods
 
@@ -15,8 +29,9 @@ class _Spout:
 
 
 class _Funnel:
-    def __init__(self, pipe_id: str):
+    def __init__(self, pipe_id: str, codec: Optional[int] = None):
         self.pipe_id = pipe_id
+        self.codec = codec
 
 
 class _Process:
@@ -26,27 +41,63 @@ class _Process:
         hostname: str,
         args: Tuple[Any, ...],
         kwargs: Dict[str, Any],
+        codecs: Optional[Dict[int, Any]] = None,
+        no_coalesce: Optional[Set[str]] = None,
+        process_id: str = "",
     ):
+        self.process_id: str = process_id
         self.hostname: str = hostname
         self.target: Callable[..., Any] = target
         self.args: Tuple[Any, ...] = args
         self.kwargs: Dict[str, Any] = kwargs
+        self.codecs: Dict[int, Any] = codecs if codecs else {}
+        self.no_coalesce: Set[str] = no_coalesce if no_coalesce else set()
 
 
 class _Join:
-    def __init__(self, hostname: str, timeout: Optional[Union[float, int]]):
+    def __init__(
+        self, hostname: str, timeout: Optional[Union[float, int]], process_id: str = "",
+    ):
         self.hostname = hostname
         self.timeout = timeout
+        self.process_id = process_id
 
 
 class _Terminate:
-    def __init__(self, hostname: str):
+    def __init__(self, hostname: str, process_id: str = ""):
         self.hostname = hostname
+        self.process_id = process_id
 
 
 class _Kill:
-    def __init__(self, hostname: str):
+    def __init__(self, hostname: str, process_id: str = ""):
+        self.hostname = hostname
+        self.process_id = process_id
+
+
+class _Stats:
+    def __init__(self, hostname: str, stats: Dict[str, Any]):
         self.hostname = hostname
+        self.stats = stats
+
+
+class _Route:
+    def __init__(self, pipe_id: str, link: str, server: Tuple[str, int], sender: bool):
+        self.pipe_id = pipe_id
+        self.link = link
+        self.server = server
+        self.sender = sender
+
+
+class _Handover:
+    def __init__(self, pipe_id: str, link: str):
+        self.pipe_id = pipe_id
+        self.link = link
+
+
+class _Immediate:
+    def __init__(self, parcel: "Parcel"):
+        self.parcel = parcel
 
 
 class Parcel:
@@ -60,42 +111,118 @@ class Parcel:
 class Funnel:
     """ TODO. """
 
-    def __init__(self, pipe_id: str, _funnel: Connection):
+    def __init__(
+        self,
+        pipe_id: str,
+        _funnel: Union[Connection, SharedRing],
+        codec: Optional[int] = None,
+    ):
         self.pipe_id = pipe_id
         self._funnel = _funnel
+        self.codec = codec
+        self.metrics = register(pipe_id)
+
+    @property
+    def connection(self) -> Union[Connection, SharedRing]:
+        """ The pipe end or shared-memory ring which messages are written to. """
+        return self._funnel
+
+    @connection.setter
+    def connection(self, connection: Union[Connection, SharedRing]) -> None:
+        self._funnel = connection
+
+    def close_connection(self) -> None:
+        """
+        Closes this process's copy of a ``multiprocessing`` pipe end, e.g. once
+        a child holds its own. Shared-memory rings are left alone.
+        """
+        if isinstance(self._funnel, Connection):
+            self._funnel.close()
 
     def send(self, data: Any) -> None:
         """ Send data (presumably to a remote node). """
         assert not isinstance(data, Parcel)
-        logging.info("FUNNEL: data: %s", str(data))
-        logging.info("FUNNEL: pipe id: %s", self.pipe_id)
-        self._funnel.send(data)
+
+        # This is the only serialization; the engine forwards the bytes as is.
+        # Otherwise this pickles as ``Connection.send()`` would.
+        start = time.perf_counter()
+        payload: Union[bytes, memoryview]
+        if cellar.SERIALIZE_ONCE:
+            payload = b"".join(dumps(data, self.codec))
+        else:
+            payload = ForkingPickler.dumps(data)
+        values = self.metrics.values
+        values[SERIALIZE] += time.perf_counter() - start
+        self._funnel.send_bytes(payload)
+        values[SENT] += 1
+        values[SENT_BYTES] += len(payload)
+        if TRACER.active:
+            TRACER.record("funnel.send", self.pipe_id, len(payload))
 
 
 class Spout:
     """ TODO. """
 
-    def __init__(self, pipe_id: str, _spout: Connection):
+    def __init__(self, pipe_id: str, _spout: Union[Connection, SharedRing]):
         self.pipe_id = pipe_id
         self._spout = _spout
+        self.metrics = register(pipe_id)
+
+    @property
+    def connection(self) -> Union[Connection, SharedRing]:
+        """ The pipe end or shared-memory ring which messages are read from. """
+        return self._spout
+
+    @connection.setter
+    def connection(self, connection: Union[Connection, SharedRing]) -> None:
+        self._spout = connection
+
+    def close_connection(self) -> None:
+        """
+        Closes this process's copy of a ``multiprocessing`` pipe end, e.g. once
+        a child holds its own. Shared-memory rings are left alone.
+        """
+        if isinstance(self._spout, Connection):
+            self._spout.close()
+
+    def poll(self, timeout: Optional[float] = 0.0) -> bool:
+        """ Returns whether a message can be read, waiting up to ``timeout``. """
+        return self._spout.poll(timeout)
 
     def recv(self) -> Any:
         """ Receive data (presumably from a remote node). """
-        logging.info("SPOUT: waiting.")
-        data = self._spout.recv()
-        logging.info("SPOUT: data: %s", str(data))
+        payload = self._spout.recv_bytes()
+        if TRACER.active:
+            TRACER.record("spout.recv", self.pipe_id, len(payload))
+        start = time.perf_counter()
+        if cellar.SERIALIZE_ONCE:
+            data = loads(payload)
+        else:
+            data = pickle.loads(payload)
+        values = self.metrics.values
+        values[DESERIALIZE] += time.perf_counter() - start
+        values[RECEIVED] += 1
+        values[RECEIVED_BYTES] += len(payload)
         assert not isinstance(data, Parcel)
         return data
 
 
 # pylint: disable=invalid-name
-def Pipe() -> Tuple[Funnel, Spout]:
-    """ Creates a ``mead.Pipe`` pair. """
+def Pipe(codec: Optional[int] = None, coalesce: bool = True) -> Tuple[Funnel, Spout]:
+    """
+    Creates a ``mead.Pipe`` pair. With the ``serialize_once`` transport
+    option, the funnel serializes with the codec registered as ``codec`` by
+    ``mead.register_codec()`` instead of pickle. With the ``coalesce``
+    transport option, pass ``coalesce=False`` for latency-sensitive pipes
+    whose messages should never wait to share a datagram.
+    """
 
     # Get a unique pipe id.
     pipe_id = str(cellar.PIPE_COUNTER)
     cellar.USED_PIPE_IDS.add(pipe_id)
     cellar.PIPE_COUNTER += 1
+    if not coalesce:
+        cellar.NO_COALESCE.add(pipe_id)
 
     # Create internal multiprocessing pipe.
     _funnel, _spout = mp.Pipe()
@@ -103,7 +230,9 @@ def Pipe() -> Tuple[Funnel, Spout]:
     cellar.INTERNAL_SPOUTS[pipe_id] = _spout
 
     # Create mead funnel and spout.
-    funnel = Funnel(pipe_id, _funnel)
+    funnel = Funnel(pipe_id, _funnel, codec)
     spout = Spout(pipe_id, _spout)
+    cellar.FUNNELS[pipe_id] = funnel
+    cellar.SPOUTS[pipe_id] = spout
 
     return funnel, spout
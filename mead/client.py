@@ -2,15 +2,80 @@
 # coding:utf-8
 """ Start a UDP NAT traversal client. """
 import sys
+import math
 import time
 import socket
 import logging
 import multiprocessing as mp
-from typing import Tuple, Callable
-from threading import Thread
+from queue import Empty, Queue
+from typing import Any, Dict, List, Tuple, Deque, Callable, Optional
+from threading import Thread, Condition
+from collections import deque
 from multiprocessing.connection import Connection
 
-from mead.utils import bytes2addr, get_length_message_pair
+from mead.mux import ADDRESS_SIZE, Mux
+from mead.utils import bytes2addr
+from mead.serialization import dumps, codec_of
+from mead.classes import Parcel, _Immediate
+from mead.framing import (
+    ACK,
+    DATA,
+    BATCH,
+    CONTROL,
+    REFRESH,
+    CONFIRM,
+    NO_PIPE,
+    RELIABLE,
+    MAX_DATAGRAM,
+    CHUNK_SIZE,
+    HEADER,
+    ENTRY,
+    Buffer,
+    Header,
+    Reassembler,
+    batch,
+    unbatch,
+    fragment,
+    pack_header,
+    unpack_header,
+)
+from mead.congestion import Aimd, TokenBucket, pacing_rate
+from mead.compression import THRESHOLD, MAX_RATIO, Compressor
+from mead.ring import ReceiveRing, count_overflows
+from mead.metrics import (
+    DROPS,
+    BACKLOG,
+    BYTES_IN,
+    ABANDONED,
+    BYTES_OUT,
+    MESSAGES_IN,
+    RETRANSMITS,
+    DATAGRAMS_IN,
+    MESSAGES_OUT,
+    SOCKET_DROPS,
+    DATAGRAMS_OUT,
+    PICKLE_SECONDS,
+    LinkMetrics,
+)
+from mead.tracing import TRACER
+from mead.keepalive import (
+    STATS,
+    MIN_INTERVAL,
+    MAX_INTERVAL,
+    KEEPALIVE_INTERVAL,
+    PeerMonitor,
+)
+from mead.reliability import (
+    RTO,
+    MIN_RTO,
+    MAX_RTO,
+    WINDOW,
+    ACK_PAYLOAD,
+    seq_diff,
+    SendWindow,
+    RttEstimator,
+    ReceiveWindow,
+)
 
 # pylint: disable=invalid-name
 
@@ -21,6 +86,14 @@ SymmetricNAT = "Symmetric NAT"  # 3
 UnknownNAT = "Unknown NAT"  # 4
 NATTYPE = (FullCone, RestrictNAT, RestrictPortNAT, SymmetricNAT, UnknownNAT)
 
+# Objects taken off ``outq`` per wakeup, so that they can be coalesced.
+DRAIN = 64
+
+# Handshake probes are resent at this interval in seconds, doubling up to the
+# maximum until the peer answers, however long it takes to come up.
+PROBE_INTERVAL = 0.01
+MAX_PROBE_INTERVAL = 0.5
+
 
 class Client:
     """
@@ -35,10 +108,25 @@ class Client:
     channel : ``str``.
         A UUID for communication between two clients on a server. This will
         typically just be the hostname of the worker node.
-    in_funnel : ``Connection``.
-        Injects received data INTO another running process.
-    outq : ``mp.Queue``.
-        Broadcasts data sent from a running process to some remote node.
+    in_funnel : ``Optional[Connection]``.
+        Injects received data INTO another running process. Only used by
+        ``main()``, not when the client is driven by an ``Engine``.
+    outq : ``Optional[mp.Queue]``.
+        Broadcasts data sent from a running process to some remote node. Only
+        used by ``main()``, not when the client is driven by an ``Engine``.
+    options : ``Optional[Dict[str, Any]]``.
+        The ``transport`` section of the ``init()`` config. Recognized keys are
+        ``reliable`` (enable acknowledgement and retransmission), ``window``
+        (packets in flight), ``rto``, ``min_rto``, ``max_rto`` (seconds),
+        ``congestion`` (enable congestion control on reliable links),
+        ``max_rate`` (pacing ceiling in bytes per second), ``compression``
+        (``"zlib"`` or ``"lzma"``), ``compression_level``,
+        ``compression_threshold`` (bytes), ``compression_thresholds``
+        (per-pipe thresholds), ``compression_max_ratio`` and ``coalesce``
+        (pack small messages queued together into shared datagrams).
+    mux : ``Optional[Mux]``.
+        A socket shared with other clients, to use instead of one of its own.
+        Only for clients driven by an ``Engine``.
     """
 
     def __init__(
@@ -46,44 +134,131 @@ class Client:
         server_ip: str,
         port: int,
         channel: str,
-        in_funnel: Connection,
-        outq: mp.Queue,
+        in_funnel: Optional[Connection] = None,
+        outq: Optional[mp.Queue] = None,
+        options: Optional[Dict[str, Any]] = None,
+        mux: Optional[Mux] = None,
     ) -> None:
         self.master = (server_ip, port)
         self.channel = channel
-        self.sockfd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        # On a shared socket, the engine passes the handshake its datagrams.
+        self.mux = mux
+        self.inbox: "Queue[Tuple[bytes, Tuple[str, int]]]" = Queue()
+        if mux is not None:
+            self.sockfd = mux.sock
+            mux.add(self)
+        else:
+            self.sockfd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            count_overflows(self.sockfd)
+
+        # Datagrams the peer sent before our handshake was done, which are
+        # handled once the receive path starts.
+        self.early: List[bytes] = []
 
         # If testing with server and both clients on localhost, use ``127.0.0.1``.
         self.target: Tuple[str, int] = ("", 0)
         self.peer_nat_type = ""
 
+        # Seconds from the start of ``connect()`` to the end of the handshake.
+        self.connect_seconds = 0.0
+
         self.in_funnel = in_funnel
         self.outq = outq
 
+        # Messages are split into MTU-sized chunks tagged with a sequence number.
+        self.seq = 0
+        self.reassembler = Reassembler()
+
+        # Chunks waiting to be sent, oldest first.
+        self.backlog: Deque[Tuple[Header, List[memoryview]]] = deque()
+
+        # Optional acknowledgement, retransmission and reordering.
+        options = options if options else {}
+        window = options.get("window", WINDOW)
+        self.reliable: bool = options.get("reliable", False)
+        self.send_window = SendWindow(window)
+        self.recv_window = ReceiveWindow(window)
+        self.rtt = RttEstimator(
+            options.get("rto", RTO),
+            options.get("min_rto", MIN_RTO),
+            options.get("max_rto", MAX_RTO),
+        )
+
+        # Congestion window and pacing. The gauges are shared memory, so they
+        # can be read from the parent process while ``main()`` runs in a child.
+        self.congestion_control: bool = options.get("congestion", True)
+        self.max_rate: float = options.get("max_rate", math.inf)
+        self.congestion = Aimd(max_cwnd=window)
+        self.pacer = TokenBucket(self.max_rate)
+        self.cwnd_gauge = mp.Value("d", self.congestion.cwnd, lock=False)
+        self.rate_gauge = mp.Value("d", self.pacer.rate, lock=False)
+
+        # Adaptive compression, applied per pipe.
+        thresholds = options.get("compression_thresholds", {})
+        self.compressor = Compressor(
+            options.get("compression", ""),
+            options.get("compression_level", -1),
+            options.get("compression_threshold", THRESHOLD),
+            {int(pipe_id): n for pipe_id, n in thresholds.items()},
+            options.get("compression_max_ratio", MAX_RATIO),
+        )
+
+        # Keepalives and path estimates, with gauges readable from the parent.
+        self.monitor = PeerMonitor(
+            options.get("keepalive_interval", KEEPALIVE_INTERVAL),
+            options.get("keepalive_min_interval", MIN_INTERVAL),
+            options.get("keepalive_max_interval", MAX_INTERVAL),
+        )
+        self.peer_gauge = mp.Array("d", self.monitor.stats(), lock=False)
+
+        # Traffic counters for ``mead.stats()``, also in shared memory.
+        self.metrics = LinkMetrics()
+
+        # Small messages held back to share a datagram. The batch is closed
+        # once nothing more is queued, so it never waits on a timer.
+        self.coalesce: bool = options.get("coalesce", False)
+        self.batch: List[Tuple[int, int, List[Buffer], int, int]] = []
+        self.batch_size = 0
+
+        # Guards all of the above, shared by the send, recv and timer threads.
+        self.cond = Condition()
+
     def request_for_connection(self, nat_type_id: str = "0") -> None:
         """ Send a request to the server for a connection. """
         # Create a socket.
-        self.sockfd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.mux is None:
+            self.sockfd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            count_overflows(self.sockfd)
 
         # Send channel and NAT type to server, requesting a connection.
         msg = (self.channel + " %s" % nat_type_id).encode("ascii")
         self.sockfd.sendto(msg, self.master)
 
         # Wait for ``ok``, acknowledgement of request.
-        data, _ = self.sockfd.recvfrom(len(self.channel) + 3)
+        data, _ = self.receive(None, len(self.channel) + 3)
         if data.decode("ascii") != "ok " + self.channel:
             print("unable to request!")
             sys.exit(1)
 
-        # Confirm we've received the ``ok``, tell server to connect us to channel.
-        self.sockfd.sendto("ok".encode("ascii"), self.master)
+        # Confirm we've received the ``ok``, tell server to connect us to
+        # channel. Clients sharing a socket share an address, so they name
+        # the channel, and the server names it back in its answer.
+        tag = b"" if self.mux is None else self.channel.encode("ascii")
+        self.sockfd.sendto(b" ".join([b"ok", tag]).strip(), self.master)
 
-        # Wait for a partner.
+        # Wait for a partner. It may start probing us before the server's
+        # answer arrives, so anything from elsewhere is skipped.
         print("request sent, waiting for partner in channel '%s'..." % self.channel)
-        data, _ = self.sockfd.recvfrom(8)
+        server = (socket.gethostbyname(self.master[0]), self.master[1])
+        data, source = self.receive(None, ADDRESS_SIZE + len(tag))
+        while source != server or data[ADDRESS_SIZE:] != tag:
+            data, source = self.receive(None, ADDRESS_SIZE + len(tag))
 
         # Decode the partner's address and NAT type.
-        self.target, peer_nat_type_id = bytes2addr(data)
+        self.target, peer_nat_type_id = bytes2addr(data[:ADDRESS_SIZE])
+        if self.mux is not None:
+            self.mux.expect(self)
         print((self.target, peer_nat_type_id))
         self.peer_nat_type = NATTYPE[peer_nat_type_id]
 
@@ -93,82 +268,494 @@ class Client:
 
     def recvloop(self, sock: socket.socket) -> None:
         """ Receive message callback. """
+        # Datagrams are drained in batches into preallocated slots.
+        assert self.in_funnel is not None
+        with self.cond:
+            early = self.on_early(sock, time.monotonic())
+        for _, message in early:
+            self.in_funnel.send_bytes(message)
+        ring = ReceiveRing()
         while True:
-            # Receive 16 bytes (size of length prefix).
-            bdata, addr = sock.recvfrom(16)
-            data = bdata.decode("ascii")
-            logging.info("%s: %s", self.channel, data)
-
-            # If the data is from a valid sender.
-            if addr in (self.target, self.master):
-
-                # Handle timeout refresh tokens.
-                if data == "refresh":
-                    sock.sendto("confirm".encode(), self.target)
-                if data == "confirm":
-                    continue
-
-                # Parse the message length bytes.
-                if not data.isnumeric():
-                    continue
-                length = int(data)
-
-                logging.info("%s: length: %d", self.channel, length)
-
-                # Receive the object.
-                bdata, addr = sock.recvfrom(length)
-
-                # Abort if the sender changed.
-                if addr not in (self.target, self.master):
-                    logging.info("%s: sender address changed.", self.channel)
-                    continue
-
-                self.in_funnel.send(bdata)
+            dropped = ring.dropped
+            received = ring.drain(sock, block=True)
+            self.count_drops(ring.dropped - dropped, ring.overflows.get(sock.fileno()))
+
+            # Handle the whole batch under one acquisition of the lock.
+            messages: List[Tuple[Header, Buffer]] = []
+            with self.cond:
+                now = time.monotonic()
+                for datagram, addr in received:
+
+                    # Ignore datagrams from anyone but the peer and the server.
+                    if addr not in (self.target, self.master):
+                        logging.info("%s: datagram from unknown sender.", self.channel)
+                        self.count_drops(1, None)
+                        continue
+                    messages.extend(self.on_datagram(sock, datagram, now))
+                self.cond.notify_all()
+
+            # Deliver outside the lock, since the funnel may block.
+            for _, message in messages:
+                self.in_funnel.send_bytes(message)
 
     def sendloop(self, sock: socket.socket) -> None:
         """ Send message callback. """
+        assert self.outq is not None
         while True:
-            obj = self.outq.get()
-
-            # Serialize in bytes as a length-message pair.
-            pair: bytes = get_length_message_pair(obj)
 
-            logging.info("%s: sending pair: %s", self.channel, str(obj))
-
-            # Send to target client.
-            sock.sendto(pair[:16], self.target)
-            sock.sendto(pair[16:], self.target)
+            # Wait for an object, then take whatever else is already queued.
+            objs = [self.outq.get()]
+            try:
+                while len(objs) < DRAIN:
+                    objs.append(self.outq.get_nowait())
+            except Empty:
+                pass
+
+            # Wait for window space and pacing until the whole message is out.
+            with self.cond:
+                for obj in objs:
+                    if isinstance(obj, _Immediate):
+                        self.submit(obj.parcel, coalesce=False)
+                    else:
+                        self.submit(obj)
+                retry = self.flush(sock, time.monotonic())
+                while self.backlog:
+                    self.cond.notify_all()
+                    timeout = None if retry is None else retry - time.monotonic()
+                    self.cond.wait(timeout)
+                    retry = self.flush(sock, time.monotonic())
+                self.cond.notify_all()
+
+    def timerloop(self, sock: socket.socket) -> None:
+        """ Retransmission and delayed-ack timer callback. """
+        with self.cond:
+            while True:
+                deadline = self.on_timer(sock, time.monotonic())
+                timeout = None if deadline is None else deadline - time.monotonic()
+                self.cond.wait(timeout)
+
+    def submit(self, obj: Any, coalesce: bool = True) -> None:
+        """
+        Serializes an object and queues it for sending. Parcels may be
+        coalesced with other small messages unless ``coalesce`` is false.
+        """
+        # Parcels are tagged with their pipe id, everything else is control.
+        if isinstance(obj, Parcel):
+            msg_type, pipe_id = DATA, int(obj.pipe_id)
+        else:
+            msg_type, pipe_id = CONTROL, NO_PIPE
+        start = time.perf_counter()
+        segments = dumps(obj)
+        self.metrics.values[PICKLE_SECONDS] += time.perf_counter() - start
+        codec = codec_of(segments[0])
+        coalesce = coalesce and msg_type == DATA
+        self.queue(msg_type, pipe_id, segments, codec=codec, coalesce=coalesce)
+
+    def queue(
+        self,
+        msg_type: int,
+        pipe_id: int,
+        segments: List[Buffer],
+        flags: int = 0,
+        codec: int = 0,
+        coalesce: bool = False,
+    ) -> None:
+        """
+        Compresses and splits a message into chunks for the backlog. With
+        ``coalesce``, a small message may instead wait in the current batch.
+        """
+        compressed, segments = self.compressor.compress(
+            pipe_id, segments, self.pacer.rate
+        )
+        flags |= compressed
+        entry = (msg_type, pipe_id, segments, flags, codec)
+        self.metrics.values[MESSAGES_OUT] += 1
+
+        # Anything not coalesced closes the batch first to keep messages in order.
+        size = ENTRY.size + sum(memoryview(segment).nbytes for segment in segments)
+        if TRACER.active:
+            TRACER.record("client.send", pipe_id, size - ENTRY.size)
+        if not (self.coalesce and coalesce and size <= CHUNK_SIZE):
+            self.close_batch()
+            self.split(*entry)
+            return
+        if self.batch_size + size > CHUNK_SIZE:
+            self.close_batch()
+        self.batch.append(entry)
+        self.batch_size += size
+
+    def close_batch(self) -> None:
+        """ Moves the coalesced messages to the backlog as one message. """
+        if len(self.batch) == 1:
+            self.split(*self.batch[0])
+        elif self.batch:
+            self.split(BATCH, NO_PIPE, batch(self.batch), 0, 0)
+        self.batch = []
+        self.batch_size = 0
+
+    def split(
+        self,
+        msg_type: int,
+        pipe_id: int,
+        segments: List[Buffer],
+        flags: int,
+        codec: int,
+    ) -> None:
+        """ Splits a message into chunks and appends them to the backlog. """
+        if self.reliable:
+            flags |= RELIABLE
+        chunks = fragment(
+            msg_type, pipe_id, self.seq, segments, flags=flags, codec=codec
+        )
+        self.backlog.extend(chunks)
+        self.seq = (self.seq + 1) % 2 ** 32
+
+    def flush(self, sock: socket.socket, now: float) -> Optional[float]:
+        """
+        Sends chunks from the backlog while the send and congestion windows
+        allow. Returns the time at which the pacer next allows a send, or
+        ``None`` if sending is blocked on acknowledgements or done.
+
+        Callers flush once nothing more is queued, like Nagle's algorithm at
+        the end of each burst, so the coalesced batch is closed first instead
+        of waiting on a timer finer than the loop can keep.
+        """
+        self.close_batch()
+        values = self.metrics.values
+        while self.backlog:
+            values[BACKLOG] = len(self.backlog)
+            if self.reliable and self.send_window.full(int(self.congestion.cwnd)):
+                return None
+            header, pieces = self.backlog[0]
+            size = HEADER.size + sum(len(piece) for piece in pieces)
+            delay = self.pacer.consume(size, now)
+            if delay:
+                return now + delay
+            self.backlog.popleft()
+            values[DATAGRAMS_OUT] += 1
+            values[BYTES_OUT] += size
+
+            # Header and chunk pieces are gathered into a single datagram.
+            if self.reliable:
+                header = header._replace(packet=self.send_window.next_packet)
+            segments: List[Buffer] = [pack_header(*header), *pieces]
+            if self.reliable:
+                self.send_window.track(segments, now)
+            sock.sendmsg(segments, [], 0, self.target)
+            self.monitor.sent(now)
+        values[BACKLOG] = 0
+        return None
+
+    def on_early(self, sock: socket.socket, now: float) -> List[Tuple[Header, Buffer]]:
+        """
+        Handles the datagrams the peer sent during the handshake, returning
+        completed messages.
+        """
+        messages: List[Tuple[Header, Buffer]] = []
+        for datagram in self.early:
+            messages.extend(self.on_datagram(sock, memoryview(datagram), now))
+        self.early = []
+        return messages
+
+    def on_datagram(
+        self, sock: socket.socket, datagram: memoryview, now: float
+    ) -> List[Tuple[Header, Buffer]]:
+        """
+        Handles one datagram from the peer, returning completed messages.
+        A returned message may be a view onto ``datagram``, so it must be
+        consumed before its receive slot is reused.
+        """
+        values = self.metrics.values
+        values[DATAGRAMS_IN] += 1
+        values[BYTES_IN] += len(datagram)
+        try:
+            header = unpack_header(datagram)
+        except ValueError as err:
+            logging.info("%s: bad datagram: %s", self.channel, err)
+            values[DROPS] += 1
+            return []
+        chunk = datagram[HEADER.size :]
+        self.monitor.heard(now)
+
+        # Answer the peer's keepalives, and note the answers to ours.
+        if header.msg_type == REFRESH:
+            sock.sendto(pack_header(CONFIRM, NO_PIPE, header.seq, 0), self.target)
+            self.monitor.sent(now)
+            return []
+        if header.msg_type == CONFIRM:
+            self.monitor.on_confirm(header.seq, now)
+            self.update_peer_gauge()
+            return []
+        if header.msg_type == ACK:
+            self.on_ack(sock, header.packet, ACK_PAYLOAD.unpack(chunk)[0], now)
+            return []
+        if header.msg_type not in (DATA, CONTROL, BATCH):
+            return []
+
+        # Reliable chunks are acknowledged and released in packet order. Those
+        # held back for reordering outlive the receive buffer, so are copied.
+        chunks: List[Tuple[Header, Buffer]] = [(header, chunk)]
+        if header.flags & RELIABLE:
+            if seq_diff(header.packet, self.recv_window.expected) > 0:
+                chunks = [(header, bytes(chunk))]
+            chunks, immediate = self.recv_window.receive(header.packet, chunks[0], now)
+            if immediate:
+                self.send_ack(sock)
+
+        # Collect messages whose chunks have all arrived.
+        messages: List[Tuple[Header, Buffer]] = []
+        for chunk_header, body in chunks:
+            message = self.reassembler.add(chunk_header, body)
+            if message is None:
+                continue
+            entries = [(chunk_header, message)]
+            if chunk_header.msg_type == BATCH:
+                try:
+                    entries = unbatch(chunk_header, message)
+                except ValueError as err:
+                    logging.info("%s: bad batch: %s", self.channel, err)
+                    values[DROPS] += 1
+                    continue
+            for entry, content in entries:
+                try:
+                    content = self.compressor.decompress(
+                        entry.flags, content, self.reassembler.budget
+                    )
+                except ValueError as err:
+                    logging.info("%s: bad message: %s", self.channel, err)
+                    values[DROPS] += 1
+                    continue
+                messages.append((entry, content))
+                if TRACER.active:
+                    TRACER.record("client.recv", entry.pipe_id, len(content))
+        values[MESSAGES_IN] += len(messages)
+        values[ABANDONED] = self.reassembler.abandoned
+        return messages
+
+    def on_ack(
+        self, sock: socket.socket, cumulative: int, bitmap: int, now: float
+    ) -> None:
+        """ Updates the send window and RTT estimate, and fast-retransmits. """
+        acked, samples, lost = self.send_window.on_ack(cumulative, bitmap, now)
+        for sample in samples:
+            self.rtt.update(sample)
+            self.monitor.sample(sample)
+        self.monitor.delivered(acked)
+        self.monitor.lost(len(lost))
+
+        # Progress means the path works again, so drop any timeout backoff.
+        if acked:
+            self.rtt.reset()
+            if self.congestion_control:
+                self.congestion.on_ack(acked, cumulative)
+        for packet in lost:
+            logging.info("%s: fast retransmit of %d.", self.channel, packet)
+            if self.congestion_control:
+                self.congestion.on_loss(packet, self.send_window.next_packet)
+            self.retransmit(sock, packet, now)
+        self.update_pacing()
+
+    def on_timer(self, sock: socket.socket, now: float) -> Optional[float]:
+        """ Fires due retransmissions and delayed acks, returns the next deadline. """
+        expired = self.send_window.expired(now, self.rtt.rto)
+        if expired:
+            self.rtt.backoff()
+            if self.congestion_control:
+                self.congestion.on_timeout(self.send_window.next_packet)
+                self.update_pacing()
+        for packet in expired:
+            logging.info("%s: retransmitting %d.", self.channel, packet)
+            self.retransmit(sock, packet, now)
+        self.monitor.lost(len(expired))
+
+        ack_deadline = self.recv_window.ack_deadline
+        if ack_deadline is not None and now >= ack_deadline:
+            self.send_ack(sock)
+
+        # Keep the NAT mapping open across idle periods.
+        self.monitor.expire(now)
+        probe = self.monitor.probe(now)
+        if probe is not None:
+            sock.sendto(pack_header(REFRESH, NO_PIPE, probe, 0), self.target)
+        self.update_peer_gauge()
+
+        deadlines = [self.send_window.next_deadline(self.rtt.rto)]
+        deadlines.append(self.recv_window.ack_deadline)
+        deadlines.append(self.monitor.deadline())
+        pending = [deadline for deadline in deadlines if deadline is not None]
+        return min(pending) if pending else None
+
+    def retransmit(self, sock: socket.socket, packet: int, now: float) -> None:
+        """ Resends a tracked packet, charging it to the pacer. """
+        segments = self.send_window.resend(packet, now)
+        self.pacer.charge(sum(len(segment) for segment in segments), now)
+        sock.sendmsg(segments, [], 0, self.target)
+        self.monitor.sent(now)
+        self.metrics.values[RETRANSMITS] += 1
+
+    def update_pacing(self) -> None:
+        """ Sets the pacing rate from the congestion window and RTT. """
+        if self.reliable and self.congestion_control:
+            cwnd = self.congestion.cwnd
+            self.pacer.rate = pacing_rate(cwnd, self.rtt.srtt, self.max_rate)
+        self.cwnd_gauge.value = self.congestion.cwnd
+        self.rate_gauge.value = self.pacer.rate
+
+    def congestion_stats(self) -> Dict[str, float]:
+        """ Returns the current congestion window (packets) and pacing rate (B/s). """
+        return {"cwnd": self.cwnd_gauge.value, "pacing_rate": self.rate_gauge.value}
+
+    def update_peer_gauge(self) -> None:
+        """ Publishes the path estimates for ``peer_stats()``. """
+        self.peer_gauge[:] = self.monitor.stats()
+
+    def peer_stats(self) -> Dict[str, float]:
+        """
+        Returns the smoothed RTT and jitter in seconds, the loss rate, the
+        current keepalive interval, and the seconds since the peer was last
+        heard from.
+        """
+        stats = dict(zip(STATS, self.peer_gauge))
+        stats["idle"] = time.monotonic() - stats.pop("last_heard")
+        return stats
+
+    def count_drops(self, dropped: int, overflows: Optional[int]) -> None:
+        """
+        Adds datagrams the receive ring dropped, and sets the kernel's count
+        of drops on the socket if it reported one.
+        """
+        self.metrics.values[DROPS] += dropped
+        if overflows is not None:
+            self.metrics.values[SOCKET_DROPS] = overflows
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the traffic counters of the link for ``mead.stats()``, with
+        the congestion and path estimates.
+        """
+        stats = self.metrics.snapshot()
+        stats.update(self.congestion_stats())
+        stats.update(self.peer_stats())
+        return stats
+
+    def compression_stats(self) -> Dict[int, Dict[str, float]]:
+        """
+        Returns per-pipe compression statistics. These live in the process
+        running the client, e.g. that of ``init()`` with the engine.
+        """
+        return self.compressor.stats()
+
+    def send_ack(self, sock: socket.socket) -> None:
+        """ Acknowledges everything received so far. """
+        cumulative, bitmap = self.recv_window.ack()
+        header = pack_header(ACK, NO_PIPE, 0, ACK_PAYLOAD.size, packet=cumulative)
+        sock.sendmsg([header, ACK_PAYLOAD.pack(bitmap)], [], 0, self.target)
+        self.monitor.sent(time.monotonic())
 
     @staticmethod
     def chat_fullcone(
         send: Callable[[socket.socket], None],
         recv: Callable[[socket.socket], None],
         sock: socket.socket,
+        timer: Optional[Callable[[socket.socket], None]] = None,
     ) -> None:
-        """ Start the send and recv threads. """
-        ts = Thread(target=send, args=(sock,))
-        ts.setDaemon(True)
+        """ Start the send, recv and (optionally) timer threads. """
+        ts = Thread(target=send, args=(sock,), daemon=True)
         ts.start()
-        tr = Thread(target=recv, args=(sock,))
-        tr.setDaemon(True)
+        tr = Thread(target=recv, args=(sock,), daemon=True)
         tr.start()
+        if timer is not None:
+            tt = Thread(target=timer, args=(sock,), daemon=True)
+            tt.start()
+
+    def connect(self) -> None:
+        """ Finds the peer through the server and punches a hole to it. """
+        start = time.perf_counter()
 
-    def main(self) -> None:
-        """ Start a chat session. """
         # Connect to the server and request a channel.
         self.request_for_connection(nat_type_id="0")
 
-        # Initialize the connection.
-        for _ in range(3):
-            self.sockfd.sendto("refresh".encode(), self.target)
-            time.sleep(1)
-        data = self.sockfd.recvfrom(1024)[0].decode()
-        if data == "refresh":
-            self.sockfd.sendto("confirm".encode(), self.target)
+        # Both sides probe until each has seen a probe of the other and had a
+        # probe confirmed. Confirmations echo the probe number, which gives the
+        # initial round-trip time. Probes sent before the peer was seen may
+        # have waited in its buffer while it started, so a fresh probe goes
+        # out then, and only confirmations from then on count.
+        sock = self.sockfd
+        sent: Dict[int, float] = {}
+        seen = confirmed = False
+        fresh = 0
+        interval = PROBE_INTERVAL
+        deadline = 0.0
+        while not (seen and confirmed):
+            now = time.monotonic()
+            if now >= deadline:
+                probe = len(sent)
+                sent[probe] = now
+                sock.sendto(pack_header(REFRESH, NO_PIPE, probe, 0), self.target)
+                deadline = now + interval
+                interval = min(interval * 2, MAX_PROBE_INTERVAL)
+
+            # Errors include the peer's port being closed while it starts up.
+            try:
+                data, addr = self.receive(max(deadline - now, 1e-4), MAX_DATAGRAM)
+                if addr != self.target:
+                    continue
+                header = unpack_header(data)
+            except (OSError, ValueError):
+                continue
+            if header.msg_type == REFRESH:
+                if not seen:
+                    seen = True
+                    fresh = len(sent)
+                    deadline = 0.0
+                sock.sendto(pack_header(CONFIRM, NO_PIPE, header.seq, 0), self.target)
+            elif header.msg_type == CONFIRM:
+                if not seen or not fresh <= header.seq < len(sent):
+                    continue
+                confirmed = True
+                self.rtt.update(time.monotonic() - sent[header.seq])
+            else:
+                # The peer is done already, so it must have our probes.
+                confirmed = True
+                self.early.append(data)
+        if self.mux is None:
+            sock.settimeout(None)
+        now = time.monotonic()
+        self.monitor.sent(now)
+        self.monitor.heard(now)
+        if self.rtt.srtt is not None:
+            self.monitor.sample(self.rtt.srtt)
+        self.update_peer_gauge()
+        self.connect_seconds = time.perf_counter() - start
+        logging.info(
+            "CLIENT: connected in %.3fs, rtt %s.", self.connect_seconds, self.rtt.srtt
+        )
+
+    def receive(
+        self, timeout: Optional[float], size: int
+    ) -> Tuple[bytes, Tuple[str, int]]:
+        """
+        Receives a datagram of up to ``size`` bytes during the handshake, from
+        the socket or, if it is shared, the ``inbox``. Raises ``socket.timeout``
+        if none comes within ``timeout`` seconds.
+        """
+        if self.mux is None:
+            self.sockfd.settimeout(timeout)
+            data, addr = self.sockfd.recvfrom(size)
+            return data, addr
+        try:
+            data, addr = self.inbox.get(timeout=timeout)
+        except Empty:
+            raise socket.timeout("no datagram within %s seconds" % timeout) from None
+        return data[:size], addr
+
+    def main(self) -> None:
+        """ Start a chat session. """
+        self.connect()
 
         # Chat with peer.
         print("FullCone chat mode")
-        self.chat_fullcone(self.sendloop, self.recvloop, self.sockfd)
+        self.chat_fullcone(self.sendloop, self.recvloop, self.sockfd, self.timerloop)
 
         # Let the threads run.
         while 1:
@@ -0,0 +1,323 @@
+"""
+MPI-style collective operations over a group of processes connected by
+``mead.Pipe``s.
+"""
+import operator
+from typing import Any, Set, Dict, List, Tuple, Callable, Optional
+from threading import Thread
+
+from mead.classes import Pipe
+
+# pylint: disable=too-few-public-methods
+
+# Arrays at least this large, in bytes, are split into one segment per rank and
+# pipelined around the group, so that each rank sends and receives about twice
+# the array whatever the size of the group. Smaller ones, and objects which
+# cannot be split, take the fewest steps instead.
+LARGE = 64 * 1024
+
+# Binomial-tree broadcast message tags: the object itself, or the shape of an
+# array whose segments follow.
+WHOLE, SPLIT = range(2)
+
+
+class Comm:
+    """
+    One rank's view of a group made by ``mead.Group()``, passed to the
+    ``mead.Process`` running as that rank. Every rank must make the same
+    collective calls in the same order, and reductions must be given objects of
+    the same shape on every rank, and an associative, commutative ``op``.
+
+    Parameters
+    ----------
+    rank : ``int``.
+        This rank, from zero.
+    size : ``int``.
+        The number of ranks in the group.
+    funnels : ``Dict[int, Any]``.
+        Funnels to the ranks this one sends to, by rank.
+    spouts : ``Dict[int, Any]``.
+        Spouts from the ranks this one receives from, by rank.
+    """
+
+    def __init__(
+        self, rank: int, size: int, funnels: Dict[int, Any], spouts: Dict[int, Any]
+    ):
+        self.rank = rank
+        self.size = size
+        self.funnels = funnels
+        self.spouts = spouts
+
+    def ends(self) -> List[Any]:
+        """ Returns the pipe ends of this rank. """
+        return list(self.funnels.values()) + list(self.spouts.values())
+
+    def replace(self, fn: Callable[[Any], Any]) -> "Comm":
+        """ Returns a copy with ``fn`` applied to every pipe end. """
+        funnels = {peer: fn(funnel) for peer, funnel in self.funnels.items()}
+        spouts = {peer: fn(spout) for peer, spout in self.spouts.items()}
+        return Comm(self.rank, self.size, funnels, spouts)
+
+    def bcast(self, obj: Any = None, root: int = 0) -> Any:
+        """
+        Returns ``obj`` from ``root`` on every rank. Large arrays are scattered
+        and then gathered around a ring, anything else goes down a binomial
+        tree.
+        """
+        if self.rank != root:
+            tag, body = self._tree_bcast(None, root)
+        elif self.size > 2 and _splittable(obj) and obj.nbytes >= LARGE:
+            tag, body = self._tree_bcast((SPLIT, obj.shape), root)
+        else:
+            tag, body = self._tree_bcast((WHOLE, obj), root)
+        if tag == WHOLE:
+            return body
+
+        # The root splits the array, and every rank gets one segment.
+        segments = _split(obj, self.size) if self.rank == root else None
+        segment = self._tree_scatter(segments, root)
+        return _join(self._ring_allgather(segment), body)
+
+    def scatter(self, objs: Optional[List[Any]] = None, root: int = 0) -> Any:
+        """ Returns ``objs[rank]`` from ``root`` on every rank. """
+        if self.rank == root:
+            assert objs is not None and len(objs) == self.size
+        return self._tree_scatter(objs, root)
+
+    def gather(self, obj: Any, root: int = 0) -> Optional[List[Any]]:
+        """ Returns every rank's ``obj`` in rank order on ``root``. """
+        items = self._tree_reduce({self.rank: obj}, _merge, root)
+        if self.rank != root:
+            return None
+        return [items[rank] for rank in range(self.size)]
+
+    def reduce(
+        self, obj: Any, op: Callable[[Any, Any], Any] = operator.add, root: int = 0
+    ) -> Any:
+        """
+        Returns every rank's ``obj`` combined by ``op`` on ``root``. Large
+        arrays are reduced in segments around a ring, and the segments gathered
+        at the root, anything else goes up a binomial tree.
+        """
+        if not self._pipelined(obj):
+            result = self._tree_reduce(obj, op, root)
+            return result if self.rank == root else None
+        segments = self._ring_reduce_scatter(_split(obj, self.size), op)
+        owned = (self.rank + 1) % self.size
+        gathered = self.gather(segments[owned], root)
+        if gathered is None:
+            return None
+        ordered = [gathered[(index - 1) % self.size] for index in range(self.size)]
+        return _join(ordered, obj.shape)
+
+    def allreduce(self, obj: Any, op: Callable[[Any, Any], Any] = operator.add) -> Any:
+        """
+        Returns every rank's ``obj`` combined by ``op`` on every rank. Large
+        arrays are reduced and then gathered around a ring, anything else by
+        recursive doubling.
+        """
+        if not self._pipelined(obj):
+            return self._recursive_doubling(obj, op)
+        segments = self._ring_reduce_scatter(_split(obj, self.size), op)
+        owned = (self.rank + 1) % self.size
+        gathered = self._ring_allgather(segments[owned], first=owned)
+        return _join(gathered, obj.shape)
+
+    def _pipelined(self, obj: Any) -> bool:
+        """ Returns whether ``obj`` is reduced in segments around a ring. """
+        return self.size > 2 and _splittable(obj) and obj.nbytes >= LARGE
+
+    def _send(self, peer: int, obj: Any) -> None:
+        """ Sends ``obj`` to rank ``peer``. """
+        self.funnels[peer].send(obj)
+
+    def _recv(self, peer: int) -> Any:
+        """ Receives from rank ``peer``. """
+        return self.spouts[peer].recv()
+
+    def _exchange(self, send_to: int, obj: Any, recv_from: int) -> Any:
+        """
+        Sends ``obj`` to one rank while receiving from another, so that ranks
+        which all send before receiving cannot wait on each other.
+        """
+        sender = Thread(target=self._send, args=(send_to, obj))
+        sender.start()
+        received = self._recv(recv_from)
+        sender.join()
+        return received
+
+    def _tree_bcast(self, obj: Any, root: int) -> Any:
+        """ Passes ``obj`` from ``root`` down a binomial tree. """
+        relative = (self.rank - root) % self.size
+        mask = 1
+        while mask < self.size:
+            if relative & mask:
+                obj = self._recv((self.rank - mask) % self.size)
+                break
+            mask <<= 1
+        mask >>= 1
+        while mask > 0:
+            if relative + mask < self.size:
+                self._send((self.rank + mask) % self.size, obj)
+            mask >>= 1
+        return obj
+
+    def _tree_scatter(self, objs: Optional[List[Any]], root: int) -> Any:
+        """
+        Passes each subtree of a binomial tree the objects of its ranks, from
+        ``root``, and returns this rank's.
+        """
+        relative = (self.rank - root) % self.size
+        chunk: List[Any] = []
+        if relative == 0:
+            assert objs is not None
+            chunk = [objs[(root + index) % self.size] for index in range(self.size)]
+        mask = 1
+        while mask < self.size:
+            if relative & mask:
+                chunk = self._recv((self.rank - mask) % self.size)
+                break
+            mask <<= 1
+        mask >>= 1
+
+        # The chunk holds the objects of ranks ``relative`` onwards.
+        while mask > 0:
+            if relative + mask < self.size:
+                self._send((self.rank + mask) % self.size, chunk[mask:])
+                chunk = chunk[:mask]
+            mask >>= 1
+        return chunk[0]
+
+    def _tree_reduce(self, obj: Any, op: Callable[[Any, Any], Any], root: int) -> Any:
+        """ Combines ``obj`` up a binomial tree, returning the total at ``root``. """
+        relative = (self.rank - root) % self.size
+        mask = 1
+        while mask < self.size:
+            if relative & mask:
+                self._send((self.rank - mask) % self.size, obj)
+                break
+            if relative + mask < self.size:
+                obj = op(obj, self._recv((self.rank + mask) % self.size))
+            mask <<= 1
+        return obj
+
+    def _recursive_doubling(self, obj: Any, op: Callable[[Any, Any], Any]) -> Any:
+        """
+        Combines ``obj`` with every rank in log2(size) exchanges. Ranks beyond
+        the largest power of two first hand their objects to a partner, and
+        get the result back from it.
+        """
+        power = 1
+        while power * 2 <= self.size:
+            power *= 2
+        if self.rank >= power:
+            self._send(self.rank - power, obj)
+            return self._recv(self.rank - power)
+        if self.rank + power < self.size:
+            obj = op(obj, self._recv(self.rank + power))
+
+        # Both partners combine in rank order, so every rank ends up with the
+        # same result even if ``op`` rounds.
+        mask = 1
+        while mask < power:
+            peer = self.rank ^ mask
+            theirs = self._exchange(peer, obj, peer)
+            obj = op(obj, theirs) if self.rank < peer else op(theirs, obj)
+            mask <<= 1
+
+        if self.rank + power < self.size:
+            self._send(self.rank + power, obj)
+        return obj
+
+    def _ring_reduce_scatter(
+        self, segments: List[Any], op: Callable[[Any, Any], Any]
+    ) -> List[Any]:
+        """
+        Passes segments around the ring, each rank adding its own, until rank
+        ``r`` holds the total of segment ``r + 1``.
+        """
+        after = (self.rank + 1) % self.size
+        before = (self.rank - 1) % self.size
+        for step in range(self.size - 1):
+            out = (self.rank - step) % self.size
+            into = (self.rank - step - 1) % self.size
+            received = self._exchange(after, segments[out], before)
+            segments[into] = op(received, segments[into])
+        return segments
+
+    def _ring_allgather(self, segment: Any, first: Optional[int] = None) -> List[Any]:
+        """
+        Passes segments around the ring until every rank has all of them,
+        given segment ``first``, by default this rank's.
+        """
+        first = self.rank if first is None else first
+        segments: List[Any] = [None] * self.size
+        segments[first] = segment
+        after = (self.rank + 1) % self.size
+        before = (self.rank - 1) % self.size
+        for step in range(self.size - 1):
+            out = (first - step) % self.size
+            into = (first - step - 1) % self.size
+            segments[into] = self._exchange(after, segments[out], before)
+        return segments
+
+
+# pylint: disable=invalid-name
+def Group(size: int) -> List[Comm]:
+    """
+    Creates the pipes of a group of ``size`` ranks, returning the ``Comm`` of
+    each rank to pass to the ``mead.Process`` which runs as that rank. Ranks
+    are connected only where the collectives need it, to the ranks a power of
+    two away in either direction, and to those differing from them in one bit.
+    """
+    if size < 1:
+        raise ValueError("A group needs at least one rank.")
+    comms = [Comm(rank, size, {}, {}) for rank in range(size)]
+    for rank in range(size):
+        for peer in sorted(_peers(rank, size)):
+            funnel, spout = Pipe()
+            comms[rank].funnels[peer] = funnel
+            comms[peer].spouts[rank] = spout
+    return comms
+
+
+def _peers(rank: int, size: int) -> Set[int]:
+    """ Returns the ranks which ``rank`` sends to in some collective. """
+    peers = set()
+    distance = 1
+    while distance < size:
+        peers.add((rank + distance) % size)
+        peers.add((rank - distance) % size)
+        if rank ^ distance < size:
+            peers.add(rank ^ distance)
+        distance <<= 1
+    peers.discard(rank)
+    return peers
+
+
+def _splittable(obj: Any) -> bool:
+    """ Returns whether ``obj`` is an array which can be split in segments. """
+    return all(hasattr(obj, name) for name in ("nbytes", "dtype", "reshape"))
+
+
+def _split(array: Any, parts: int) -> List[Any]:
+    """ Splits a flattened copy of ``array`` into ``parts`` segments. """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    return list(np.array_split(np.array(array).reshape(-1), parts))
+
+
+def _join(segments: List[Any], shape: Tuple[int, ...]) -> Any:
+    """ Joins the segments of an array, and restores its shape. """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    return np.concatenate(segments).reshape(shape)
+
+
+def _merge(left: Dict[int, Any], right: Dict[int, Any]) -> Dict[int, Any]:
+    """ Merges the objects gathered from two subtrees. """
+    left.update(right)
+    return left
+
+
+__all__: List[str] = ["Comm", "Group"]
@@ -0,0 +1,187 @@
+""" Adaptive per-pipe compression of messages. """
+import lzma
+import math
+import time
+import zlib
+import struct
+from typing import Any, Dict, List, Tuple, Optional
+
+from mead.framing import Buffer
+
+# pylint: disable=too-few-public-methods
+
+# Header flags marking a compressed message, one per algorithm.
+ZLIB = 0x04
+LZMA = 0x08
+ALGORITHMS = {"zlib": ZLIB, "lzma": LZMA}
+
+# A compressed message starts with its original length, so that the receiver
+# never inflates it past what was sent.
+ORIGINAL = struct.Struct("!Q")
+
+# Defaults, overridable from the ``transport`` section of the ``init()`` config.
+LEVELS = {ZLIB: 6, LZMA: 1}
+THRESHOLD = 1024
+MAX_RATIO = 0.9
+
+# Assumed link rate in bytes per second when the pacer does not know better.
+LINK_RATE = 100e6 / 8
+
+# A pipe whose messages did not compress well is left alone for this many
+# messages before being probed again, doubling on every failed probe.
+MIN_SKIP = 8
+MAX_SKIP = 1024
+
+
+class _PipeState:
+    """ Compression statistics and adaptive state of one pipe. """
+
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        self.messages = 0
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        self.skip = 0
+        self.backoff = MIN_SKIP
+
+
+class Compressor:
+    """
+    Compresses outgoing messages and decompresses incoming ones.
+
+    Compression is tried for messages of at least the pipe's threshold, and
+    kept up only while it pays: the compressed size must stay under
+    ``max_ratio`` of the original, and the time saved on the wire at the
+    current send rate must exceed the time spent compressing. Otherwise the
+    pipe is skipped for a while and then probed again.
+
+    Parameters
+    ----------
+    algorithm : ``str``.
+        ``"zlib"``, ``"lzma"``, or ``""`` to send uncompressed. Incoming
+        messages are decompressed regardless.
+    level : ``int``.
+        Compression level, or ``-1`` for the algorithm's default here.
+    threshold : ``int``.
+        Messages smaller than this many bytes are never compressed.
+    thresholds : ``Dict[int, int]``.
+        Per-pipe overrides of ``threshold``.
+    max_ratio : ``float``.
+        Compressed-to-original size ratio above which compression is skipped.
+    """
+
+    def __init__(
+        self,
+        algorithm: str = "",
+        level: int = -1,
+        threshold: int = THRESHOLD,
+        thresholds: Optional[Dict[int, int]] = None,
+        max_ratio: float = MAX_RATIO,
+    ):
+        self.flag = ALGORITHMS[algorithm] if algorithm else 0
+        self.level = LEVELS.get(self.flag, 0) if level < 0 else level
+        self.threshold = threshold
+        self.thresholds = thresholds if thresholds else {}
+        self.max_ratio = max_ratio
+        self.pipes: Dict[int, _PipeState] = {}
+
+    def compress(
+        self, pipe_id: int, segments: List[Buffer], link_rate: float
+    ) -> Tuple[int, List[Buffer]]:
+        """
+        Returns the header flag and segments to send for a message, which are
+        ``segments`` unchanged with flag zero when compression is skipped.
+        """
+        state = self.pipes.get(pipe_id)
+        if state is None:
+            threshold = self.thresholds.get(pipe_id, self.threshold)
+            state = self.pipes[pipe_id] = _PipeState(threshold)
+        size = sum(memoryview(segment).nbytes for segment in segments)
+        state.messages += 1
+        state.bytes_in += size
+        if not self.flag or size < max(state.threshold, 1) or state.skip:
+            state.skip = max(state.skip - 1, 0)
+            state.bytes_out += size
+            return 0, segments
+
+        # Compress the segments in place of joining them first.
+        start = time.perf_counter()
+        if self.flag == ZLIB:
+            compressor: Any = zlib.compressobj(self.level)
+        else:
+            compressor = lzma.LZMACompressor(preset=self.level)
+        out: List[Buffer] = [ORIGINAL.pack(size)]
+        out.extend(compressor.compress(segment) for segment in segments)
+        out.append(compressor.flush())
+        elapsed = time.perf_counter() - start
+        compressed = sum(len(piece) for piece in out)
+
+        ratio = compressed / size
+        state.seconds += elapsed
+
+        # Back off from pipes where compression costs more than it saves.
+        rate = link_rate if math.isfinite(link_rate) else LINK_RATE
+        if ratio > self.max_ratio or (size - compressed) / rate < elapsed:
+            state.skip = state.backoff
+            state.backoff = min(state.backoff * 2, MAX_SKIP)
+        else:
+            state.backoff = MIN_SKIP
+
+        if ratio >= 1.0:
+            state.bytes_out += size
+            return 0, segments
+        state.compressed += 1
+        state.bytes_out += compressed
+        return self.flag, out
+
+    @staticmethod
+    def decompress(flags: int, message: Buffer, limit: int) -> Buffer:
+        """
+        Decompresses a message if its header flags say it is compressed.
+        Raises ``ValueError`` if it is corrupt, or would inflate past its
+        original length or ``limit`` bytes.
+        """
+        if not flags & (ZLIB | LZMA):
+            return message
+        view = memoryview(message)
+        if len(view) < ORIGINAL.size:
+            raise ValueError("compressed message too short")
+        length = ORIGINAL.unpack_from(view)[0]
+        if length > limit:
+            raise ValueError("compressed message of %d bytes over limit" % length)
+
+        # A zero ``max_length`` means no limit to zlib, so ask for at least one
+        # byte, which a message of length zero then fails on.
+        try:
+            if flags & ZLIB:
+                decompressor: Any = zlib.decompressobj()
+            else:
+                decompressor = lzma.LZMADecompressor()
+            out: bytes = decompressor.decompress(view[ORIGINAL.size :], max(length, 1))
+
+            # Output may stop at the limit just short of the end of the stream,
+            # which must then come without another byte.
+            if len(out) == length and not decompressor.eof:
+                tail = getattr(decompressor, "unconsumed_tail", b"")
+                out += decompressor.decompress(tail, 1)
+        except (zlib.error, lzma.LZMAError) as err:
+            raise ValueError("corrupt compressed message: %s" % err) from err
+        if len(out) != length or not decompressor.eof or decompressor.unused_data:
+            raise ValueError("compressed message does not match its length")
+        return out
+
+    def stats(self) -> Dict[int, Dict[str, float]]:
+        """ Returns the compression ratio and time spent per pipe id. """
+        return {
+            pipe_id: {
+                "messages": state.messages,
+                "compressed": state.compressed,
+                "bytes_in": state.bytes_in,
+                "bytes_out": state.bytes_out,
+                "ratio": state.bytes_out / state.bytes_in if state.bytes_in else 1.0,
+                "seconds": state.seconds,
+            }
+            for pipe_id, state in self.pipes.items()
+        }
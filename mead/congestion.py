@@ -0,0 +1,118 @@
+""" Congestion control and send pacing for the UDP client. """
+import math
+from typing import Optional
+
+from mead.framing import MTU
+from mead.reliability import seq_diff
+
+# pylint: disable=too-few-public-methods
+
+# Congestion window bounds and initial value, in packets.
+INITIAL_CWND = 10.0
+MIN_CWND = 2.0
+
+# Pacing runs slightly faster than ``cwnd / srtt`` so that the pacer itself
+# never becomes the bottleneck, and allows short bursts of ``BURST`` bytes.
+PACING_GAIN = 1.25
+BURST = 10 * MTU
+
+
+class Aimd:
+    """
+    Additive-increase, multiplicative-decrease congestion window (Reno-style).
+
+    The window grows by one packet per acknowledged packet in slow start and
+    by one packet per round trip in congestion avoidance. A loss halves it at
+    most once per round trip, and a retransmission timeout collapses it. The
+    window is held while recovering from a loss.
+
+    Parameters
+    ----------
+    cwnd : ``float``.
+        The initial congestion window in packets.
+    max_cwnd : ``float``.
+        Upper bound on the congestion window, usually the send window size.
+    """
+
+    def __init__(self, cwnd: float = INITIAL_CWND, max_cwnd: float = math.inf):
+        self.max_cwnd = max_cwnd
+        self.cwnd = min(cwnd, max_cwnd)
+        self.ssthresh = math.inf
+        self.recovery: Optional[int] = None
+
+    def on_ack(self, acked: int, cumulative: int) -> None:
+        """ Grows the window for ``acked`` newly acknowledged packets. """
+        if self.recovery is not None:
+            if seq_diff(cumulative, self.recovery) < 0:
+                return
+            self.recovery = None
+        if self.cwnd < self.ssthresh:
+            self.cwnd += acked
+        else:
+            self.cwnd += acked / self.cwnd
+        self.cwnd = min(self.cwnd, self.max_cwnd)
+
+    def on_loss(self, packet: int, next_packet: int) -> None:
+        """ Halves the window, unless already recovering from an earlier loss. """
+        if self.recovery is not None and seq_diff(packet, self.recovery) < 0:
+            return
+        self.ssthresh = max(self.cwnd / 2, MIN_CWND)
+        self.cwnd = self.ssthresh
+        self.recovery = next_packet
+
+    def on_timeout(self, next_packet: int) -> None:
+        """ Collapses the window after a retransmission timeout. """
+        self.ssthresh = max(self.cwnd / 2, MIN_CWND)
+        self.cwnd = MIN_CWND
+        self.recovery = next_packet
+
+
+class TokenBucket:
+    """
+    Paces sends to ``rate`` bytes per second with bursts of up to ``burst``.
+
+    Parameters
+    ----------
+    rate : ``float``.
+        Refill rate in bytes per second. ``math.inf`` disables pacing.
+    burst : ``float``.
+        Bucket capacity in bytes.
+    """
+
+    def __init__(self, rate: float = math.inf, burst: float = BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp: Optional[float] = None
+
+    def refill(self, now: float) -> None:
+        """ Adds the tokens accrued since the last call. """
+        if self.stamp is not None and math.isfinite(self.rate):
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def consume(self, size: int, now: float) -> float:
+        """
+        Takes ``size`` bytes worth of tokens if any are available and returns
+        zero, otherwise returns the seconds to wait before trying again. The
+        bucket may go into debt, so a packet larger than ``burst`` still goes.
+        """
+        if not math.isfinite(self.rate):
+            return 0.0
+        self.refill(now)
+        if self.tokens < 0:
+            return -self.tokens / self.rate
+        self.tokens -= size
+        return 0.0
+
+    def charge(self, size: int, now: float) -> None:
+        """ Takes tokens for a packet that was sent regardless, e.g. a retransmit. """
+        self.refill(now)
+        self.tokens -= size
+
+
+def pacing_rate(cwnd: float, srtt: Optional[float], max_rate: float) -> float:
+    """ Returns the pacing rate in bytes per second for a window and RTT. """
+    if not srtt:
+        return max_rate
+    return min(PACING_GAIN * cwnd * MTU / srtt, max_rate)
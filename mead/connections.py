@@ -4,7 +4,40 @@ from typing import Any, Dict, List, Tuple
 from multiprocessing.connection import Connection
 
 from mead import cellar
-from mead.classes import Spout, Funnel, _Spout, _Funnel
+from mead.engine import LOOPBACK
+from mead.classes import Spout, Funnel, _Route, _Spout, _Funnel
+from mead.collectives import Comm
+
+
+def wrap_funnel(placeholder: _Funnel, funnel: Connection) -> Funnel:
+    """
+    Wraps a remote process's funnel, which serializes as set by the
+    ``serialize_once`` option and counts what it sends for ``mead.stats()``.
+    """
+    return Funnel(placeholder.pipe_id, funnel, placeholder.codec)
+
+
+def wrap_spout(placeholder: _Spout, spout: Connection) -> Spout:
+    """ Wraps a remote process's spout, the counterpart of ``wrap_funnel()``. """
+    return Spout(placeholder.pipe_id, spout)
+
+
+def pipe_ends(args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> List[Any]:
+    """ Returns the pipe ends among arguments, including those of a ``Comm``. """
+    ends: List[Any] = []
+    for arg in list(args) + list(kwargs.values()):
+        ends.extend(arg.ends() if isinstance(arg, Comm) else [arg])
+    return ends
+
+
+def close_remote_ends(args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> None:
+    """
+    Closes this process's copies of the pipe ends given to a user process it
+    has started, so that they are freed when the user process exits.
+    """
+    for arg in pipe_ends(args, kwargs):
+        if isinstance(arg, (Funnel, Spout)):
+            arg.close_connection()
 
 
 def get_head_connections(
@@ -18,39 +51,60 @@ def get_head_connections(
     in_funnels: Dict[str, Connection] = {}
     out_spouts: Dict[str, Connection] = {}
 
+    def convert(arg: Any) -> Any:
+        """ Replaces a pipe end, or those of a ``Comm``, with placeholders. """
+        if isinstance(arg, Funnel):
+            in_funnels[arg.pipe_id] = cellar.INTERNAL_FUNNELS[arg.pipe_id]
+            return _Funnel(arg.pipe_id, arg.codec)
+        if isinstance(arg, Spout):
+            out_spouts[arg.pipe_id] = cellar.INTERNAL_SPOUTS[arg.pipe_id]
+            return _Spout(arg.pipe_id)
+        if isinstance(arg, Comm):
+            return arg.replace(convert)
+        return arg
+
     # Construct serializable argument lists with mead placeholders.
-    mp_args: List[Any] = []
-    mp_kwargs: Dict[str, Any] = {}
+    mp_args = tuple(convert(arg) for arg in args)
+    mp_kwargs = {name: convert(arg) for name, arg in kwargs.items()}
+    return in_funnels, out_spouts, mp_args, mp_kwargs
 
-    for arg in args:
-        if isinstance(arg, Funnel):
-            funnel = cellar.INTERNAL_FUNNELS[arg.pipe_id]
-            in_funnels[arg.pipe_id] = funnel
-            _funnel = _Funnel(arg.pipe_id)
-            mp_args.append(_funnel)
-        elif isinstance(arg, Spout):
-            spout = cellar.INTERNAL_SPOUTS[arg.pipe_id]
-            out_spouts[arg.pipe_id] = spout
-            _spout = _Spout(arg.pipe_id)
-            mp_args.append(_spout)
-        else:
-            mp_args.append(arg)
 
-    for name, arg in kwargs.items():
-        if isinstance(arg, Funnel):
-            funnel = cellar.INTERNAL_FUNNELS[arg.pipe_id]
-            in_funnels[arg.pipe_id] = funnel
-            _funnel = _Funnel(arg.pipe_id)
-            mp_kwargs[name] = _funnel
-        elif isinstance(arg, Spout):
-            spout = cellar.INTERNAL_SPOUTS[arg.pipe_id]
-            out_spouts[arg.pipe_id] = spout
-            _spout = _Spout(arg.pipe_id)
-            mp_kwargs[name] = _spout
-        else:
-            mp_kwargs[name] = arg
+def get_direct_routes(
+    hostname: str, in_funnels: Dict[str, Connection], out_spouts: Dict[str, Connection]
+) -> List[Tuple[str, _Route]]:
+    """
+    Records the pipe ends given to a process on the worker ``hostname``, and
+    returns the ``_Route``s to send, with the worker for each, for its pipes
+    whose other end is in a process on a worker too. Those pipes then run
+    directly between the two workers, which the head only introduces to each
+    other through the rendezvous server.
+    """
+    for pipe_id in in_funnels:
+        cellar.FUNNEL_HOSTS[pipe_id] = hostname
+    for pipe_id in out_spouts:
+        cellar.SPOUT_HOSTS[pipe_id] = hostname
+
+    # The receiver is told first, so that it is ready for direct messages.
+    routes: List[Tuple[str, _Route]] = []
+    for pipe_id in list(in_funnels) + list(out_spouts):
+        sender = cellar.FUNNEL_HOSTS.get(pipe_id)
+        receiver = cellar.SPOUT_HOSTS.get(pipe_id)
+        if sender is None or receiver is None:
+            continue
+        link = link_name(sender, receiver)
+        routes.append((receiver, _Route(pipe_id, link, cellar.SERVER, False)))
+        routes.append((sender, _Route(pipe_id, link, cellar.SERVER, True)))
+    return routes
+
 
-    return in_funnels, out_spouts, tuple(mp_args), mp_kwargs
+def link_name(sender: str, receiver: str) -> str:
+    """
+    Returns the channel of the link between two workers, the same whichever
+    asks, or ``LOOPBACK`` for a pipe within one worker.
+    """
+    if sender == receiver:
+        return LOOPBACK
+    return "~".join(sorted((sender, receiver)))
 
 
 def get_remote_connections(
@@ -64,33 +118,21 @@ def get_remote_connections(
     in_funnels: Dict[str, Connection] = {}
     out_spouts: Dict[str, Connection] = {}
 
-    mp_args: List[Any] = []
-    mp_kwargs: Dict[str, Any] = {}
-
-    # Iterate over the arguments, replacing mead pipes with mp pipes.
-    for arg in args:
+    def convert(arg: Any) -> Any:
+        """ Replaces a placeholder, or those of a ``Comm``, with an mp pipe. """
         if isinstance(arg, _Funnel):
             funnel, spout = mp.Pipe()
             out_spouts[arg.pipe_id] = spout
-            mp_args.append(funnel)
-        elif isinstance(arg, _Spout):
+            return wrap_funnel(arg, funnel)
+        if isinstance(arg, _Spout):
             funnel, spout = mp.Pipe()
             in_funnels[arg.pipe_id] = funnel
-            mp_args.append(spout)
-        else:
-            mp_args.append(arg)
+            return wrap_spout(arg, spout)
+        if isinstance(arg, Comm):
+            return arg.replace(convert)
+        return arg
 
-    # Iterate over the keyword arguments, replacing mead pipes with mp pipes.
-    for name, arg in kwargs.items():
-        if isinstance(arg, _Funnel):
-            funnel, spout = mp.Pipe()
-            out_spouts[arg.pipe_id] = spout
-            mp_kwargs[name] = funnel
-        elif isinstance(arg, _Spout):
-            funnel, spout = mp.Pipe()
-            in_funnels[arg.pipe_id] = funnel
-            mp_kwargs[name] = spout
-        else:
-            mp_kwargs[name] = arg
-
-    return in_funnels, out_spouts, tuple(mp_args), mp_kwargs
+    # Iterate over the arguments, replacing mead pipes with mp pipes.
+    mp_args = tuple(convert(arg) for arg in args)
+    mp_kwargs = {name: convert(arg) for name, arg in kwargs.items()}
+    return in_funnels, out_spouts, mp_args, mp_kwargs
@@ -0,0 +1,627 @@
+""" A single-threaded transport loop multiplexing every peer of a host. """
+import os
+import time
+import socket
+import struct
+import logging
+import selectors
+from typing import Any, Set, Dict, List, Tuple, Deque, Callable, Optional
+from itertools import islice
+from functools import partial
+from threading import Thread, get_ident
+from collections import deque
+from multiprocessing.connection import Connection
+from multiprocessing.reduction import ForkingPickler
+
+from mead import cellar
+from mead.mux import Mux
+from mead.ring import ReceiveRing
+from mead.client import Client
+from mead.metrics import FAILURES
+from mead.classes import Parcel, _Join, _Kill, _Stats, _Handover, _Terminate
+from mead.framing import RAW, DATA, Buffer, Header
+from mead.serialization import loads, codec_of
+
+# pylint: disable=too-few-public-methods
+
+# Bytes read from a pipe per wakeup, so that a busy pipe cannot starve the
+# links and the other pipes.
+READ_SIZE = 1 << 20
+
+# Buffers handed to a single ``os.writev`` call.
+IOV_BATCH = 64
+
+# ``multiprocessing.Connection`` frames each message with a signed 32-bit
+# length, or ``-1`` followed by a 64-bit length for larger messages.
+SIZE = struct.Struct("!i")
+LARGE_SIZE = struct.Struct("!Q")
+MAX_SIZE = 0x7FFFFFFF
+
+# The link of a direct pipe whose two ends are on the same worker, which the
+# engine forwards without going through the network.
+LOOPBACK = ""
+
+
+class _Writer:
+    """
+    Writes messages to a ``Connection`` without ever blocking the loop. The
+    connection is switched to non-blocking mode and messages are framed
+    exactly as ``Connection.send_bytes()`` would, so the other end reads
+    them with ``recv_bytes()``, or ``recv()`` if they are pickles.
+    """
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+        self.fd = conn.fileno()
+        os.set_blocking(self.fd, False)
+        self.pending: Deque[memoryview] = deque()
+        self.closed = False
+        self.watched = False
+
+    def send_bytes(self, data: Buffer) -> None:
+        """
+        Frames and writes a message, keeping whatever does not fit. The kept
+        remainder is copied, since ``data`` may be a view onto a reused buffer.
+        """
+        if self.closed:
+            return
+        n = len(data)
+        if n > MAX_SIZE:
+            header = SIZE.pack(-1) + LARGE_SIZE.pack(n)
+        else:
+            header = SIZE.pack(n)
+        self.pending.append(memoryview(header))
+        self.pending.append(memoryview(data))
+        self.drain()
+        if self.pending:
+            self.pending[-1] = memoryview(bytes(self.pending[-1]))
+
+    def drain(self) -> None:
+        """ Writes as much pending data as the pipe accepts. """
+        while self.pending and not self.closed:
+            try:
+                sent = os.writev(self.fd, list(islice(self.pending, IOV_BATCH)))
+            except BlockingIOError:
+                return
+            except OSError as err:
+                logging.info("ENGINE: pipe closed: %s", err)
+                self.pending.clear()
+                self.closed = True
+                return
+            while sent:
+                head = self.pending[0]
+                if sent < len(head):
+                    self.pending[0] = head[sent:]
+                    break
+                sent -= len(head)
+                self.pending.popleft()
+
+
+class _Reader:
+    """
+    Reads messages framed by ``Connection.send_bytes()`` without ever blocking
+    the loop, the counterpart of ``_Writer``. A pipe the engine both writes
+    and reads, as the head does when it relays a pipe between two workers,
+    may hold part of a message whose rest the engine has yet to write.
+    """
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+        self.fd = conn.fileno()
+        os.set_blocking(self.fd, False)
+        self.buffer = bytearray()
+
+    def read(self) -> Optional[List[bytes]]:
+        """
+        Returns the messages completed by what the pipe holds, or ``None`` once
+        it is closed.
+        """
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+        except OSError:
+            return None
+        if not data:
+            return None
+        self.buffer += data
+
+        messages = []
+        while len(self.buffer) >= SIZE.size:
+            (n,) = SIZE.unpack_from(self.buffer)
+            start = SIZE.size
+            if n == -1:
+                if len(self.buffer) < SIZE.size + LARGE_SIZE.size:
+                    break
+                (n,) = LARGE_SIZE.unpack_from(self.buffer, SIZE.size)
+                start += LARGE_SIZE.size
+            if len(self.buffer) < start + n:
+                break
+            messages.append(bytes(self.buffer[start : start + n]))
+            del self.buffer[: start + n]
+        return messages
+
+
+class Engine:
+    """
+    Runs the UDP links of this host, and the pipes of the user processes
+    they serve, in one ``selectors`` loop instead of a client process per
+    peer plus an ``inject``/``extract`` process per pipe.
+
+    Every ``Client`` is driven through its non-blocking methods from the loop
+    thread only. The public methods may be called from any thread; they hand
+    their work to the loop through ``call_soon()``. Counter reports from
+    workers are kept in ``cellar.REMOTE_STATS`` for ``mead.stats()``.
+
+    A pipe between processes on two workers runs over a link of its own
+    between them once the head has introduced them, or within the engine of
+    a worker which has both ends. The head relays whatever was sent before
+    that, and the receiving worker keeps the direct messages until the relayed
+    ones are in, which a ``_Handover`` passed on by the head marks.
+
+    Clients which share a ``Mux`` socket are served by one registration of
+    it, which hands each datagram to the client it is for, or, while that
+    client is still connecting, to its ``inbox``.
+
+    Parameters
+    ----------
+    on_control : ``Optional[Callable[[str, Any], None]]``.
+        Called in the loop thread with the channel and the object for every
+        control message which is not a process signal routed to an attached
+        auxiliary pipe.
+    """
+
+    def __init__(self, on_control: Optional[Callable[[str, Any], None]] = None):
+        self.on_control = on_control
+        self.selector = selectors.DefaultSelector()
+        self.clients: Dict[str, Client] = {}
+        self.connected: Dict[str, Client] = {}
+        self.funnels: Dict[str, Dict[str, _Writer]] = {}
+        self.spouts: Dict[str, Dict[str, _Reader]] = {}
+        self.aux: Dict[Tuple[str, str], _Writer] = {}
+        self.muxes: Set[Mux] = set()
+
+        # The links of direct pipes on this worker, by pipe id, and the
+        # messages each keeps until its ``_Handover``, by link and pipe id.
+        self.routes: Dict[str, str] = {}
+        self.held: Dict[Tuple[str, str], List[bytes]] = {}
+        self.thread: Optional[Thread] = None
+        self.ident: Optional[int] = None
+        self.running = False
+
+        # Datagrams are received in batches into one ring of preallocated
+        # slots, which bounds how long one busy peer can hold up the others.
+        self.ring = ReceiveRing()
+
+        # Other threads queue callbacks and wake the loop through a socket pair.
+        self.calls: Deque[Callable[[], None]] = deque()
+        self.waker, self.wakee = socket.socketpair()
+        self.waker.setblocking(False)
+        self.wakee.setblocking(False)
+        self.selector.register(self.wakee, selectors.EVENT_READ, self._on_wakeup)
+
+    def call_soon(self, callback: Callable[[], None]) -> None:
+        """ Runs ``callback`` in the loop thread. Safe from any thread. """
+        self.calls.append(callback)
+        try:
+            self.waker.send(b"\0")
+        except BlockingIOError:
+            pass
+
+    def add(self, client: Client) -> None:
+        """ Connects a client to its peer in the background, then serves it. """
+        self.clients[client.channel] = client
+        if client.mux is not None:
+            self.call_soon(partial(self._watch_mux, client.mux))
+        Thread(target=self._connect, args=(client,), daemon=True).start()
+
+    def attach(
+        self,
+        channel: str,
+        in_funnels: Dict[str, Connection],
+        out_spouts: Dict[str, Connection],
+        aux_funnel: Optional[Connection] = None,
+        process_id: str = "",
+    ) -> None:
+        """
+        Starts forwarding between the peer on ``channel`` and local pipes:
+        parcels received for a pipe id are written to its ``in_funnels``
+        entry, objects read from ``out_spouts`` are sent to the peer, and
+        signals for the process ``process_id`` are written to ``aux_funnel``
+        if given.
+        """
+        callback = partial(
+            self._attach, channel, in_funnels, out_spouts, aux_funnel, process_id
+        )
+
+        # From ``on_control``, the pipes must be in place for data which came
+        # in the same batch of datagrams as the process that uses them.
+        if get_ident() == self.ident:
+            callback()
+        else:
+            self.call_soon(callback)
+
+    def detach(self, channel: str, pipe_ids: List[str], process_id: str = "") -> None:
+        """ Stops forwarding for the given pipes and the process's auxiliary pipe. """
+        self.call_soon(partial(self._detach, channel, pipe_ids, process_id))
+
+    def reroute(self, channel: str, pipe_id: str, link: str) -> None:
+        """
+        Sends what a local pipe holds over ``link`` instead of to the head on
+        ``channel``, after a ``_Handover`` to the head.
+        """
+        callback = partial(self._reroute, channel, pipe_id, link)
+        if get_ident() == self.ident:
+            callback()
+        else:
+            self.call_soon(callback)
+
+    def hold(self, channel: str, pipe_id: str, link: str) -> None:
+        """
+        Also delivers messages for a local pipe from ``link``, keeping them
+        until the ``_Handover`` from the head on ``channel``.
+        """
+        callback = partial(self._hold, channel, pipe_id, link)
+        if get_ident() == self.ident:
+            callback()
+        else:
+            self.call_soon(callback)
+
+    def send(self, channel: str, obj: Any) -> None:
+        """ Sends an object to the peer on ``channel``. """
+        callback = partial(self.clients[channel].submit, obj)
+        if get_ident() == self.ident:
+            callback()
+        else:
+            self.call_soon(callback)
+
+    def start(self) -> None:
+        """ Runs the loop in a daemon thread. """
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """ Stops the loop and waits for it if it runs in a thread. """
+        self.call_soon(partial(setattr, self, "running", False))
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self) -> None:
+        """ Runs the loop in the calling thread until ``stop()``. """
+        self.running = True
+        self.ident = get_ident()
+        timeout: Optional[float] = None
+        while self.running:
+            for key, _ in self.selector.select(timeout):
+
+                # An earlier callback in the batch may have rerouted or removed
+                # the registration, so its current callback is looked up.
+                try:
+                    callback = self.selector.get_key(key.fileobj).data
+                except KeyError:
+                    continue
+                callback()
+            while self.calls:
+                self.calls.popleft()()
+            timeout = self._tick(time.monotonic())
+
+    def _tick(self, now: float) -> Optional[float]:
+        """ Fires client timers and sends, returning the next select timeout. """
+        deadlines: List[float] = []
+        for client in self.connected.values():
+            deadline = client.on_timer(client.sockfd, now)
+            if deadline is not None:
+                deadlines.append(deadline)
+            retry = client.flush(client.sockfd, now)
+            if retry is not None:
+                deadlines.append(retry)
+        if not deadlines:
+            return None
+        return max(min(deadlines) - time.monotonic(), 0.0)
+
+    def _connect(self, client: Client) -> None:
+        """ Punches a hole to the peer, then registers the socket with the loop. """
+        client.connect()
+        self.call_soon(partial(self._register, client))
+
+    def _register(self, client: Client) -> None:
+        """ Starts reading from a connected client's socket. """
+        self.connected[client.channel] = client
+        now = time.monotonic()
+        self._dispatch(client.channel, client.on_early(client.sockfd, now))
+        if client.mux is None:
+            callback = partial(self._on_datagrams, client)
+            self.selector.register(client.sockfd, selectors.EVENT_READ, callback)
+            return
+
+        # The mux socket is read already. What the peer sent since the
+        # handshake finished waits in the inbox.
+        client.mux.channels.pop(client.channel.encode("ascii"), None)
+        while not client.inbox.empty():
+            datagram, addr = client.inbox.get()
+            if addr == client.target:
+                messages = client.on_datagram(client.sockfd, memoryview(datagram), now)
+                self._dispatch(client.channel, messages)
+
+    def _watch_mux(self, mux: Mux) -> None:
+        """ Starts reading from a shared socket, unless already reading. """
+        if mux not in self.muxes:
+            self.muxes.add(mux)
+            callback = partial(self._on_mux, mux)
+            self.selector.register(mux.sock, selectors.EVENT_READ, callback)
+
+    def _on_wakeup(self) -> None:
+        """ Empties the wakeup socket. The callbacks run after the events. """
+        try:
+            while self.wakee.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _on_datagrams(self, client: Client) -> None:
+        """ Drains a batch of datagrams from a client's socket. """
+        sock = client.sockfd
+        now = time.monotonic()
+        messages: List[Tuple[Header, Buffer]] = []
+        dropped = self.ring.dropped
+        received = self.ring.drain(sock)
+        client.count_drops(
+            self.ring.dropped - dropped, self.ring.overflows.get(sock.fileno())
+        )
+        for datagram, addr in received:
+
+            # Ignore datagrams from anyone but the peer and the server.
+            if addr not in (client.target, client.master):
+                logging.info("%s: datagram from unknown sender.", client.channel)
+                client.count_drops(1, None)
+                continue
+            messages.extend(client.on_datagram(sock, datagram, now))
+        self._dispatch(client.channel, messages)
+
+    def _on_mux(self, mux: Mux) -> None:
+        """ Drains a batch of datagrams from a shared socket. """
+        now = time.monotonic()
+        dropped = self.ring.dropped
+        received = self.ring.drain(mux.sock)
+        mux.dropped += self.ring.dropped - dropped
+        for datagram, addr in received:
+            client = mux.find(datagram, addr)
+            if client is None:
+                mux.dropped += 1
+            elif client.channel in self.connected:
+                messages = client.on_datagram(mux.sock, datagram, now)
+                self._dispatch(client.channel, messages)
+            else:
+                client.inbox.put((bytes(datagram), addr))
+
+    def _dispatch(self, channel: str, messages: List[Tuple[Header, Buffer]]) -> None:
+        """
+        Routes the messages received on a link. Data is forwarded before the
+        ring wraps around. Control messages may be kept by ``on_control``, so
+        they get their own copy.
+
+        A message which cannot be unpickled or handled, e.g. a process whose
+        target this host cannot import, is logged and counted in the link's
+        ``failures``, and the loop carries on with the next.
+        """
+        for header, message in messages:
+            try:
+                if header.flags & RAW:
+                    self._route_bytes(channel, str(header.pipe_id), message)
+                elif header.msg_type == DATA:
+                    self._route(channel, loads(message))
+                else:
+                    self._route(channel, loads(bytes(message)))
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("ENGINE: failed to handle a message on %s.", channel)
+                self.clients[channel].metrics.values[FAILURES] += 1
+
+    def _route_bytes(self, channel: str, pipe_id: str, message: Buffer) -> None:
+        """
+        Writes a message serialized by ``mead.Funnel`` straight to its pipe,
+        or keeps a copy while the pipe waits for its ``_Handover``.
+        """
+        writer = self.funnels.get(channel, {}).get(pipe_id)
+        if writer is None:
+            logging.info("ENGINE: no pipe %s on %s.", pipe_id, channel)
+            return
+        held = self.held.get((channel, pipe_id))
+        if held is not None:
+            held.append(bytes(message))
+            return
+        self._write(writer, message)
+
+    def _route(self, channel: str, obj: Any) -> None:
+        """ Delivers a received object to a pipe, the aux pipe or ``on_control``. """
+        if isinstance(obj, Parcel):
+            self._route_bytes(channel, obj.pipe_id, ForkingPickler.dumps(obj.obj))
+        elif (
+            isinstance(obj, (_Join, _Terminate, _Kill))
+            and (channel, obj.process_id) in self.aux
+        ):
+            self._write(self.aux[channel, obj.process_id], ForkingPickler.dumps(obj))
+        elif isinstance(obj, _Stats):
+            cellar.REMOTE_STATS[obj.hostname] = obj.stats
+        elif isinstance(obj, _Handover):
+            self._handover(channel, obj)
+        elif self.on_control is not None:
+            self.on_control(channel, obj)
+        else:
+            logging.info("ENGINE: unhandled message: %s", type(obj).__name__)
+
+    def _write(self, writer: _Writer, data: Buffer) -> None:
+        """ Writes to a pipe, waiting for writability if the pipe is full. """
+        writer.send_bytes(data)
+        self._watch(writer)
+
+    def _on_writable(self, writer: _Writer) -> None:
+        """ Resumes a blocked pipe write. """
+        writer.drain()
+        self._watch(writer)
+
+    def _watch(self, writer: _Writer) -> None:
+        """ Waits for writability exactly while a pipe has pending data. """
+        if writer.pending and not writer.watched:
+            callback = partial(self._on_writable, writer)
+            self.selector.register(writer.conn, selectors.EVENT_WRITE, callback)
+            writer.watched = True
+        elif not writer.pending and writer.watched:
+            self.selector.unregister(writer.conn)
+            writer.watched = False
+
+    def _on_spout(self, channel: str, pipe_id: str, reader: _Reader) -> None:
+        """ Forwards the objects a local pipe holds to the peer. """
+        messages = reader.read()
+        if messages is None:
+            logging.info("ENGINE: pipe %s closed.", pipe_id)
+            self.selector.unregister(reader.conn)
+            del self.spouts[channel][pipe_id]
+            return
+        if channel == LOOPBACK:
+            for data in messages:
+                self._route_bytes(channel, pipe_id, data)
+            return
+        self._forward(channel, pipe_id, messages)
+
+    def _forward(self, channel: str, pipe_id: str, messages: List[bytes]) -> None:
+        """ Sends messages read from a local pipe to the peer. """
+        client = self.clients[channel]
+
+        # Bytes from ``mead.Funnel`` go out as is, tagged only by the header.
+        coalesce = pipe_id not in cellar.NO_COALESCE
+        for data in messages:
+            if cellar.SERIALIZE_ONCE:
+                codec = codec_of(data)
+                client.queue(DATA, int(pipe_id), [data], RAW, codec, coalesce)
+            else:
+                obj = ForkingPickler.loads(data)
+                assert not isinstance(obj, Parcel)
+                client.submit(Parcel(pipe_id, obj), coalesce)
+
+    def _attach(
+        self,
+        channel: str,
+        in_funnels: Dict[str, Connection],
+        out_spouts: Dict[str, Connection],
+        aux_funnel: Optional[Connection],
+        process_id: str,
+    ) -> None:
+        """ Loop-thread half of ``attach()``. """
+        funnels = self.funnels.setdefault(channel, {})
+        for pipe_id, funnel in in_funnels.items():
+            funnels[pipe_id] = _Writer(funnel)
+        spouts = self.spouts.setdefault(channel, {})
+        for pipe_id, spout in out_spouts.items():
+            reader = spouts[pipe_id] = _Reader(spout)
+            callback = partial(self._on_spout, channel, pipe_id, reader)
+            self.selector.register(spout, selectors.EVENT_READ, callback)
+        if aux_funnel is not None:
+            self.aux[channel, process_id] = _Writer(aux_funnel)
+
+    def _detach(self, channel: str, pipe_ids: List[str], process_id: str) -> None:
+        """ Loop-thread half of ``detach()``, also for pipes rerouted to a link. """
+        writers: Dict[int, _Writer] = {}
+        readers: List[_Reader] = []
+        for pipe_id in pipe_ids:
+            for name in {channel, self.routes.pop(pipe_id, channel)}:
+                writer = self.funnels.get(name, {}).pop(pipe_id, None)
+                if writer is not None:
+                    writers[id(writer)] = writer
+                reader = self.spouts.get(name, {}).pop(pipe_id, None)
+                if reader is not None:
+                    readers.append(reader)
+                self.held.pop((name, pipe_id), None)
+        aux = self.aux.pop((channel, process_id), None)
+        if aux is not None:
+            writers[id(aux)] = aux
+        for writer in writers.values():
+            if writer.watched:
+                self.selector.unregister(writer.conn)
+        for reader in readers:
+            self.selector.unregister(reader.conn)
+
+    def _reroute(self, channel: str, pipe_id: str, link: str) -> None:
+        """
+        Loop-thread half of ``reroute()``. Whatever was read from the pipe has
+        gone to the head ahead of the ``_Handover``, and a partial message
+        stays with its reader.
+        """
+        reader = self.spouts.get(channel, {}).pop(pipe_id, None)
+        if reader is not None:
+            callback = partial(self._on_spout, link, pipe_id, reader)
+            self.selector.modify(reader.conn, selectors.EVENT_READ, callback)
+            self.spouts.setdefault(link, {})[pipe_id] = reader
+            self.routes[pipe_id] = link
+        self.clients[channel].submit(_Handover(pipe_id, link))
+
+    def _hold(self, channel: str, pipe_id: str, link: str) -> None:
+        """ Loop-thread half of ``hold()``. """
+        writer = self.funnels.get(channel, {}).get(pipe_id)
+        if writer is None:
+            logging.info("ENGINE: no pipe %s on %s to hold.", pipe_id, channel)
+            return
+        self.funnels.setdefault(link, {})[pipe_id] = writer
+        self.held[link, pipe_id] = []
+        self.routes[pipe_id] = link
+
+    def _handover(self, channel: str, obj: _Handover) -> None:
+        """
+        On the receiving worker, writes the messages kept for a direct pipe
+        once the head has relayed the rest, and stops taking it from the head.
+        On the head, relays the rest of a pipe whose sender has switched to
+        the direct link, then passes the ``_Handover`` on to the receiver.
+        """
+        held = self.held.pop((obj.link, obj.pipe_id), None)
+        if held is not None:
+            self.funnels.get(channel, {}).pop(obj.pipe_id, None)
+            writer = self.funnels.get(obj.link, {}).get(obj.pipe_id)
+            if writer is not None:
+                for data in held:
+                    self._write(writer, data)
+            return
+
+        # The head writes what came from the sender into the pipe, and reads it
+        # back to send to the receiver, so both ends are flushed together.
+        writer = self.funnels.get(channel, {}).pop(obj.pipe_id, None)
+        if writer is not None and writer.watched:
+            self.selector.unregister(writer.conn)
+            writer.watched = False
+        receivers = [name for name, ends in self.spouts.items() if obj.pipe_id in ends]
+        if not receivers:
+            logging.info("ENGINE: no receiver for pipe %s.", obj.pipe_id)
+            return
+        receiver = receivers[0]
+        reader = self.spouts[receiver].pop(obj.pipe_id)
+        while True:
+            if writer is not None:
+                writer.drain()
+            buffered = len(reader.buffer)
+            messages = reader.read()
+            if messages is None:
+                break
+            self._forward(receiver, obj.pipe_id, messages)
+            if messages or (writer is not None and writer.pending):
+                continue
+            if not reader.buffer:
+                break
+            if len(reader.buffer) == buffered:
+
+                # Only a process on the head can finish the partial message,
+                # so the reader keeps it and waits without holding up the loop.
+                callback = partial(self._finish_handover, receiver, obj, reader)
+                self.selector.modify(reader.conn, selectors.EVENT_READ, callback)
+                return
+        self.selector.unregister(reader.conn)
+        self.clients[receiver].submit(obj)
+
+    def _finish_handover(self, receiver: str, obj: _Handover, reader: _Reader) -> None:
+        """
+        Forwards the rest of a partial message left in a relayed pipe, then
+        passes the ``_Handover`` on to the receiver.
+        """
+        messages = reader.read()
+        if messages:
+            self._forward(receiver, obj.pipe_id, messages)
+        if messages is None or not reader.buffer:
+            self.selector.unregister(reader.conn)
+            self.clients[receiver].submit(obj)
@@ -0,0 +1,482 @@
+""" A ``concurrent.futures``-style executor over ``mead.Process`` workers. """
+import time
+import pickle
+import logging
+import itertools
+from typing import Any, Dict, List, Deque, Tuple, Callable, Iterable, Iterator, Optional
+from threading import Condition, Thread
+from collections import deque
+from concurrent.futures import Future, BrokenExecutor, as_completed
+
+from mead import cellar
+from mead.classes import Pipe, Funnel, Spout
+from mead.process import Process
+
+# pylint: disable=too-few-public-methods
+
+# Seconds of work a batch should hold, once a worker's speed is known, so
+# that the round trip to the worker is small next to the work.
+TARGET_SECONDS = 0.05
+
+# Largest number of calls in a batch.
+MAX_CHUNK = 1024
+
+# Batches sent to a worker before it returns the first, so it never waits on
+# the round trip between batches.
+DEPTH = 2
+
+# Weight of the latest batch in a worker's seconds-per-call estimate.
+ALPHA = 0.3
+
+# A batch running this many times longer than its worker's estimate, plus
+# ``SPECULATE_SLACK`` seconds, is sent again to an idle worker.
+SPECULATE_FACTOR = 3.0
+SPECULATE_SLACK = 0.1
+
+# Seconds an idle worker waits for work before it looks for stragglers.
+POLL = 0.02
+
+# Seconds between checks that a worker which owes results is still there.
+CHECK_INTERVAL = 1.0
+
+# Keepalive intervals a host may stay silent before its workers are lost.
+SILENT_INTERVALS = 3.0
+
+
+class _Call:
+    """ A call submitted to an ``Executor``, and the future of its result. """
+
+    def __init__(
+        self,
+        future: Future,
+        fn: Callable[..., Any],
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        chunksize: Optional[int] = None,
+    ):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.chunksize = chunksize
+
+        # Whether the future was marked running, which happens only once even
+        # if the call is sent again after its worker is lost.
+        self.running = False
+
+
+class _Batch:
+    """ Calls of one function sent to a worker in one message. """
+
+    def __init__(self, calls: List[_Call]):
+        self.calls = calls
+        self.done = False
+        self.copies = 1
+
+        # When the worker which got the batch started on it, if it has.
+        self.started: Optional[float] = None
+
+
+class _Worker:
+    """ A ``mead.Process`` running ``serve()``, and what it has been sent. """
+
+    def __init__(self, hostname: str, process: Process, tasks: Funnel, results: Spout):
+        self.hostname = hostname
+        self.process = process
+        self.tasks = tasks
+        self.results = results
+        self.outstanding: Deque[Tuple[int, _Batch]] = deque()
+        self.alive = True
+
+        # Estimated seconds per call, from the times the worker reports.
+        self.seconds_per_call: Optional[float] = None
+        self.calls = 0
+        self.batches = 0
+
+    def chunk(self, queued: int, workers: int) -> int:
+        """
+        Returns how many calls to send next: enough for ``TARGET_SECONDS`` of
+        work, but no more than half a fair share of the ``queued`` calls, so
+        that the last batches are small and finish together.
+        """
+        if self.seconds_per_call is None:
+            by_speed = 1
+        elif self.seconds_per_call <= 0:
+            by_speed = MAX_CHUNK
+        else:
+            by_speed = int(TARGET_SECONDS / self.seconds_per_call)
+        guided = -(-queued // (2 * workers))
+        return max(1, min(by_speed, guided, MAX_CHUNK))
+
+    def expected(self, batch: _Batch) -> Optional[float]:
+        """ Returns the seconds ``batch`` should take here, if known. """
+        if self.seconds_per_call is None:
+            return None
+        return self.seconds_per_call * len(batch.calls)
+
+
+def serve(tasks: Spout, results: Funnel) -> None:
+    """
+    Runs batches of calls until ``None`` is received, replying to each with
+    its outcomes and the seconds spent on it. Runs on the worker.
+    """
+    while True:
+        batch = tasks.recv()
+        if batch is None:
+            return
+        batch_id, fn, calls = batch
+        start = time.perf_counter()
+        outcomes: List[Tuple[bool, Any]] = []
+        for args, kwargs in calls:
+            try:
+                outcomes.append((True, fn(*args, **kwargs)))
+            except Exception as err:  # pylint: disable=broad-except
+                outcomes.append((False, _picklable(err)))
+        results.send((batch_id, outcomes, time.perf_counter() - start))
+
+
+def _picklable(err: Exception) -> Exception:
+    """ Returns ``err``, or a ``RuntimeError`` describing it if unpicklable. """
+    try:
+        pickle.dumps(err)
+    except Exception:  # pylint: disable=broad-except
+        return RuntimeError(repr(err))
+    return err
+
+
+class Executor:
+    """
+    Runs calls on the hosts given to ``mead.init()``, like the executors of
+    ``concurrent.futures``. Calls are sent in batches whose size follows the
+    speed each worker has shown, and workers take batches as they become
+    free, so fast hosts do more of the work. Once nothing is queued, an idle
+    worker also runs any batch that is far behind its estimate elsewhere, and
+    the first result is kept, so a slow or lost host does not hold up the
+    rest. Such calls may therefore run twice.
+
+    Functions and arguments are pickled, so functions must be importable on
+    the workers. Without the ``engine`` transport option, use one worker per
+    remote host.
+
+    Parameters
+    ----------
+    hostnames : ``Optional[List[str]]``.
+        Hosts to run workers on, by default all of ``cellar.HOSTNAMES``.
+    workers_per_host : ``int``.
+        Number of worker processes on each host, e.g. one per core.
+    speculate : ``bool``.
+        Whether to run stragglers again on idle workers.
+    timeout : ``Optional[float]``.
+        Seconds a worker may take over a batch before it is taken for lost
+        and its calls are sent elsewhere, by default no limit. Workers are
+        also lost once their host stops answering keepalives, or their
+        local process exits.
+    """
+
+    def __init__(
+        self,
+        hostnames: Optional[List[str]] = None,
+        workers_per_host: int = 1,
+        speculate: bool = True,
+        timeout: Optional[float] = None,
+    ):
+        hostnames = list(cellar.HOSTNAMES) if hostnames is None else hostnames
+        if not hostnames or workers_per_host < 1:
+            raise ValueError("An executor needs at least one host and worker.")
+        self.speculate = speculate
+        self.timeout = timeout
+        self.queue: Deque[_Call] = deque()
+        self.condition = Condition()
+        self.shutting_down = False
+        self.batch_ids = itertools.count()
+
+        self.workers: List[_Worker] = []
+        for hostname in hostnames:
+            for _ in range(workers_per_host):
+                task_funnel, task_spout = Pipe()
+                result_funnel, result_spout = Pipe()
+                process = Process(
+                    target=serve, hostname=hostname, args=(task_spout, result_funnel)
+                )
+                process.start()
+                self.workers.append(
+                    _Worker(hostname, process, task_funnel, result_spout)
+                )
+
+        self.threads = [
+            Thread(target=self._dispatch, args=(worker,), daemon=True)
+            for worker in self.workers
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self) -> "Executor":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.shutdown(wait=True)
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """ Schedules ``fn(*args, **kwargs)``, returning a future of its result. """
+        future: Future = Future()
+        self._enqueue([_Call(future, fn, args, kwargs)])
+        return future
+
+    def map(
+        self,
+        fn: Callable[..., Any],
+        *iterables: Iterable[Any],
+        timeout: Optional[float] = None,
+        chunksize: Optional[int] = None,
+    ) -> Iterator[Any]:
+        """
+        Returns an iterator of ``fn`` applied to the items of ``iterables``,
+        in order, like ``map()``. Calls are batched by each worker's speed
+        unless ``chunksize`` fixes the size of every batch.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        calls = [_Call(Future(), fn, args, {}, chunksize) for args in zip(*iterables)]
+        self._enqueue(calls)
+
+        def results() -> Iterator[Any]:
+            """ Yields the results in order, cancelling the rest on an error. """
+            try:
+                for call in calls:
+                    if deadline is None:
+                        yield call.future.result()
+                    else:
+                        yield call.future.result(deadline - time.monotonic())
+            finally:
+                for call in calls:
+                    call.future.cancel()
+
+        return results()
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False) -> None:
+        """
+        Stops accepting calls, and once the queued ones are done, stops the
+        workers. With ``cancel_futures``, queued calls are cancelled instead.
+        """
+        with self.condition:
+            self.shutting_down = True
+            if cancel_futures:
+                while self.queue:
+                    self.queue.popleft().future.cancel()
+            self.condition.notify_all()
+        if not wait:
+            return
+        for thread in self.threads:
+            thread.join()
+        for worker in self.workers:
+            if worker.alive:
+                worker.process.join()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns, per worker, its host, the calls and batches it has run, its
+        estimated seconds per call, and whether it is still in use.
+        """
+        with self.condition:
+            return {
+                str(index): {
+                    "hostname": worker.hostname,
+                    "calls": worker.calls,
+                    "batches": worker.batches,
+                    "seconds_per_call": worker.seconds_per_call,
+                    "alive": worker.alive,
+                }
+                for index, worker in enumerate(self.workers)
+            }
+
+    def _enqueue(self, calls: List[_Call]) -> None:
+        """ Queues calls for the workers. """
+        with self.condition:
+            if self.shutting_down:
+                raise RuntimeError("Cannot schedule new calls after shutdown.")
+            if not any(worker.alive for worker in self.workers):
+                raise BrokenExecutor("Every worker of the executor has failed.")
+            self.queue.extend(calls)
+            self.condition.notify_all()
+
+    def _next_batch(self, worker: _Worker, idle: bool) -> Optional[_Batch]:
+        """
+        Takes the next calls for ``worker`` off the queue, or if nothing is
+        queued and the worker is ``idle``, a straggler from another worker.
+        Called with the lock held.
+        """
+        calls: List[_Call] = []
+        size = 0
+        while self.queue:
+            call = self.queue[0]
+            if calls and (call.fn is not calls[0].fn or len(calls) >= size):
+                break
+            self.queue.popleft()
+            if not call.running:
+                if not call.future.set_running_or_notify_cancel():
+                    continue
+                call.running = True
+            if not calls:
+                live = sum(1 for other in self.workers if other.alive)
+                size = call.chunksize or worker.chunk(len(self.queue) + 1, live)
+            calls.append(call)
+        if calls:
+            return _Batch(calls)
+        if self.speculate and idle:
+            return self._straggler(worker)
+        return None
+
+    def _straggler(self, worker: _Worker) -> Optional[_Batch]:
+        """
+        Returns a batch from the worker furthest behind its estimate, if any
+        is: the first there which no other worker has finished or taken.
+        """
+        now = time.monotonic()
+        worst, worst_lag = None, 0.0
+        for other in self.workers:
+            if other is worker or not other.outstanding:
+                continue
+
+            # Batches queued behind a late one are as late.
+            _, head = other.outstanding[0]
+            expected = other.expected(head)
+            if head.started is None or expected is None:
+                continue
+            lag = now - head.started - (SPECULATE_FACTOR * expected + SPECULATE_SLACK)
+            if lag <= worst_lag:
+                continue
+            for _, batch in other.outstanding:
+                if not batch.done and batch.copies == 1:
+                    worst, worst_lag = batch, lag
+                    break
+        if worst is not None:
+            worst.copies += 1
+            logging.info("EXECUTOR: %s runs a straggler again.", worker.hostname)
+        return worst
+
+    def _dispatch(self, worker: _Worker) -> None:
+        """
+        Keeps up to ``DEPTH`` batches with ``worker``, and resolves the futures
+        of each as its results arrive. Runs in a thread per worker.
+        """
+        while True:
+            sends: List[Tuple[int, _Batch]] = []
+            with self.condition:
+                while True:
+                    while len(worker.outstanding) + len(sends) < DEPTH:
+                        idle = not worker.outstanding and not sends
+                        batch = self._next_batch(worker, idle)
+                        if batch is None:
+                            break
+                        sends.append((next(self.batch_ids), batch))
+                    if sends or worker.outstanding:
+                        break
+                    if self.shutting_down and not self.queue:
+                        break
+                    self.condition.wait(POLL if self.speculate else None)
+                if not sends and not worker.outstanding:
+                    break
+                if not worker.outstanding and sends:
+                    sends[0][1].started = time.monotonic()
+                worker.outstanding.extend(sends)
+
+            try:
+                for batch_id, batch in sends:
+                    calls = [(call.args, call.kwargs) for call in batch.calls]
+                    worker.tasks.send((batch_id, batch.calls[0].fn, calls))
+                while not worker.results.poll(CHECK_INTERVAL):
+                    reason = self._lost(worker)
+                    if reason is not None and not worker.results.poll():
+                        raise TimeoutError(reason)
+                batch_id, outcomes, seconds = worker.results.recv()
+            except (OSError, EOFError) as err:
+                logging.info("EXECUTOR: lost worker on %s: %s", worker.hostname, err)
+                self._fail(worker)
+                return
+            self._resolve(worker, batch_id, outcomes, seconds)
+
+        # Nothing is left, so the worker can exit.
+        try:
+            worker.tasks.send(None)
+        except OSError as err:
+            logging.info("EXECUTOR: lost worker on %s: %s", worker.hostname, err)
+            worker.alive = False
+
+    def _lost(self, worker: _Worker) -> Optional[str]:
+        """ Returns why ``worker`` is taken for lost, if it is. """
+        if worker.process.local:
+            if not worker.process.p_local.is_alive():
+                return "the process exited"
+        else:
+            client = cellar.HEAD_CLIENTS.get(worker.hostname)
+            if client is not None:
+                stats = client.peer_stats()
+                interval = stats["keepalive_interval"]
+                if interval > 0 and stats["idle"] > SILENT_INTERVALS * interval:
+                    return "the host is silent for %.1f seconds" % stats["idle"]
+        if self.timeout is not None:
+            with self.condition:
+                started = worker.outstanding[0][1].started
+            if started is not None and time.monotonic() - started > self.timeout:
+                return "no batch returned in %.1f seconds" % self.timeout
+        return None
+
+    def _resolve(
+        self,
+        worker: _Worker,
+        batch_id: int,
+        outcomes: List[Tuple[bool, Any]],
+        seconds: float,
+    ) -> None:
+        """ Completes the futures of a batch, unless a copy already has. """
+        with self.condition:
+            # A worker runs its batches in the order they were sent.
+            sent_id, batch = worker.outstanding.popleft()
+            assert sent_id == batch_id
+            if worker.outstanding:
+                worker.outstanding[0][1].started = time.monotonic()
+
+            per_call = seconds / max(1, len(outcomes))
+            if worker.seconds_per_call is None:
+                worker.seconds_per_call = per_call
+            else:
+                worker.seconds_per_call += ALPHA * (per_call - worker.seconds_per_call)
+            worker.calls += len(outcomes)
+            worker.batches += 1
+
+            if batch.done:
+                return
+            batch.done = True
+            self.condition.notify_all()
+        for call, (ok, value) in zip(batch.calls, outcomes):
+            if ok:
+                call.future.set_result(value)
+            else:
+                call.future.set_exception(value)
+
+    def _fail(self, worker: _Worker) -> None:
+        """
+        Gives the unfinished calls of a lost worker back to the queue, or fails
+        every queued call if no worker is left.
+        """
+        with self.condition:
+            worker.alive = False
+            for _, batch in reversed(worker.outstanding):
+                if batch.done:
+                    continue
+                batch.copies -= 1
+                if batch.copies == 0:
+                    batch.done = True
+                    self.queue.extendleft(reversed(batch.calls))
+            worker.outstanding.clear()
+            if not any(other.alive for other in self.workers):
+                broken = BrokenExecutor("Every worker of the executor has failed.")
+                while self.queue:
+
+                    # Calls given back by a lost worker are marked running.
+                    call = self.queue.popleft()
+                    if call.running or call.future.set_running_or_notify_cancel():
+                        call.future.set_exception(broken)
+            self.condition.notify_all()
+
+
+__all__: List[str] = ["Executor", "as_completed"]
@@ -0,0 +1,274 @@
+""" Binary wire header, fragmentation and reassembly of messages. """
+import time
+import struct
+import logging
+from typing import Dict, List, Tuple, Union, Iterator, Optional, Sequence, NamedTuple
+
+# pylint: disable=too-few-public-methods
+
+# Every datagram starts with a fixed binary header:
+#   magic, version, message type, flags, the tag of the codec which
+#   serialized the message, pipe id, sequence number, total message length,
+#   the offset of this chunk within the message, and the packet number used
+#   for acknowledgement.
+HEADER = struct.Struct("!HBBBBIIIII")
+MAGIC = 0x4D44
+VERSION = 4
+
+# Message types.
+DATA = 0
+CONTROL = 1
+REFRESH = 2
+CONFIRM = 3
+ACK = 4
+BATCH = 5
+
+# Header flags. ``RAW`` marks a payload already serialized by ``mead.Funnel``,
+# which is forwarded as opaque bytes to the pipe named in the header.
+RELIABLE = 0x01
+RAW = 0x02
+
+# Pipe id used for messages which do not belong to a ``mead.Pipe``.
+NO_PIPE = 0xFFFFFFFF
+
+# A ``BATCH`` message packs several small messages, each preceded by an entry
+# header: message type, flags, codec tag, pipe id and length.
+ENTRY = struct.Struct("!BBBIH")
+
+# Stay under a 1500-byte Ethernet MTU once the IP and UDP headers are counted,
+# so that the kernel never has to IP-fragment a chunk.
+MTU = 1500
+IP_UDP_OVERHEAD = 20 + 8
+CHUNK_SIZE = MTU - IP_UDP_OVERHEAD - HEADER.size
+
+# Largest datagram we will ever read off the socket.
+MAX_DATAGRAM = 65535
+
+# Reassembly defaults: bytes held in incomplete messages, and seconds without
+# a new chunk before an incomplete message is abandoned.
+REASSEMBLY_BUDGET = 256 * 2 ** 20
+REASSEMBLY_TIMEOUT = 10.0
+
+# Number of completed message ids remembered to discard late duplicates.
+COMPLETED_HISTORY = 1024
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class Header(NamedTuple):
+    """ A decoded wire header. """
+
+    msg_type: int
+    pipe_id: int
+    seq: int
+    length: int
+    offset: int = 0
+    flags: int = 0
+    packet: int = 0
+    codec: int = 0
+
+
+def pack_header(
+    msg_type: int,
+    pipe_id: int,
+    seq: int,
+    length: int,
+    offset: int = 0,
+    flags: int = 0,
+    packet: int = 0,
+    codec: int = 0,
+) -> bytes:
+    """ Packs a wire header. Arguments are in the same order as ``Header``. """
+    return HEADER.pack(
+        MAGIC, VERSION, msg_type, flags, codec, pipe_id, seq, length, offset, packet
+    )
+
+
+def unpack_header(datagram: Buffer) -> Header:
+    """ Unpacks and validates the header at the start of ``datagram``. """
+    if len(datagram) < HEADER.size:
+        raise ValueError("datagram shorter than header")
+    magic, version, msg_type, flags, codec, *fields = HEADER.unpack_from(datagram)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("bad magic or version: %x/%d" % (magic, version))
+    pipe_id, seq, length, offset, packet = fields
+    if offset + len(datagram) - HEADER.size > length:
+        raise ValueError("chunk overruns message length")
+    return Header(msg_type, pipe_id, seq, length, offset, flags, packet, codec)
+
+
+def fragment(
+    msg_type: int,
+    pipe_id: int,
+    seq: int,
+    segments: Sequence[Buffer],
+    chunk_size: int = CHUNK_SIZE,
+    flags: int = 0,
+    codec: int = 0,
+) -> Iterator[Tuple[Header, List[memoryview]]]:
+    """
+    Yields ``(header, pieces)`` pairs, one per datagram. The message is the
+    concatenation of ``segments``, and each datagram's chunk is a list of
+    views onto them, so nothing is copied before ``socket.sendmsg``.
+    """
+    views = [memoryview(segment).cast("B") for segment in segments]
+    length = sum(len(view) for view in views)
+    offset = 0
+    index = 0
+    pos = 0
+    while True:
+        pieces: List[memoryview] = []
+        need = chunk_size
+        while need and index < len(views):
+            piece = views[index][pos : pos + need]
+            if piece:
+                pieces.append(piece)
+            need -= len(piece)
+            pos += len(piece)
+            if pos >= len(views[index]):
+                index += 1
+                pos = 0
+        yield Header(msg_type, pipe_id, seq, length, offset, flags, 0, codec), pieces
+        offset += chunk_size - need
+        if offset >= length:
+            break
+
+
+def batch(
+    entries: Sequence[Tuple[int, int, Sequence[Buffer], int, int]]
+) -> List[Buffer]:
+    """
+    Packs ``(msg_type, pipe_id, segments, flags, codec)`` entries into the
+    segments of one ``BATCH`` message, without copying their segments.
+    """
+    segments: List[Buffer] = []
+    for msg_type, pipe_id, parts, flags, codec in entries:
+        length = sum(memoryview(part).nbytes for part in parts)
+        segments.append(ENTRY.pack(msg_type, flags, codec, pipe_id, length))
+        segments.extend(parts)
+    return segments
+
+
+def unbatch(header: Header, message: Buffer) -> List[Tuple[Header, Buffer]]:
+    """ Unpacks a ``BATCH`` message into headers and views of its messages. """
+    view = memoryview(message)
+    messages: List[Tuple[Header, Buffer]] = []
+    pos = 0
+    while pos < len(view):
+        if pos + ENTRY.size > len(view):
+            raise ValueError("truncated batch entry")
+        msg_type, flags, codec, pipe_id, length = ENTRY.unpack_from(view, pos)
+        pos += ENTRY.size
+        if pos + length > len(view):
+            raise ValueError("batch entry overruns message")
+        entry = Header(msg_type, pipe_id, header.seq, length, 0, flags, 0, codec)
+        messages.append((entry, view[pos : pos + length]))
+        pos += length
+    return messages
+
+
+class _Partial:
+    """ A message buffer which is filled in as chunks arrive. """
+
+    def __init__(self, length: int):
+        self.buffer = bytearray(length)
+        self.offsets: Dict[int, None] = {}
+        self.received = 0
+        self.touched = time.monotonic()
+
+
+class Reassembler:
+    """
+    Collects chunks produced by ``fragment()`` back into whole messages.
+
+    Parameters
+    ----------
+    budget : ``int``.
+        Upper bound on the bytes held by incomplete messages. When a new
+        message would exceed it, the least recently active ones are evicted.
+    timeout : ``float``.
+        Seconds without a new chunk after which an incomplete message is
+        abandoned. Timed-out and evicted messages are counted in ``abandoned``.
+    """
+
+    def __init__(
+        self, budget: int = REASSEMBLY_BUDGET, timeout: float = REASSEMBLY_TIMEOUT
+    ):
+        self.budget = budget
+        self.timeout = timeout
+        self.used = 0
+        self.partials: Dict[int, _Partial] = {}
+        self.completed: Dict[int, None] = {}
+        self.abandoned = 0
+
+    def add(self, header: Header, chunk: Buffer) -> Optional[Buffer]:
+        """ Stores a chunk, returning the whole message once it is complete. """
+        if header.offset == 0 and len(chunk) == header.length:
+            return chunk
+
+        self.expire()
+
+        seq = header.seq
+        partial = self.partials.get(seq)
+        if partial is None:
+            if seq in self.completed:
+                return None
+            partial = self._reserve(seq, header.length)
+            if partial is None:
+                return None
+        if len(partial.buffer) != header.length:
+            logging.info("REASSEMBLY: length mismatch for %d.", seq)
+            return None
+
+        # Ignore duplicates.
+        if header.offset in partial.offsets:
+            return None
+        partial.offsets[header.offset] = None
+        partial.buffer[header.offset : header.offset + len(chunk)] = chunk
+        partial.received += len(chunk)
+        if partial.received < header.length:
+
+            # Keep partials ordered by most recent activity.
+            partial.touched = time.monotonic()
+            del self.partials[seq]
+            self.partials[seq] = partial
+            return None
+
+        self._release(seq)
+        self.completed[seq] = None
+        if len(self.completed) > COMPLETED_HISTORY:
+            del self.completed[next(iter(self.completed))]
+        return partial.buffer
+
+    def expire(self) -> None:
+        """ Drops incomplete messages idle for longer than ``self.timeout``. """
+        deadline = time.monotonic() - self.timeout
+
+        # Partials are stored in activity order, so stop at the first fresh one.
+        while self.partials:
+            seq, partial = next(iter(self.partials.items()))
+            if partial.touched > deadline:
+                break
+            logging.info("REASSEMBLY: message %d timed out.", seq)
+            self.abandoned += 1
+            self._release(seq)
+
+    def _reserve(self, seq: int, length: int) -> Optional[_Partial]:
+        """ Allocates a partial message, evicting old ones to stay under budget. """
+        if length > self.budget:
+            logging.info("REASSEMBLY: message %d exceeds budget.", seq)
+            return None
+        while self.partials and self.used + length > self.budget:
+            idlest = next(iter(self.partials))
+            logging.info("REASSEMBLY: evicting message %d.", idlest)
+            self.abandoned += 1
+            self._release(idlest)
+        partial = _Partial(length)
+        self.partials[seq] = partial
+        self.used += length
+        return partial
+
+    def _release(self, seq: int) -> None:
+        """ Forgets a partial message and returns its budget. """
+        partial = self.partials.pop(seq)
+        self.used -= len(partial.buffer)
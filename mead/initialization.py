@@ -1,17 +1,32 @@
 """ Functions for initializing client connections. """
 import os
+import time
 import json
+import base64
 import socket
 import multiprocessing as mp
-from typing import Dict, Mapping
+from typing import Any, Dict, List, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import stun
 from pssh.utils import read_openssh_config
 from pssh.clients import ParallelSSHClient
 
 from mead import cellar
-from mead.utils import get_available_hostnames_from_sshconfig
+from mead.utils import is_local_host, get_available_hostnames_from_sshconfig
+from mead.mux import Mux
 from mead.client import Client
+from mead.engine import Engine
+
+# Seconds for which an external address found by STUN is reused.
+STUN_TTL = 300.0
+
+# Seconds a STUN lookup through a shared head socket waits for each answer,
+# as ``stun.get_ip_info()`` does on a socket of its own.
+STUN_TIMEOUT = 2.0
+
+# Most hosts whose STUN discovery or SSH session run at once.
+MAX_PARALLEL = 128
 
 
 def init(config_path: str = "~/config.json") -> None:
@@ -21,6 +36,7 @@ def init(config_path: str = "~/config.json") -> None:
         server_ip = config["server_ip"]
         port = config["port"]
         hosts = config.get("hostnames", [])
+        transport = config.get("transport", {})
 
     # Per-host config dictionaries.
     host_config = {}
@@ -38,65 +54,216 @@ def init(config_path: str = "~/config.json") -> None:
     cellar.HOSTNAMES = hosts
     print("Hosts:", hosts)
 
+    # Processes on this machine bypass the network, so it needs no client.
+    hosts = [hostname for hostname in hosts if not is_local_host(hostname)]
+
     # Get private key.
     pkey = os.path.expanduser("~/.ssh/id_rsa")
 
-    # Start the ssh client.
-    sshclient = ParallelSSHClient(hosts, host_config=host_config, pkey=pkey)
+    # Start the ssh client, with a session per host at once.
+    pool_size = max(1, min(len(hosts), MAX_PARALLEL))
+    sshclient = ParallelSSHClient(
+        hosts, host_config=host_config, pkey=pkey, pool_size=pool_size
+    )
 
-    # Reserve local UDP ports for each remote node.
+    # Reserve local UDP ports for each remote node and discover their external
+    # addresses in the background while the head clients start. Shared head
+    # sockets are bound first and looked up once each, through the socket
+    # itself, which must happen before the engine reads from it.
     # TODO: Address possibility that ports are already in-use by another program.
     # HARDCODE
-    i = 50000
+    start = time.perf_counter()
+    timings: Dict[str, float] = {}
+    pool = ThreadPoolExecutor(max_workers=pool_size)
+    muxes = [Mux() for _ in range(_head_sockets(transport))]
+    if muxes:
+        lookups = [
+            pool.submit(_timed_discover, mux.sock.getsockname()[1], mux.sock)
+            for mux in muxes
+        ]
+        wait(lookups)
+        futures = {name: lookups[i % len(muxes)] for i, name in enumerate(hosts)}
+    else:
+        futures = {
+            name: pool.submit(_timed_discover, 50000 + i)
+            for i, name in enumerate(hosts)
+        }
+
+    # Clients wait on the rendezvous server for their peers concurrently.
+    phase = time.perf_counter()
+    start_clients(server_ip, port, hosts, transport, muxes)
+    timings["clients"] = time.perf_counter() - phase
+
     head_ip = ""
-    ports: Mapping[str, int] = {}
-    for name in hosts:
-        _, external_ip, external_port = stun.get_ip_info(source_port=i)
-        head_ip = external_ip
-        ports[name] = external_port
-        i += 1
+    ports: Dict[str, int] = {}
+    finished = start
+    for name, future in futures.items():
+        head_ip, ports[name], done = future.result()
+        finished = max(finished, done)
+    pool.shutdown()
+    timings["stun"] = finished - start
 
     # NOTE: We're not using the rendezvous server anymore.
     # Reset the channel map of the rendezvous server.
     # reset(server_ip, port)
 
-    # Command string format arguments are in ``host_args``.
-    host_args = [(head_ip, ports[name], name) for name in hosts]
+    # Command string format arguments are in ``host_args``. Transport options
+    # are base64-encoded JSON so they survive the nested shell quoting.
+    phase = time.perf_counter()
+    options = base64.urlsafe_b64encode(json.dumps(transport).encode()).decode()
+    host_args = [(head_ip, ports[name], name, options) for name in hosts]
     sshclient.run_command(
-        "meadclient %s %s %s > mead_global.log 2>&1",
+        "meadclient %s %s %s %s > mead_global.log 2>&1",
         host_args=host_args,
         shell="bash -ic",
     )
+    timings["ssh"] = time.perf_counter() - phase
+    timings["total"] = time.perf_counter() - start
+    cellar.TIMINGS = timings
+    print("Init timings:", ", ".join("%s %.3fs" % item for item in timings.items()))
 
-    # Create and start the head node client (one for each remote node).
+    # Store a reference to the SSH client.
+    cellar.SSHCLIENT = sshclient
+
+
+def start_clients(
+    server_ip: str,
+    port: int,
+    hosts: List[str],
+    transport: Dict[str, Any],
+    muxes: Optional[List[Mux]] = None,
+) -> None:
+    """
+    Starts the head side of a link to each of ``hosts`` through the
+    rendezvous server at ``server_ip:port``. The remote side is a
+    ``meadclient`` started with the same channel, i.e. hostname. With the
+    ``head_sockets`` option, the links share ``muxes`` if given, e.g. those
+    ``init()`` has looked up already, and otherwise new ones.
+    """
+    # Create and start the head node client (one for each remote node). With
+    # the engine, one loop in a thread of this process serves every link.
     head_processes: Dict[str, mp.Process] = {}
-    for hostname in hosts:
 
-        # The ``in_spout`` receives data coming from the remote node.
-        in_funnel, in_spout = mp.Pipe()
-        cellar.HEAD_SPOUTS[hostname] = in_spout
+    # Workers meet each other on the same server for direct pipes.
+    cellar.SERVER = (server_ip, port)
+    if transport.get("engine", False):
+        engine = Engine()
+
+        # Links may share a few sockets instead of one each, round-robin.
+        if not muxes:
+            muxes = [Mux() for _ in range(_head_sockets(transport))]
+        for i, hostname in enumerate(hosts):
+            mux = muxes[i % len(muxes)] if muxes else None
+            leader = Client(server_ip, port, hostname, options=transport, mux=mux)
+            engine.add(leader)
+            cellar.HEAD_CLIENTS[hostname] = leader
+        engine.start()
+        cellar.ENGINE = engine
+        cellar.SERIALIZE_ONCE = transport.get("serialize_once", False)
+    else:
+        # Workers' counters arrive through each ``inject`` process.
+        cellar.STATS_QUEUE = mp.Queue()
+        for hostname in hosts:
+
+            # The ``in_spout`` receives data coming from the remote node.
+            in_funnel, in_spout = mp.Pipe()
+            cellar.HEAD_SPOUTS[hostname] = in_spout
 
-        # The ``out_queue`` sends data going to the remote node.
-        out_queue: mp.Queue = mp.Queue()
-        cellar.HEAD_QUEUES[hostname] = out_queue
+            # The ``out_queue`` sends data going to the remote node.
+            out_queue: mp.Queue = mp.Queue()
+            cellar.HEAD_QUEUES[hostname] = out_queue
 
-        # We use the hostname as the channel.
-        leader = Client(server_ip, port, hostname, in_funnel, out_queue)
-        p_client = mp.Process(target=leader.main)
-        p_client.start()
+            # We use the hostname as the channel.
+            leader = Client(server_ip, port, hostname, in_funnel, out_queue, transport)
+            p_client = mp.Process(target=leader.main)
+            p_client.start()
 
-        head_processes[hostname] = p_client
+            head_processes[hostname] = p_client
+            cellar.HEAD_CLIENTS[hostname] = leader
 
-    # Store references to the head processes and SSH client.
+    # Store references to the head processes.
     cellar.HEAD_PROCESSES = head_processes
-    cellar.SSHCLIENT = sshclient
 
 
-def kill() -> None:
-    """ Kills head processes amd remote meadclient processes. """
+def _head_sockets(transport: Dict[str, Any]) -> int:
+    """ Returns how many sockets the head's links share, or 0 for one each. """
+    if not transport.get("engine", False):
+        return 0
+    return max(0, int(transport.get("head_sockets", 0)))
+
+
+def stop_clients() -> None:
+    """ Stops the head side of every link. """
+    if cellar.ENGINE is not None:
+        cellar.ENGINE.stop()
+        cellar.ENGINE = None
     for p in cellar.HEAD_PROCESSES.values():
         p.terminate()
         p.join()
+    cellar.HEAD_PROCESSES = {}
+
+
+def discover(source_port: int, sock: Optional[socket.socket] = None) -> Tuple[str, int]:
+    """
+    Returns the external IP address and port a STUN server sees for a local
+    UDP port, reusing the last answer for that port for ``STUN_TTL`` seconds.
+    Given ``sock``, already bound to the port, the lookup goes through it, as
+    a second socket on the port would race it for the answers.
+    """
+    now = time.monotonic()
+    cached = cellar.STUN_CACHE.get(source_port)
+    if cached is not None and cached[0] > now:
+        return cached[1], cached[2]
+    if sock is None:
+        _, external_ip, external_port = stun.get_ip_info(source_port=source_port)
+    else:
+        timeout = sock.gettimeout()
+        sock.settimeout(STUN_TIMEOUT)
+        try:
+            _, nat = stun.get_nat_type(sock, "0.0.0.0", source_port)
+        finally:
+            sock.settimeout(timeout)
+        external_ip, external_port = nat["ExternalIP"], nat["ExternalPort"]
+    if external_ip is not None:
+        cellar.STUN_CACHE[source_port] = (now + STUN_TTL, external_ip, external_port)
+    return external_ip, external_port
+
+
+def _timed_discover(
+    source_port: int, sock: Optional[socket.socket] = None
+) -> Tuple[str, int, float]:
+    """ Runs ``discover()`` and also returns when it finished. """
+    external_ip, external_port = discover(source_port, sock)
+    return external_ip, external_port, time.perf_counter()
+
+
+def init_timings() -> Dict[str, float]:
+    """
+    Returns the seconds ``init()`` spent starting the head clients, in STUN
+    discovery and launching the remote clients over SSH, with discovery
+    overlapping the first unless the links share sockets. With the engine,
+    once every link is up, the longest handshake is included as well.
+    """
+    timings = dict(cellar.TIMINGS)
+    engine = cellar.ENGINE
+    if engine is not None and len(engine.connected) == len(engine.clients):
+        seconds = [client.connect_seconds for client in engine.clients.values()]
+        timings["handshake"] = max(seconds, default=0.0)
+    return timings
+
+
+def peer_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Returns the live path estimates of the link to each remote host: the
+    smoothed RTT and jitter in seconds, the loss rate, the keepalive interval
+    and the seconds since the host was last heard from.
+    """
+    return {name: client.peer_stats() for name, client in cellar.HEAD_CLIENTS.items()}
+
+
+def kill() -> None:
+    """ Kills head processes amd remote meadclient processes. """
+    stop_clients()
     output = cellar.SSHCLIENT.run_command("pkill -e meadclient")
     for _, out in output.items():
         for line in out.stdout:
@@ -0,0 +1,147 @@
+""" NAT keepalives and live path estimates for one peer. """
+import math
+from typing import Dict, List, Optional
+
+# pylint: disable=too-few-public-methods
+
+# Defaults, overridable from the ``transport`` section of the ``init()`` config.
+# Most NATs drop an idle UDP mapping after 30 seconds or more.
+KEEPALIVE_INTERVAL = 15.0
+MIN_INTERVAL = 2.0
+MAX_INTERVAL = 60.0
+
+# The interval grows by this factor after every keepalive the peer answers,
+# and shrinks by ``SHRINK`` when one goes unanswered, so it settles just
+# under the shortest timeout of the NATs on the path.
+GROWTH = 1.25
+SHRINK = 0.5
+
+# A keepalive still unanswered after this many seconds, or four round trips
+# if longer, is counted as lost.
+PROBE_TIMEOUT = 2.0
+
+# Keepalive probe numbers start here, clear of those of the handshake.
+FIRST_PROBE = 2 ** 31
+
+# Names of the values returned by ``PeerMonitor.stats()``.
+STATS = ("rtt", "jitter", "loss", "keepalive_interval", "last_heard")
+
+# Gains of the moving averages, as for RTT and jitter in RFC 6298 and 3550.
+RTT_GAIN = 0.125
+JITTER_GAIN = 0.0625
+LOSS_GAIN = 0.125
+
+
+class PeerMonitor:
+    """
+    Keeps the NAT mapping to a peer alive and tracks the path to it.
+
+    Anything sent to the peer refreshes the mapping, so a keepalive probe is
+    only due once nothing has been sent for an interval. Round-trip samples
+    from probes and acknowledgements feed smoothed RTT and jitter estimates,
+    and answered or lost probes and packets feed a loss-rate estimate.
+
+    Parameters
+    ----------
+    interval : ``float``.
+        The initial keepalive interval in seconds, or zero to never probe.
+    min_interval : ``float``.
+        Lower bound on the adapted interval.
+    max_interval : ``float``.
+        Upper bound on the adapted interval.
+    """
+
+    def __init__(
+        self,
+        interval: float = KEEPALIVE_INTERVAL,
+        min_interval: float = MIN_INTERVAL,
+        max_interval: float = MAX_INTERVAL,
+    ):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.srtt: Optional[float] = None
+        self.jitter = 0.0
+        self.loss = 0.0
+        self.last_sample: Optional[float] = None
+        self.last_sent = 0.0
+        self.last_heard = 0.0
+        self.next_probe = FIRST_PROBE
+        self.probes: Dict[int, float] = {}
+
+    def sent(self, now: float) -> None:
+        """ Notes that a datagram went to the peer. """
+        self.last_sent = now
+
+    def heard(self, now: float) -> None:
+        """ Notes that a datagram came from the peer. """
+        self.last_heard = now
+
+    def sample(self, rtt: float) -> None:
+        """ Folds a round-trip sample into the RTT and jitter estimates. """
+        if self.srtt is None:
+            self.srtt = rtt
+        else:
+            self.srtt += RTT_GAIN * (rtt - self.srtt)
+        if self.last_sample is not None:
+            delta = abs(rtt - self.last_sample)
+            self.jitter += JITTER_GAIN * (delta - self.jitter)
+        self.last_sample = rtt
+
+    def delivered(self, n: int = 1) -> None:
+        """ Folds ``n`` answered probes or acked packets into the loss rate. """
+        self.loss *= (1 - LOSS_GAIN) ** n
+
+    def lost(self, n: int = 1) -> None:
+        """ Folds ``n`` lost probes or packets into the loss rate. """
+        self.loss = 1 - (1 - self.loss) * (1 - LOSS_GAIN) ** n
+
+    def probe(self, now: float) -> Optional[int]:
+        """ Returns the number of a keepalive probe to send now, if one is due. """
+        if not self.interval or now < self.last_sent + self.interval:
+            return None
+        probe = self.next_probe
+        self.next_probe = FIRST_PROBE + (probe + 1 - FIRST_PROBE) % FIRST_PROBE
+        self.probes[probe] = now
+        self.last_sent = now
+        return probe
+
+    def on_confirm(self, probe: int, now: float) -> None:
+        """ Handles the peer's answer to a keepalive probe. """
+        sent = self.probes.pop(probe, None)
+        if sent is None:
+            return
+        self.sample(now - sent)
+        self.delivered()
+        self.interval = min(self.interval * GROWTH, self.max_interval)
+
+    def timeout(self) -> float:
+        """ Returns how long a probe may go unanswered before it is lost. """
+        return max(PROBE_TIMEOUT, 4 * self.srtt if self.srtt else 0.0)
+
+    def expire(self, now: float) -> None:
+        """ Counts probes unanswered for too long as lost, and probes sooner. """
+        timeout = self.timeout()
+        for probe, sent in list(self.probes.items()):
+            if now - sent >= timeout:
+                del self.probes[probe]
+                self.lost()
+                self.interval = max(self.interval * SHRINK, self.min_interval)
+
+    def deadline(self) -> Optional[float]:
+        """ Returns when a probe next falls due or times out, if ever. """
+        if not self.interval:
+            return None
+        deadline = self.last_sent + self.interval
+        if self.probes:
+            deadline = min(deadline, min(self.probes.values()) + self.timeout())
+        return deadline
+
+    def stats(self) -> List[float]:
+        """
+        Returns the smoothed RTT and jitter in seconds (``nan`` before the
+        first sample), the loss rate, the keepalive interval, and when the
+        peer was last heard from, in the order of ``STATS``.
+        """
+        srtt = math.nan if self.srtt is None else self.srtt
+        return [srtt, self.jitter, self.loss, self.interval, self.last_heard]
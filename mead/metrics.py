@@ -0,0 +1,191 @@
+""" Counters and gauges for pipes and links, and the cluster-wide view. """
+import os
+import json
+import time
+import multiprocessing as mp
+from typing import Any, Dict, List, Tuple, Callable, Optional
+from threading import Event, Thread
+
+from mead import cellar
+
+# pylint: disable=too-few-public-methods
+
+# Default seconds between the reports workers send to the head node.
+STATS_INTERVAL = 5.0
+
+# Indices of the pipe counters.
+SENT, SENT_BYTES, SERIALIZE, RECEIVED, RECEIVED_BYTES, DESERIALIZE = range(6)
+
+# Indices of the link counters and gauges.
+(
+    MESSAGES_OUT,
+    DATAGRAMS_OUT,
+    BYTES_OUT,
+    MESSAGES_IN,
+    DATAGRAMS_IN,
+    BYTES_IN,
+    RETRANSMITS,
+    DROPS,
+    ABANDONED,
+    SOCKET_DROPS,
+    PICKLE_SECONDS,
+    BACKLOG,
+    FAILURES,
+) = range(13)
+
+
+class Metrics:
+    """
+    Named counters in shared memory. A process forked after they are created
+    updates the same memory, so its parent reads them without messages.
+    Updates are not atomic, so each counter should have one writer.
+
+    Parameters
+    ----------
+    values : ``Optional[Any]``.
+        Existing shared ``double`` storage for the counters, if not new.
+    """
+
+    FIELDS: Tuple[str, ...] = ()
+
+    def __init__(self, values: Optional[Any] = None) -> None:
+        if values is None:
+            values = mp.Array("d", len(self.FIELDS), lock=False)
+        self.values = values
+
+    def snapshot(self) -> Dict[str, float]:
+        """ Returns the current values by name. """
+        return dict(zip(self.FIELDS, self.values))
+
+
+class PipeMetrics(Metrics):
+    """ Counters of one end of a ``mead.Pipe``. """
+
+    FIELDS = (
+        "messages_sent",
+        "bytes_sent",
+        "serialize_seconds",
+        "messages_received",
+        "bytes_received",
+        "deserialize_seconds",
+    )
+
+
+class LinkMetrics(Metrics):
+    """
+    Counters of the link to one peer. ``drops`` counts datagrams discarded by
+    the client as truncated, malformed or from strangers, ``abandoned`` the
+    messages given up on before all their chunks arrived, and
+    ``socket_drops`` the datagrams the kernel dropped for want of buffer
+    space, where it says. ``backlog`` is the number of chunks waiting to be
+    sent, and ``serialize_seconds`` the time spent pickling control messages
+    and parcels. ``failures`` counts received messages which could not be
+    unpickled or delivered.
+    """
+
+    FIELDS = (
+        "messages_sent",
+        "datagrams_sent",
+        "bytes_sent",
+        "messages_received",
+        "datagrams_received",
+        "bytes_received",
+        "retransmits",
+        "drops",
+        "abandoned",
+        "socket_drops",
+        "serialize_seconds",
+        "backlog",
+        "failures",
+    )
+
+
+def register(pipe_id: str, values: Optional[Any] = None) -> PipeMetrics:
+    """ Returns counters for an end of a pipe, listed under its id. """
+    metrics = PipeMetrics(values)
+    cellar.PIPE_METRICS.setdefault(pipe_id, []).append(metrics)
+    return metrics
+
+
+def pipe_stats() -> Dict[str, Dict[str, float]]:
+    """ Returns the counters of the pipe ends made in this process, per pipe. """
+    pipes = {}
+    for pipe_id, ends in cellar.PIPE_METRICS.items():
+        totals = dict.fromkeys(PipeMetrics.FIELDS, 0.0)
+        for end in ends:
+            for field, value in end.snapshot().items():
+                totals[field] += value
+        pipes[pipe_id] = totals
+    return pipes
+
+
+def stats() -> Dict[str, Any]:
+    """
+    Returns a cluster-wide view of the counters: ``pipes``, the ends used in
+    this process; ``links``, the head side of the link to each host, with the
+    depth of its send queue if it has one; and ``remote``, the latest report
+    from each worker on its own pipes and link.
+    """
+    while cellar.STATS_QUEUE is not None and not cellar.STATS_QUEUE.empty():
+        report = cellar.STATS_QUEUE.get()
+        cellar.REMOTE_STATS[report.hostname] = report.stats
+
+    links = {}
+    for hostname, client in cellar.HEAD_CLIENTS.items():
+        link: Dict[str, Any] = client.stats()
+        if hostname in cellar.HEAD_QUEUES:
+            try:
+                link["queue_depth"] = cellar.HEAD_QUEUES[hostname].qsize()
+            except NotImplementedError:
+                pass
+        links[hostname] = link
+
+    return {
+        "time": time.time(),
+        "pipes": pipe_stats(),
+        "links": links,
+        "remote": dict(cellar.REMOTE_STATS),
+    }
+
+
+def dump_stats(path: str, interval: float = STATS_INTERVAL) -> Thread:
+    """ Writes ``stats()`` as JSON to ``path`` every ``interval`` seconds. """
+
+    def dump() -> None:
+        """ Replaces the file whole, so readers never see half of it. """
+        while True:
+            with open(path + ".tmp", "w") as stats_file:
+                json.dump(stats(), stats_file)
+            os.replace(path + ".tmp", path)
+            time.sleep(interval)
+
+    thread = Thread(target=dump, daemon=True)
+    thread.start()
+    return thread
+
+
+def worker_stats(client: Any) -> Dict[str, Any]:
+    """ Returns what a worker reports: its pipe ends and its side of the link. """
+    return {"pipes": pipe_stats(), "link": client.stats()}
+
+
+def report_periodically(
+    send: Callable[[Dict[str, Any]], None], client: Any, interval: float
+) -> Event:
+    """
+    Calls ``send`` with a fresh ``worker_stats()`` every ``interval`` seconds,
+    if positive, until the returned event is set.
+    """
+    stop = Event()
+
+    def report() -> None:
+        """ Runs until ``stop`` is set. """
+        while not stop.wait(interval):
+            send(worker_stats(client))
+
+    if interval > 0:
+        Thread(target=report, daemon=True).start()
+    return stop
+
+
+__all__: List[str] = ["stats", "dump_stats"]
@@ -0,0 +1,75 @@
+""" One UDP socket shared by the head side of many links. """
+import socket
+from typing import Any, Dict, Tuple, Optional
+
+from mead.ring import count_overflows
+
+# pylint: disable=too-few-public-methods
+
+# Socket receive buffer, since every link of the socket queues in it.
+RCVBUF = 4 * 2 ** 20
+
+# Length of the address the rendezvous server sends each partner, which is
+# followed by the channel on a shared socket.
+ADDRESS_SIZE = 8
+
+
+class Mux:
+    """
+    A UDP socket which the head side of many links shares, so that the head
+    needs one port, one buffer and one registration with the ``Engine`` loop
+    however many workers it serves. Datagrams are sorted by source address,
+    and those of the rendezvous server, which is the same for every link, by
+    the channel they name. A ``Client`` given a mux confirms its request to
+    the server with its channel, and the server names the channel in its
+    answer.
+
+    Until a client is connected, the engine passes its datagrams to the
+    client's ``inbox``, which its handshake reads instead of the socket.
+
+    Parameters
+    ----------
+    port : ``int``.
+        Local port to bind, or 0 for any.
+    """
+
+    def __init__(self, port: int = 0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF)
+        self.sock.bind(("", port))
+        count_overflows(self.sock)
+
+        # Clients by channel while they wait on the server, and by the peer's
+        # address once the server has named it.
+        self.channels: Dict[bytes, Any] = {}
+        self.peers: Dict[Tuple[str, int], Any] = {}
+
+        # Datagrams no client was found for.
+        self.dropped = 0
+
+    def add(self, client: Any) -> None:
+        """ Routes the server's answers for ``client``'s channel to it. """
+        self.channels[client.channel.encode("ascii")] = client
+
+    def expect(self, client: Any) -> None:
+        """ Routes datagrams from ``client``'s peer to it. """
+        self.peers[client.target] = client
+
+    def remove(self, client: Any) -> None:
+        """ Stops routing datagrams to ``client``. """
+        self.channels.pop(client.channel.encode("ascii"), None)
+        target = client.target
+        if self.peers.get(target) is client:
+            del self.peers[target]
+
+    def find(self, datagram: memoryview, addr: Tuple[str, int]) -> Optional[Any]:
+        """
+        Returns the client a datagram is for, by its source address, or by the
+        channel named in an answer from the server.
+        """
+        client = self.peers.get(addr)
+        if client is not None:
+            return client
+        if datagram[:3] == b"ok ":
+            return self.channels.get(bytes(datagram[3:]))
+        return self.channels.get(bytes(datagram[ADDRESS_SIZE:]))
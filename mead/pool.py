@@ -0,0 +1,206 @@
+""" Pre-forked interpreters which run ``mead.Process`` targets on a worker. """
+import atexit
+import ctypes
+import socket
+import logging
+import multiprocessing as mp
+from typing import Any, Dict, List, Tuple, Deque, Callable
+from threading import Lock
+from collections import deque
+from multiprocessing.reduction import sendfds, recvfds
+from multiprocessing.connection import Connection
+
+from mead import cellar
+from mead.classes import Funnel, Spout, _Process
+from mead.metrics import PipeMetrics, register
+from mead.connections import pipe_ends, get_remote_connections
+from mead.serialization import dumps, loads, register_codec
+
+# pylint: disable=too-few-public-methods
+
+# Pipes per process whose counters the worker can read, after which further
+# pipes of the same process are not reported by ``mead.stats()``.
+SLOTS = 64
+
+# Counters per pipe.
+WIDTH = len(PipeMetrics.FIELDS)
+
+
+class _Warm:
+    """ An idle interpreter, its control pipe, and the slab for its counters. """
+
+    def __init__(self, process: mp.Process, control: Connection, slab: Any):
+        self.process = process
+        self.control = control
+        self.slab = slab
+
+
+class WarmPool:
+    """
+    Interpreters forked ahead of time, each waiting to run one process.
+
+    The worker imports the modules it should preload before the pool is
+    created, so every interpreter starts with them. Handing one a process is
+    a message on its control pipe: it sets up the process's pipes itself,
+    passes the descriptors of the transport ends back to the worker, and runs
+    the target. Each interpreter runs a single process and exits, like an
+    ``mp.Process``, and a replacement is forked through ``call_soon``, one
+    per callback. Forking while other threads run can leave a lock held in
+    the child, so the worker's engine sets ``call_soon`` to run them in its
+    loop thread; by default they are forked before ``launch()`` returns.
+    Interpreters which have died while idle are skipped.
+
+    Parameters
+    ----------
+    size : ``int``.
+        Number of idle interpreters kept ready.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.idle: Deque[_Warm] = deque()
+        self.lock = Lock()
+        self.closed = False
+        self.call_soon: Callable[[Callable[[], None]], None] = _call_now
+        self.refill()
+
+        # Idle interpreters must be gone before ``multiprocessing`` joins its
+        # children at exit.
+        atexit.register(self.close)
+
+    def refill(self) -> None:
+        """ Forks interpreters until ``size`` are idle. """
+        while True:
+            with self.lock:
+                if self.closed or len(self.idle) >= self.size:
+                    return
+            warm = self._fork()
+            with self.lock:
+                if not self.closed:
+                    self.idle.append(warm)
+                    continue
+            warm.process.terminate()
+
+    def replace(self) -> None:
+        """ Forks one interpreter if fewer than ``size`` are idle, then the next. """
+        with self.lock:
+            if self.closed or len(self.idle) >= self.size:
+                return
+        warm = self._fork()
+        with self.lock:
+            if self.closed:
+                warm.process.terminate()
+                return
+            self.idle.append(warm)
+        self.call_soon(self.replace)
+
+    def close(self) -> None:
+        """ Stops the idle interpreters, and forking more. """
+        with self.lock:
+            self.closed = True
+            while self.idle:
+                warm = self.idle.popleft()
+                warm.control.close()
+                warm.process.terminate()
+
+    def launch(
+        self, p: _Process
+    ) -> Tuple[mp.Process, Dict[str, Connection], Dict[str, Connection]]:
+        """
+        Runs a deserialized remote process in an idle interpreter, returning
+        it and the ends of its pipes which transport reads from and writes to,
+        like ``mead.remote.launch()``.
+        """
+        warm = None
+        with self.lock:
+            while self.idle and warm is None:
+                warm = self.idle.popleft()
+                if not warm.process.is_alive():
+                    logging.info("POOL: idle interpreter died, skipping it.")
+                    warm.control.close()
+                    warm = None
+        if warm is None:
+            logging.info("POOL: no idle interpreter, forking one.")
+            warm = self._fork()
+
+        for tag, codec in p.codecs.items():
+            register_codec(tag, codec)
+        cellar.NO_COALESCE.update(p.no_coalesce)
+
+        warm.control.send_bytes(b"".join(dumps(p)))
+        in_ids, out_ids, slots = warm.control.recv()
+        with _socket(warm.control) as sock:
+            fds = recvfds(sock, len(in_ids) + len(out_ids))
+        warm.control.close()
+        conns = [Connection(fd) for fd in fds]
+        in_funnels = dict(zip(in_ids, conns))
+        out_spouts = dict(zip(out_ids, conns[len(in_ids) :]))
+        for pipe_id, slot in slots:
+            register(pipe_id, _slot(warm.slab, slot))
+
+        # The replacement is forked once this process is under way.
+        self.call_soon(self.replace)
+        return warm.process, in_funnels, out_spouts
+
+    def _fork(self) -> _Warm:
+        """ Starts an interpreter which waits for a process. """
+        control, child_control = mp.Pipe()
+        slab = mp.Array("d", SLOTS * WIDTH, lock=False)
+        process = mp.Process(target=_run, args=(child_control, slab))
+        process.start()
+        child_control.close()
+        return _Warm(process, control, slab)
+
+
+def _call_now(callback: Callable[[], None]) -> None:
+    """ Runs ``callback`` at once, as ``WarmPool.call_soon`` does by default. """
+    callback()
+
+
+def _socket(control: Connection) -> socket.socket:
+    """
+    Returns a socket onto a control pipe, which is a Unix socket pair, for
+    passing descriptors.
+    """
+    return socket.fromfd(control.fileno(), socket.AF_UNIX, socket.SOCK_STREAM)
+
+
+def _slot(slab: Any, slot: int) -> Any:
+    """ Returns a view onto the counters of one pipe in a slab. """
+    offset = slot * WIDTH * ctypes.sizeof(ctypes.c_double)
+    return (ctypes.c_double * WIDTH).from_buffer(slab, offset)
+
+
+def _run(control: Connection, slab: Any) -> None:
+    """
+    Waits for a process, connects its pipes, and runs its target. Exits
+    quietly if the worker closes the control pipe first.
+    """
+    # The first shared counters made in a process create its shared heap,
+    # which is better done while idle.
+    PipeMetrics()
+    try:
+        p = loads(control.recv_bytes())
+    except EOFError:
+        return
+    for tag, codec in p.codecs.items():
+        register_codec(tag, codec)
+
+    # Counters of the user's ends go in the slab, which the worker reads.
+    in_funnels, out_spouts, args, kwargs = get_remote_connections(p.args, p.kwargs)
+    slots: List[Tuple[str, int]] = []
+    for arg in pipe_ends(args, kwargs):
+        if isinstance(arg, (Funnel, Spout)) and len(slots) < SLOTS:
+            slot = len(slots)
+            arg.metrics = PipeMetrics(_slot(slab, slot))
+            slots.append((arg.pipe_id, slot))
+
+    # The descriptors are duplicated into the worker as they are sent.
+    conns = list(in_funnels.values()) + list(out_spouts.values())
+    control.send((list(in_funnels), list(out_spouts), slots))
+    with _socket(control) as sock:
+        sendfds(sock, [conn.fileno() for conn in conns])
+    control.close()
+    for conn in conns:
+        conn.close()
+    p.target(*args, **kwargs)
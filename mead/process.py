@@ -1,13 +1,18 @@
 """ The ``mead.Process`` class, analogous to ``mp.Process``. """
 import logging
 import multiprocessing as mp
-from typing import Any, Dict, Tuple, Union, Callable, Optional
+from typing import Any, Dict, List, Tuple, Union, Callable, Optional
+from multiprocessing.process import BaseProcess
 from multiprocessing.connection import Connection
 
 from mead import cellar
-from mead.classes import _Join, _Process
+from mead.shm import LENGTH, CAPACITY, SharedRing
+from mead.utils import is_local_host
+from mead.classes import _Join, _Process, Funnel, Spout
 from mead.transport import inject, extract
-from mead.connections import get_head_connections
+from mead.collectives import Comm
+from mead.serialization import CODECS
+from mead.connections import pipe_ends, get_direct_routes, get_head_connections
 
 
 class Process:
@@ -36,13 +41,44 @@ class Process:
         else:
             self.kwargs = {}
 
+        # Identifies this process to the worker, which may run many at once.
+        self.process_id = str(cellar.PROCESS_COUNTER)
+        cellar.PROCESS_COUNTER += 1
+
+        # Targets on this machine run in a child process of the head instead.
+        # Pipes with an end on another host never move to shared memory, and
+        # one which has cannot be given to another host any more.
+        self.local = is_local_host(self.hostname)
+        self.p_local: BaseProcess
+        if not self.local:
+            for end in pipe_ends(self.args, self.kwargs):
+                if not isinstance(end, (Funnel, Spout)):
+                    continue
+                if end.pipe_id in cellar.RINGS:
+                    raise ValueError(
+                        "Pipe %s already runs over shared memory between local "
+                        "processes, so it cannot reach %s." % (end.pipe_id, hostname)
+                    )
+                cellar.REMOTE_PIPES.add(end.pipe_id)
+
         self.aux_spout: Connection
         self.p_in: mp.Process
         self.p_outs: Dict[str, mp.Process]
+        self.pipe_ids: List[str] = []
 
     def join(self, timeout: Optional[Union[float, int]] = None) -> None:
         """ Blocks until the process terminates. """
-        join = _Join(self.hostname, timeout)
+        if self.local:
+            self.p_local.join(timeout)
+            return
+        join = _Join(self.hostname, timeout, self.process_id)
+        if cellar.ENGINE is not None:
+            cellar.ENGINE.send(self.hostname, join)
+            reply = self.aux_spout.recv()
+            if isinstance(reply, _Join):
+                logging.info("Remote process joined.")
+                cellar.ENGINE.detach(self.hostname, self.pipe_ids, self.process_id)
+            return
         cellar.HEAD_QUEUES[self.hostname].put(join)
         reply = self.aux_spout.recv()
         if isinstance(reply, _Join):
@@ -63,6 +99,9 @@ class Process:
 
     def start(self) -> None:
         """ Runs client on head node. Called by ``mp.Process``. """
+        if self.local:
+            self._start_local()
+            return
 
         # Replace e.g. ``mead.Funnel`` with ``mead._Funnel``.
         # Retrieve refs to internal funnels and spouts leading to head process pipes.
@@ -70,17 +109,48 @@ class Process:
             self.args, self.kwargs
         )
 
-        # Creata a placeholder process object to hold target and arguments.
-        _process = _Process(self.target, self.hostname, mp_args, mp_kwargs)
+        # Creata a placeholder process object to hold target and arguments, and
+        # the user codecs and pipe settings, which the remote must also know.
+        _process = _Process(
+            self.target,
+            self.hostname,
+            mp_args,
+            mp_kwargs,
+            dict(CODECS),
+            set(cellar.NO_COALESCE),
+            self.process_id,
+        )
+
+        aux_funnel, aux_spout = mp.Pipe()
+        self.aux_spout = aux_spout
+        self.pipe_ids = list(in_funnels) + list(out_spouts)
+
+        # The engine forwards between the pipes and the link itself. The pipes
+        # are attached and the process sent in one pass of the loop, so that
+        # nothing sent into the pipes can overtake the process. Pipes to
+        # processes on workers are then switched to run directly.
+        if cellar.ENGINE is not None:
+            engine = cellar.ENGINE
+            routes = get_direct_routes(self.hostname, in_funnels, out_spouts)
+
+            def launch() -> None:
+                """ Runs in the loop thread. """
+                engine.attach(
+                    self.hostname, in_funnels, out_spouts, aux_funnel, self.process_id
+                )
+                for _ in range(3):
+                    engine.send(self.hostname, _process)
+                for hostname, route in routes:
+                    engine.send(hostname, route)
+
+            engine.call_soon(launch)
+            return
 
         # Send an instruction to start ``self: mead.Process`` on remote.
         cellar.HEAD_QUEUES[self.hostname].put(_process)
         cellar.HEAD_QUEUES[self.hostname].put(_process)
         cellar.HEAD_QUEUES[self.hostname].put(_process)
 
-        aux_funnel, aux_spout = mp.Pipe()
-        self.aux_spout = aux_spout
-
         # Create and start the in process.
         head_spout = cellar.HEAD_SPOUTS[self.hostname]
         self.p_in = mp.Process(target=inject, args=(head_spout, in_funnels, aux_funnel))
@@ -94,3 +164,58 @@ class Process:
             p_out = mp.Process(target=extract, args=(pipe_id, head_queue, out_spout))
             p_out.start()
             self.p_outs[pipe_id] = p_out
+
+    def _start_local(self) -> None:
+        """
+        Runs the target in a forked child process. A pipe passed to it whose
+        ends all stay on this machine, in the head or in local children, is
+        carried by a shared-memory ring instead of its ``multiprocessing``
+        pipe; one with an end on another host keeps the pipe, which the head
+        forwards. Rings are set up before the fork, which they rely on.
+        """
+        context = mp.get_context("fork")
+        rings: Dict[str, SharedRing] = {}
+
+        def localize(arg: Any) -> Any:
+            """ Rebinds a ``mead.Funnel`` or ``mead.Spout`` to a ring. """
+            if isinstance(arg, Comm):
+                return arg.replace(localize)
+            if not isinstance(arg, (Funnel, Spout)):
+                return arg
+            if arg.pipe_id in cellar.REMOTE_PIPES:
+                return arg
+            ring = cellar.RINGS.get(arg.pipe_id)
+            if ring is None:
+                ring = rings[arg.pipe_id] = _ring(arg.pipe_id)
+                cellar.RINGS[arg.pipe_id] = ring
+            if isinstance(arg, Funnel):
+                return Funnel(arg.pipe_id, ring, arg.codec)
+            return Spout(arg.pipe_id, ring)
+
+        args = tuple(localize(arg) for arg in self.args)
+        kwargs = {key: localize(arg) for key, arg in self.kwargs.items()}
+        for pipe_id, ring in rings.items():
+            cellar.FUNNELS[pipe_id].connection = ring
+            cellar.SPOUTS[pipe_id].connection = ring
+        self.p_local = context.Process(target=self.target, args=args, kwargs=kwargs)
+        self.p_local.start()
+
+        # The child has inherited the mappings, so the names can go.
+        for ring in rings.values():
+            ring.unlink()
+
+
+def _ring(pipe_id: str) -> SharedRing:
+    """
+    Returns a new ring for a pipe, holding whatever was already sent into the
+    pipe, which must all fit since nothing reads it before the fork.
+    """
+    spout = cellar.INTERNAL_SPOUTS[pipe_id]
+    pending: List[bytes] = []
+    while spout.poll():
+        pending.append(spout.recv_bytes())
+    size = sum(LENGTH.size + len(message) for message in pending)
+    ring = SharedRing(max(CAPACITY, size))
+    for message in pending:
+        ring.send_bytes(message)
+    return ring
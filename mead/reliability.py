@@ -0,0 +1,259 @@
+""" Sliding-window ARQ for reliable, ordered delivery over UDP. """
+import struct
+from typing import Any, Dict, List, Tuple, Optional
+
+# pylint: disable=too-few-public-methods
+
+# Payload of an ``ACK`` datagram: a selective-acknowledgement bitmap in which
+# bit ``i`` set means packet ``cumulative + 1 + i`` has been received.
+ACK_PAYLOAD = struct.Struct("!Q")
+SACK_BITS = 64
+
+# Defaults, overridable from the ``transport`` section of the ``init()`` config.
+WINDOW = 64
+RTO = 1.0
+MIN_RTO = 0.2
+MAX_RTO = 60.0
+
+# Number of later packets that must be acknowledged before a packet is
+# considered lost and fast-retransmitted.
+DUPTHRESH = 3
+
+# In-order packets are acknowledged every ``ACK_EVERY`` packets or after
+# ``ACK_DELAY`` seconds, whichever comes first.
+ACK_EVERY = 2
+ACK_DELAY = 0.01
+
+# Packet numbers are 32-bit and compared with serial-number arithmetic.
+SERIAL = 2 ** 32
+
+
+def seq_add(seq: int, n: int) -> int:
+    """ Adds ``n`` to a packet number, wrapping around. """
+    return (seq + n) % SERIAL
+
+
+def seq_diff(a: int, b: int) -> int:
+    """ Returns the signed distance from ``b`` to ``a``. """
+    diff = (a - b) % SERIAL
+    if diff >= SERIAL // 2:
+        diff -= SERIAL
+    return diff
+
+
+class RttEstimator:
+    """
+    Smoothed round-trip time and retransmission timeout, as in RFC 6298.
+
+    Parameters
+    ----------
+    rto : ``float``.
+        The initial retransmission timeout in seconds.
+    min_rto : ``float``.
+        Lower bound on the retransmission timeout.
+    max_rto : ``float``.
+        Upper bound on the retransmission timeout, also capping backoff.
+    """
+
+    def __init__(
+        self, rto: float = RTO, min_rto: float = MIN_RTO, max_rto: float = MAX_RTO
+    ):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.rto = rto
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+
+    def update(self, sample: float) -> None:
+        """ Folds a new round-trip sample into the estimate. """
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+        self.reset()
+
+    def reset(self) -> None:
+        """ Recomputes the timeout from the estimate, undoing any backoff. """
+        if self.srtt is None:
+            return
+        rto = self.srtt + 4 * self.rttvar
+        self.rto = min(max(rto, self.min_rto), self.max_rto)
+
+    def backoff(self) -> None:
+        """ Doubles the timeout after a retransmission timeout fires. """
+        self.rto = min(self.rto * 2, self.max_rto)
+
+
+class _Inflight:
+    """ A sent but unacknowledged packet. """
+
+    def __init__(self, segments: List[Any], sent: float):
+        self.segments = segments
+        self.sent = sent
+        self.retransmits = 0
+        self.fast_retransmitted = False
+
+
+class SendWindow:
+    """
+    Tracks unacknowledged packets and decides which must be retransmitted.
+
+    Parameters
+    ----------
+    size : ``int``.
+        Maximum number of unacknowledged packets in flight.
+    """
+
+    def __init__(self, size: int = WINDOW):
+        self.size = size
+        self.next_packet = 0
+        self.inflight: Dict[int, _Inflight] = {}
+
+    def full(self, limit: Optional[int] = None) -> bool:
+        """
+        Whether the window is full. The window spans packet numbers from the
+        oldest unacknowledged packet, so that the sender never runs past the
+        receiver's reorder buffer. ``limit`` optionally caps the number of
+        packets in flight.
+        """
+        if limit is not None and len(self.inflight) >= limit:
+            return True
+        if not self.inflight:
+            return False
+        oldest = next(iter(self.inflight))
+        return seq_diff(self.next_packet, oldest) >= self.size
+
+    def track(self, segments: List[Any], now: float) -> int:
+        """ Records a packet sent as ``self.next_packet`` and advances it. """
+        packet = self.next_packet
+        self.inflight[packet] = _Inflight(segments, now)
+        self.next_packet = seq_add(packet, 1)
+        return packet
+
+    def on_ack(
+        self, cumulative: int, bitmap: int, now: float
+    ) -> Tuple[int, List[float], List[int]]:
+        """
+        Removes acknowledged packets.
+
+        Returns the number of packets newly acknowledged, round-trip samples
+        from those which were never retransmitted (Karn's algorithm), and the
+        packet numbers now deemed lost.
+        """
+        samples: List[float] = []
+        outstanding = len(self.inflight)
+
+        # Packets are stored in send order, so the cumulative ack pops a prefix.
+        for packet in list(self.inflight):
+            if seq_diff(packet, cumulative) >= 0:
+                break
+            entry = self.inflight.pop(packet)
+            if entry.retransmits == 0:
+                samples.append(now - entry.sent)
+
+        # Selective acks.
+        highest = None
+        for i in range(SACK_BITS):
+            if not bitmap >> i & 1:
+                continue
+            packet = seq_add(cumulative, 1 + i)
+            highest = packet
+            sacked = self.inflight.pop(packet, None)
+            if sacked is not None and sacked.retransmits == 0:
+                samples.append(now - sacked.sent)
+
+        # Anything sufficiently far below the highest sacked packet is lost.
+        lost: List[int] = []
+        if highest is not None:
+            for packet, entry in self.inflight.items():
+                if seq_diff(highest, packet) < DUPTHRESH:
+                    break
+                if not entry.fast_retransmitted:
+                    entry.fast_retransmitted = True
+                    lost.append(packet)
+
+        return outstanding - len(self.inflight), samples, lost
+
+    def expired(self, now: float, rto: float) -> List[int]:
+        """
+        Returns every outstanding packet once any retransmission timer has
+        fired, since after a timeout all of them are presumed lost.
+        """
+        if any(now - entry.sent >= rto for entry in self.inflight.values()):
+            return list(self.inflight)
+        return []
+
+    def next_deadline(self, rto: float) -> Optional[float]:
+        """ Returns the earliest time at which a retransmission timer fires. """
+        if not self.inflight:
+            return None
+        return min(entry.sent for entry in self.inflight.values()) + rto
+
+    def resend(self, packet: int, now: float) -> List[Any]:
+        """ Marks a packet as retransmitted and returns its segments. """
+        entry = self.inflight[packet]
+        entry.sent = now
+        entry.retransmits += 1
+        return entry.segments
+
+
+class ReceiveWindow:
+    """
+    Reorders incoming packets and produces acknowledgements.
+
+    Parameters
+    ----------
+    size : ``int``.
+        Maximum number of out-of-order packets buffered ahead of the next
+        expected packet.
+    """
+
+    def __init__(self, size: int = WINDOW):
+        self.size = size
+        self.expected = 0
+        self.buffered: Dict[int, Any] = {}
+        self.unacked = 0
+        self.ack_deadline: Optional[float] = None
+
+    def receive(self, packet: int, item: Any, now: float) -> Tuple[List[Any], bool]:
+        """
+        Accepts a packet and returns the items now deliverable in order, and
+        whether an acknowledgement should be sent immediately.
+        """
+        distance = seq_diff(packet, self.expected)
+
+        # Duplicates and packets beyond the window are re-acknowledged.
+        if distance < 0 or distance >= self.size:
+            return [], True
+
+        # Out of order: buffer it and ack at once so the sender sees the gap.
+        if distance > 0:
+            self.buffered.setdefault(packet, item)
+            return [], True
+
+        delivered = [item]
+        self.expected = seq_add(self.expected, 1)
+        while self.expected in self.buffered:
+            delivered.append(self.buffered.pop(self.expected))
+            self.expected = seq_add(self.expected, 1)
+
+        # Filling a gap is acked at once; otherwise delay the ack.
+        self.unacked += 1
+        if len(delivered) > 1 or self.unacked >= ACK_EVERY:
+            return delivered, True
+        if self.ack_deadline is None:
+            self.ack_deadline = now + ACK_DELAY
+        return delivered, False
+
+    def ack(self) -> Tuple[int, int]:
+        """ Returns ``(cumulative, bitmap)`` and resets the delayed-ack state. """
+        bitmap = 0
+        for packet in self.buffered:
+            distance = seq_diff(packet, self.expected) - 1
+            if 0 <= distance < SACK_BITS:
+                bitmap |= 1 << distance
+        self.unacked = 0
+        self.ack_deadline = None
+        return self.expected, bitmap
@@ -1,87 +1,213 @@
 """ Starts processes for a remote client. Called by ``meadclient``. """
 import os
 import sys
+import signal
 import logging
+import importlib
 import multiprocessing as mp
-from typing import Dict
+from typing import Any, Dict, List, Tuple, Optional
+from functools import partial
+from threading import Lock, Event, Thread
 from multiprocessing.connection import Connection
 
 import stun
-import dill
 
+from mead import cellar
 from mead.client import Client
-from mead.classes import _Join, _Process
-from mead.transport import inject, extract
-from mead.connections import get_remote_connections
+from mead.pool import WarmPool
+from mead.engine import LOOPBACK, Engine
+from mead.classes import Parcel, _Join, _Route, _Stats, _Process
+from mead.metrics import STATS_INTERVAL, report_periodically
+from mead.tracing import TRACER
+from mead.transport import extract
+from mead.serialization import loads, register_codec
+from mead.connections import close_remote_ends, get_remote_connections
 
+# The head sends each ``_Process`` several times in case some are lost, so
+# this many of the latest process ids are remembered to ignore the copies.
+HISTORY = 4096
 
-def remote(head_ip: str, port: int, channel: str) -> None:
-    """ Runs the client for a remote worker. """
+
+class _Job:
+    """ A user process started on this worker, and its pipes. """
+
+    def __init__(
+        self,
+        process: mp.Process,
+        in_funnels: Dict[str, Connection],
+        out_spouts: Dict[str, Connection],
+        p_outs: Optional[Dict[str, mp.Process]] = None,
+    ):
+        self.process = process
+        self.in_funnels = in_funnels
+        self.out_spouts = out_spouts
+        self.p_outs: Dict[str, mp.Process] = p_outs if p_outs else {}
+
+    @property
+    def pipe_ids(self) -> List[str]:
+        """ The ids of the pipes the process was given. """
+        return list(self.in_funnels) + list(self.out_spouts)
+
+    def release(self) -> None:
+        """ Frees the pipes and the counters of a finished process. """
+        for p_out in self.p_outs.values():
+            p_out.terminate()
+            p_out.join()
+        for conn in list(self.in_funnels.values()) + list(self.out_spouts.values()):
+            conn.close()
+        for pipe_id in self.pipe_ids:
+            cellar.PIPE_METRICS.pop(pipe_id, None)
+        self.process.close()
+
+
+def first_sight(seen: Dict[str, None], process_id: str) -> bool:
+    """ Returns whether ``process_id`` is new, and remembers it. """
+    if process_id in seen:
+        return False
+    seen[process_id] = None
+    if len(seen) > HISTORY:
+        del seen[next(iter(seen))]
+    return True
+
+
+def remote(
+    head_ip: str, port: int, channel: str, options: Optional[Dict[str, Any]] = None
+) -> None:
+    """
+    Runs the client for a remote worker, which starts every ``_Process`` the
+    head sends, and joins each on its own ``_Join``, until it is killed.
+    """
     logging.basicConfig(filename="remote.log", level=logging.DEBUG)
     logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
 
-    # Get external IP and port from STUN server.
-    _, external_ip, external_port = stun.get_ip_info(source_port=50000)
+    # Get external IP and port from STUN server, and write the sockaddr to file.
+    # Loopback runs such as the benchmarks skip this with the ``stun`` option.
+    if options is None or options.get("stun", True):
+        _, external_ip, external_port = stun.get_ip_info(source_port=50000)
+        sockpath = os.path.abspath(os.path.expanduser("~/.sockaddr.mead"))
+        with open(sockpath, "w") as sockfile:
+            sockfile.write(external_ip + "\n")
+            sockfile.write(str(external_port) + "\n")
+
+    # Modules to preload are imported once here, so that every process
+    # forked from here on, and every interpreter of the pool, has them.
+    # The serialization setting is inherited the same way.
+    options = options if options else {}
+    if options.get("engine", False):
+        cellar.SERIALIZE_ONCE = options.get("serialize_once", False)
+    for module in options.get("preload", []):
+        importlib.import_module(module)
+    pool = WarmPool(options["pool_size"]) if options.get("pool_size") else None
 
-    # Write sockaddr to file.
-    sockpath = os.path.abspath(os.path.expanduser("~/.sockaddr.mead"))
-    with open(sockpath, "w") as sockfile:
-        sockfile.write(external_ip + "\n")
-        sockfile.write(str(external_port) + "\n")
+    if options.get("engine", False):
+        serve(head_ip, port, channel, options, pool)
+        return
 
     # Transport in and out of the head node.
     in_funnel, in_spout = mp.Pipe()
     out_queue: mp.Queue = mp.Queue()
-    aux_funnel, aux_spout = mp.Pipe()
 
     # Create and start the client.
-    client = Client(head_ip, port, channel, in_funnel, out_queue)
+    client = Client(head_ip, port, channel, in_funnel, out_queue, options)
     p_client = mp.Process(target=client.main)
     p_client.start()
 
-    while 1:
-        logging.info("REMOTE: waiting for a ``_Process``.")
-        bprocess = in_spout.recv()
-        p = dill.loads(bprocess)
+    # Parcels for every process are routed from here by pipe id, so that the
+    # worker keeps listening for more processes. Joins wait in threads.
+    jobs: Dict[str, _Job] = {}
+    funnels: Dict[str, Connection] = {}
+    seen: Dict[str, None] = {}
+    lock = Lock()
 
-        if isinstance(p, _Process):
-            logging.info("REMOTE: starting user process.")
+    # Counters are reported while processes run, since the head node only
+    # reads control messages from ``inject`` until it joins them.
+    interval = options.get("stats_interval", STATS_INTERVAL)
+    reporting: List[Event] = []
 
-            # Start the process.
-            p_remote = start(p, in_spout, out_queue, aux_funnel)
+    def join(sig: _Join) -> None:
+        """ Waits for a process, then frees it and replies to the head node. """
+        job = jobs.get(sig.process_id)
+        if job is not None:
+            job.process.join(timeout=sig.timeout)
+        with lock:
+            if job is not None and job.process.exitcode is not None:
+                del jobs[sig.process_id]
+                for pipe_id in job.in_funnels:
+                    funnels.pop(pipe_id, None)
+                job.release()
+            if not jobs and reporting:
+                reporting.pop().set()
+        out_queue.put(sig)
 
-            logging.info("REMOTE: break.")
-            break
+    while 1:
+        data = in_spout.recv_bytes()
+        obj = loads(data)
 
-        logging.info("ERR: p not _Process: %s", p)
+        if isinstance(obj, Parcel):
+            if TRACER.active:
+                TRACER.record("inject", obj.pipe_id, len(data))
+            with lock:
+                funnel = funnels.get(obj.pipe_id)
+            if funnel is None:
+                logging.info("REMOTE: no pipe %s.", obj.pipe_id)
+                continue
+            try:
+                funnel.send(obj.obj)
+            except OSError as err:
+                logging.info("REMOTE: pipe %s closed: %s", obj.pipe_id, err)
+        elif isinstance(obj, _Process):
+            if not first_sight(seen, obj.process_id):
+                continue
+            logging.info("REMOTE: starting user process %s.", obj.process_id)
+            job = start(obj, out_queue, pool)
+            with lock:
+                jobs[obj.process_id] = job
+                funnels.update(job.in_funnels)
+                if not reporting:
+                    reporting.append(
+                        report_periodically(
+                            lambda stats: out_queue.put(_Stats(channel, stats)),
+                            client,
+                            interval,
+                        )
+                    )
+        elif isinstance(obj, _Join):
+            logging.info("REMOTE: joining %s.", obj.process_id)
+            Thread(target=join, args=(obj,), daemon=True).start()
+        else:
+            logging.info("ERR: unexpected message: %s", type(obj).__name__)
 
-    while 1:
-        sig = aux_spout.recv()
-        if isinstance(sig, _Join):
-            logging.info("REMOTE: Joining.")
-            out_queue.put(sig)
-            p_remote.join(timeout=sig.timeout)
-
-
-def start(
-    p: _Process, in_spout: Connection, out_queue: mp.Queue, aux_funnel: Connection
-) -> mp.Process:
-    """ Starts a deserialized remote process. """
-    # Connects pipes in transport processes to pipes in ``p_remote``.
+
+def launch(
+    p: _Process,
+) -> Tuple[mp.Process, Dict[str, Connection], Dict[str, Connection]]:
+    """
+    Starts a deserialized remote process, returning it and the ends of its
+    pipes which transport reads from and writes to.
+    """
+    for tag, codec in p.codecs.items():
+        register_codec(tag, codec)
+    cellar.NO_COALESCE.update(p.no_coalesce)
+
+    # Connects pipes in transport to pipes in ``p_remote``.
     in_funnels, out_spouts, mp_args, mp_kwargs = get_remote_connections(
         p.args, p.kwargs
     )
-
-    logging.info("REMOTE: in funnels: %s:", str(in_funnels))
-    logging.info("REMOTE: mpargs: %s:", str(mp_args))
-
-    # Start the deserialized process.
+    logging.info("REMOTE: in funnels: %s", list(in_funnels))
     p_remote = mp.Process(target=p.target, args=mp_args, kwargs=mp_kwargs)
     p_remote.start()
 
-    # Transport process to read from the client and write to ``p_remote``.
-    p_in = mp.Process(target=inject, args=(in_spout, in_funnels, aux_funnel))
-    p_in.start()
+    # Only the child uses its ends, so they close when it exits.
+    close_remote_ends(mp_args, mp_kwargs)
+    return p_remote, in_funnels, out_spouts
+
+
+def start(p: _Process, out_queue: mp.Queue, pool: Optional[WarmPool] = None) -> _Job:
+    """
+    Starts a deserialized remote process, in an interpreter from ``pool`` if
+    given, and its extraction processes.
+    """
+    p_remote, in_funnels, out_spouts = pool.launch(p) if pool else launch(p)
 
     # Transport processes to read from ``p_remote`` and write to the client.
     p_outs: Dict[str, mp.Process] = {}
@@ -90,4 +216,87 @@ def start(
         p_out.start()
         p_outs[pipe_id] = p_out
 
-    return p_remote
+    return _Job(p_remote, in_funnels, out_spouts, p_outs)
+
+
+def serve(
+    head_ip: str,
+    port: int,
+    channel: str,
+    options: Dict[str, Any],
+    pool: Optional[WarmPool] = None,
+) -> None:
+    """
+    Runs the client and the user processes' pipes in one ``Engine`` loop,
+    starting the processes in interpreters from ``pool`` if given. Links to
+    other workers are opened as the head routes pipes directly over them.
+    """
+    jobs: Dict[str, _Job] = {}
+    seen: Dict[str, None] = {}
+    engine = Engine()
+
+    # Replacement interpreters are forked from the loop thread, between its
+    # other work, never while it holds a lock of its own.
+    if pool is not None:
+        pool.call_soon = engine.call_soon
+
+    def on_control(channel: str, obj: Any) -> None:
+        """
+        Starts each new ``_Process`` and joins it on its ``_Join``, and
+        switches pipes to the links given by ``_Route``s.
+        """
+        if isinstance(obj, _Process):
+            if not first_sight(seen, obj.process_id):
+                return
+            logging.info("REMOTE: starting user process %s.", obj.process_id)
+            p_remote, in_funnels, out_spouts = pool.launch(obj) if pool else launch(obj)
+            jobs[obj.process_id] = _Job(p_remote, in_funnels, out_spouts)
+            engine.attach(channel, in_funnels, out_spouts)
+        elif isinstance(obj, _Join):
+            logging.info("REMOTE: joining %s.", obj.process_id)
+            job = jobs.get(obj.process_id)
+            Thread(target=join, args=(channel, obj, job), daemon=True).start()
+        elif isinstance(obj, _Route):
+            logging.info("REMOTE: pipe %s on link '%s'.", obj.pipe_id, obj.link)
+            if obj.link != LOOPBACK and obj.link not in engine.clients:
+                server_ip, server_port = obj.server
+                engine.add(Client(server_ip, server_port, obj.link, options=options))
+            if obj.sender:
+                engine.reroute(channel, obj.pipe_id, obj.link)
+            else:
+                engine.hold(channel, obj.pipe_id, obj.link)
+        else:
+            logging.info("ERR: unexpected control message: %s", obj)
+
+    def join(channel: str, sig: _Join, job: Optional[_Job]) -> None:
+        """ Waits for a process, then has the loop thread finish the join. """
+        if job is not None:
+            job.process.join(timeout=sig.timeout)
+        engine.call_soon(partial(joined, channel, sig, job))
+
+    def joined(channel: str, sig: _Join, job: Optional[_Job]) -> None:
+        """
+        Frees a process which has exited, then replies to the head node. Runs
+        in the loop thread, and each step is queued behind the one before.
+        """
+        if job is not None and job.process.exitcode is not None:
+            if jobs.get(sig.process_id) is job:
+                del jobs[sig.process_id]
+                engine.detach(channel, job.pipe_ids)
+                engine.call_soon(job.release)
+        engine.call_soon(partial(engine.send, channel, sig))
+
+    # Exit when SIGTERM is sent, i.e. by ``pkill`` from ``mead.kill()``.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+
+    # Report counters to the head node, which keeps the latest.
+    client = Client(head_ip, port, channel, options=options)
+    report_periodically(
+        lambda stats: engine.send(channel, _Stats(channel, stats)),
+        client,
+        options.get("stats_interval", STATS_INTERVAL),
+    )
+
+    engine.on_control = on_control
+    engine.add(client)
+    engine.run()
@@ -0,0 +1,86 @@
+""" A preallocated ring of receive buffers, drained in batches. """
+import socket
+import struct
+import logging
+from typing import Any, Dict, List, Tuple
+
+from mead.framing import MTU
+
+# pylint: disable=too-few-public-methods
+
+# Datagrams are at most one MTU; anything longer is truncated and dropped.
+SLOT_SIZE = 2048
+
+# Number of slots, and so the most datagrams received per batch.
+SLOTS = 64
+
+# Once enabled on a socket, Linux attaches its running count of datagrams
+# dropped for want of buffer space to each datagram received. The option is
+# missing from the ``socket`` module, so its Linux value is the fallback.
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)
+OVERFLOWS = struct.Struct("I")
+
+
+def count_overflows(sock: socket.socket) -> None:
+    """ Asks the kernel to report ``sock``'s drops, where it can. """
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+    except OSError:
+        pass
+
+
+class ReceiveRing:
+    """
+    Receives datagrams into a fixed ring of ``bytearray`` slots, so that no
+    memory is allocated per datagram. A datagram returned by ``drain()`` is a
+    view onto its slot, which stays valid until the ring wraps around, i.e.
+    for the whole of the batch it was returned in. Oversized datagrams are
+    counted in ``dropped``, and the kernel's drop count for each socket, if
+    reported, is kept in ``overflows`` by file descriptor.
+
+    Parameters
+    ----------
+    slots : ``int``.
+        Number of slots, which bounds the size of a batch.
+    slot_size : ``int``.
+        Size of each slot in bytes, at least one MTU.
+    """
+
+    def __init__(self, slots: int = SLOTS, slot_size: int = SLOT_SIZE):
+        assert slot_size >= MTU
+        self.views = [memoryview(bytearray(slot_size)) for _ in range(slots)]
+        self.head = 0
+        self.dropped = 0
+        self.overflows: Dict[int, int] = {}
+        self.ancbufsize = socket.CMSG_SPACE(OVERFLOWS.size)
+
+    def drain(
+        self, sock: socket.socket, block: bool = False
+    ) -> List[Tuple[memoryview, Any]]:
+        """
+        Returns ``(datagram, address)`` pairs for everything queued on
+        ``sock``, up to one per slot. With ``block``, waits for the first.
+        """
+        batch: List[Tuple[memoryview, Any]] = []
+        ancdata: List[Tuple[int, int, bytes]] = []
+        while len(batch) < len(self.views):
+            flags = 0 if block and not batch else socket.MSG_DONTWAIT
+            view = self.views[self.head]
+            try:
+                nbytes, ancdata, msg_flags, addr = sock.recvmsg_into(
+                    [view], self.ancbufsize, flags
+                )
+            except BlockingIOError:
+                break
+            if msg_flags & socket.MSG_TRUNC:
+                logging.info("RING: dropped an oversized datagram from %s.", addr)
+                self.dropped += 1
+                continue
+            batch.append((view[:nbytes], addr))
+            self.head = (self.head + 1) % len(self.views)
+
+        # The count only grows, so that of the last datagram is enough.
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL:
+                self.overflows[sock.fileno()] = OVERFLOWS.unpack(data)[0]
+        return batch
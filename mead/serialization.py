@@ -0,0 +1,205 @@
+""" Tiered serialization with out-of-band buffers (pickle protocol 5). """
+import io
+import types
+import struct
+import pickle
+from typing import Any, Dict, List, Type, Optional
+
+import dill
+
+from mead.framing import Buffer
+
+# pylint: disable=too-few-public-methods
+
+PROTOCOL = 5
+
+# Buffers smaller than this are cheaper to copy into the pickle stream than
+# to carry as separate segments.
+OOB_THRESHOLD = 4096
+
+# Codec tags. Every message starts with the tag of the codec which produced
+# it, which is mirrored in the wire header. Tags from ``FIRST_USER_CODEC`` up
+# are free for ``register_codec()``.
+PICKLE = 0
+DILL = 1
+FIRST_USER_CODEC = 16
+TAG = struct.Struct("!B")
+
+# After the tag, a pickled message is laid out as:
+#   buffer count ``n``, the lengths of the pickle stream and of the ``n``
+#   buffers, the pickle stream, and then the raw buffers back to back.
+COUNT = struct.Struct("!I")
+LENGTH = struct.Struct("!Q")
+
+
+class Codec:
+    """
+    A user serializer, registered with ``register_codec()`` and selected per
+    pipe with ``mead.Pipe(codec=tag)``. The codec object itself is shipped to
+    the remote worker with the process, so it must be picklable.
+    """
+
+    def dumps(self, obj: Any) -> List[Buffer]:
+        """ Serializes ``obj`` into a list of segments. """
+        raise NotImplementedError
+
+    def loads(self, message: memoryview) -> Any:
+        """ Deserializes the concatenation of the segments from ``dumps()``. """
+        raise NotImplementedError
+
+
+CODECS: Dict[int, Codec] = {}
+
+
+def register_codec(tag: int, codec: Codec) -> None:
+    """ Makes ``codec`` available under ``tag`` to ``dumps()`` and ``loads()``. """
+    if not FIRST_USER_CODEC <= tag <= 0xFF:
+        raise ValueError("codec tag must be in [%d, 255]" % FIRST_USER_CODEC)
+    CODECS[tag] = codec
+
+
+class _OutOfBandPickler:
+    """
+    Replaces each large byte string with its type name and a ``PickleBuffer``,
+    which the buffer callback then keeps out-of-band, and any later reference
+    to it with its index. The C pickler never offers ``bytes`` or
+    ``bytearray`` to ``reducer_override()``, but it asks ``persistent_id()``
+    about every object.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.sent: Dict[int, int] = {}
+
+    def persistent_id(self, obj: Any) -> Any:
+        """ Sends large byte strings out-of-band. """
+        kind = type(obj)
+        if (kind is not bytes and kind is not bytearray) or len(obj) < OOB_THRESHOLD:
+            return None
+        index = self.sent.get(id(obj))
+        if index is not None:
+            return index
+        self.sent[id(obj)] = len(self.sent)
+        return kind.__name__, pickle.PickleBuffer(obj)
+
+
+class _OutOfBandUnpickler:
+    """ Rebuilds the byte strings replaced by ``_OutOfBandPickler``. """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.loaded: List[Any] = []
+
+    def persistent_load(self, pid: Any) -> Any:
+        """ Rebuilds a byte string sent out-of-band. """
+        if isinstance(pid, int):
+            return self.loaded[pid]
+        kind, buffer = pid
+        if kind == "bytes":
+            self.loaded.append(bytes(buffer))
+        elif kind == "bytearray":
+            self.loaded.append(bytearray(buffer))
+        else:
+            raise pickle.UnpicklingError("unknown persistent id: %r" % (kind,))
+        return self.loaded[-1]
+
+
+class _Pickler(_OutOfBandPickler, pickle.Pickler):
+    """
+    The stdlib pickler, which refuses anything defined in ``__main__``: it
+    would be pickled by reference and could not be found on a remote worker.
+    """
+
+    def reducer_override(self, obj: Any) -> Any:
+        """ Refuses classes and functions defined in ``__main__``. """
+        if isinstance(obj, (type, types.FunctionType)) and obj.__module__ == "__main__":
+            raise pickle.PicklingError("%s is defined in __main__" % obj.__qualname__)
+        return NotImplemented
+
+
+class _DillPickler(_OutOfBandPickler, dill.Pickler):
+    """ The ``dill`` pickler, for closures, lambdas and ``__main__`` code. """
+
+
+class _Unpickler(_OutOfBandUnpickler, pickle.Unpickler):
+    """ The stdlib unpickler. """
+
+
+class _DillUnpickler(_OutOfBandUnpickler, dill.Unpickler):
+    """ The ``dill`` unpickler. """
+
+
+def _pickle(tag: int, pickler: Type[pickle.Pickler], obj: Any) -> List[Buffer]:
+    """ Pickles ``obj`` with ``pickler``, keeping large buffers out-of-band. """
+    buffers: List[pickle.PickleBuffer] = []
+
+    def callback(buffer: pickle.PickleBuffer) -> bool:
+        """ Returns ``True`` to keep a buffer in-band. """
+        if buffer.raw().nbytes < OOB_THRESHOLD:
+            return True
+        buffers.append(buffer)
+        return False
+
+    file = io.BytesIO()
+    pickler(file, protocol=PROTOCOL, buffer_callback=callback).dump(obj)
+    stream = file.getbuffer()
+    raws = [buffer.raw() for buffer in buffers]
+    lengths = [len(stream)] + [raw.nbytes for raw in raws]
+    layout = TAG.pack(tag) + COUNT.pack(len(raws))
+    layout += b"".join(LENGTH.pack(n) for n in lengths)
+    return [layout, stream, *raws]
+
+
+def dumps(obj: Any, codec: Optional[int] = None) -> List[Buffer]:
+    """
+    Serializes ``obj`` into a list of segments, with the registered ``codec``
+    if given. Otherwise the stdlib pickler is tried first, and ``dill`` is only
+    used for what it cannot handle, such as lambdas, closures and anything
+    defined in ``__main__``.
+
+    Buffers of at least ``OOB_THRESHOLD`` bytes are not copied into the
+    pickle stream, but returned as views onto the object's own memory, so
+    they can be handed straight to ``socket.sendmsg``. This covers objects
+    which expose a ``PickleBuffer``, e.g. NumPy arrays, and ``bytes`` and
+    ``bytearray`` anywhere in ``obj``.
+    """
+    if codec is not None:
+        return [TAG.pack(codec), *CODECS[codec].dumps(obj)]
+    try:
+        return _pickle(PICKLE, _Pickler, obj)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return _pickle(DILL, _DillPickler, obj)
+
+
+def codec_of(segment: Buffer) -> int:
+    """ Returns the codec tag of a message, given its first segment. """
+    tag: int = TAG.unpack_from(segment)[0]
+    return tag
+
+
+def loads(message: Buffer) -> Any:
+    """
+    Deserializes a message produced by ``dumps()``. Out-of-band buffers are
+    views onto ``message``, so objects such as NumPy arrays share its memory
+    rather than copying it, and are writable if ``message`` is. Byte strings
+    sent out-of-band are copied out, as ``bytes`` must own their memory.
+    """
+    view = memoryview(message)
+    tag = codec_of(view)
+    if tag not in (PICKLE, DILL):
+        return CODECS[tag].loads(view[TAG.size :])
+
+    count = COUNT.unpack_from(view, TAG.size)[0]
+    pos = TAG.size + COUNT.size
+    lengths = struct.unpack_from("!%dQ" % (count + 1), view, pos)
+    pos += LENGTH.size * (count + 1)
+
+    stream = view[pos : pos + lengths[0]]
+    pos += lengths[0]
+    buffers = []
+    for length in lengths[1:]:
+        buffers.append(view[pos : pos + length])
+        pos += length
+
+    unpickler = _Unpickler if tag == PICKLE else _DillUnpickler
+    return unpickler(io.BytesIO(stream), buffers=buffers).load()
@@ -0,0 +1,159 @@
+""" A shared-memory ring buffer for pipes between processes on one machine. """
+import os
+import pickle
+import select
+import time
+import struct
+from typing import Any, Optional
+from multiprocessing import shared_memory
+from multiprocessing.reduction import ForkingPickler
+
+from mead.framing import Buffer
+
+# pylint: disable=too-few-public-methods
+
+# Bytes of ring storage per pipe direction. Longer messages are streamed
+# through the ring in pieces.
+CAPACITY = 1 << 20
+
+# The ring starts with its write and read positions, which only ever grow.
+# Messages are stored as a length followed by that many bytes.
+INDEX = struct.Struct("QQ")
+POSITION = struct.Struct("Q")
+LENGTH = struct.Struct("Q")
+
+# Upper bound on a single wait, as a backstop against a lost wakeup.
+WAIT = 0.05
+
+# The value added to an eventfd counter by a wakeup.
+ONE = struct.pack("Q", 1)
+
+
+class _Wakeup:
+    """
+    A wakeup between two processes: an eventfd where the platform has one,
+    and otherwise a pipe. Setting never blocks, and a wakeup set before the
+    other side starts waiting is not lost.
+    """
+
+    def __init__(self) -> None:
+        if hasattr(os, "eventfd"):
+            self.rfd = self.wfd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        else:
+            self.rfd, self.wfd = os.pipe()
+            os.set_blocking(self.rfd, False)
+            os.set_blocking(self.wfd, False)
+
+    def set(self) -> None:
+        """ Wakes the other side, if it is waiting. """
+        try:
+            os.write(self.wfd, ONE)
+        except BlockingIOError:
+            pass
+
+    def wait(self, timeout: float) -> None:
+        """ Waits up to ``timeout`` seconds for ``set()``, and clears it. """
+        select.select([self.rfd], [], [], timeout)
+        try:
+            os.read(self.rfd, 4096)
+        except BlockingIOError:
+            pass
+
+
+class SharedRing:
+    """
+    A single-producer, single-consumer byte ring in shared memory, with the
+    ``send``/``recv`` interface of a ``multiprocessing`` connection. It must be
+    created before the other process is forked, which inherits the mapping and
+    the wakeup descriptors; one process then only sends and the other only
+    receives. Only the positions cross the process boundary, so a message is
+    copied once into the ring and once out of it, and no system call is made
+    beyond the wakeups.
+
+    Parameters
+    ----------
+    capacity : ``int``.
+        Size of the ring storage in bytes.
+    """
+
+    def __init__(self, capacity: int = CAPACITY):
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=INDEX.size + capacity)
+        buf = self.shm.buf
+        assert buf is not None
+        self.buf = buf
+        INDEX.pack_into(self.buf, 0, 0, 0)
+        self.readable = _Wakeup()
+        self.writable = _Wakeup()
+
+    def unlink(self) -> None:
+        """
+        Removes the segment's name once both processes hold the mapping, so
+        that it is freed when they exit however they exit.
+        """
+        self.shm.unlink()
+
+    def send_bytes(self, data: Buffer) -> None:
+        """ Writes a message, waiting while the ring is full. """
+        view = memoryview(data).cast("B")
+        self._write(memoryview(LENGTH.pack(view.nbytes)))
+        self._write(view)
+
+    def recv_bytes(self) -> bytearray:
+        """ Reads a message, waiting while the ring is empty. """
+        length = bytearray(LENGTH.size)
+        self._read(memoryview(length))
+        message = bytearray(LENGTH.unpack(length)[0])
+        self._read(memoryview(message))
+        return message
+
+    def send(self, obj: Any) -> None:
+        """ Pickles and writes ``obj``, like ``Connection.send()``. """
+        self.send_bytes(ForkingPickler.dumps(obj))
+
+    def recv(self) -> Any:
+        """ Reads and unpickles an object, like ``Connection.recv()``. """
+        return pickle.loads(self.recv_bytes())
+
+    def poll(self, timeout: Optional[float] = 0.0) -> bool:
+        """ Returns whether a message can be read, waiting up to ``timeout``. """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            head, tail = INDEX.unpack_from(self.buf)
+            if head != tail:
+                return True
+            remaining = WAIT if deadline is None else deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.readable.wait(min(remaining, WAIT))
+
+    def _write(self, view: memoryview) -> None:
+        """ Copies ``view`` into the ring, publishing each piece as it fits. """
+        while view:
+            head, tail = INDEX.unpack_from(self.buf)
+            free = self.capacity - (head - tail)
+            if not free:
+                self.writable.wait(WAIT)
+                continue
+            start = head % self.capacity
+            size = min(free, view.nbytes, self.capacity - start)
+            offset = INDEX.size + start
+            self.buf[offset : offset + size] = view[:size]
+            POSITION.pack_into(self.buf, 0, head + size)
+            self.readable.set()
+            view = view[size:]
+
+    def _read(self, view: memoryview) -> None:
+        """ Fills ``view`` from the ring, releasing each piece as it is read. """
+        while view:
+            head, tail = INDEX.unpack_from(self.buf)
+            if head == tail:
+                self.readable.wait(WAIT)
+                continue
+            start = tail % self.capacity
+            size = min(head - tail, view.nbytes, self.capacity - start)
+            offset = INDEX.size + start
+            view[:size] = self.buf[offset : offset + size]
+            POSITION.pack_into(self.buf, POSITION.size, tail + size)
+            self.writable.set()
+            view = view[size:]
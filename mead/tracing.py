@@ -0,0 +1,97 @@
+""" Sampled, in-memory tracing of messages through pipes and clients. """
+import os
+import json
+import time
+from typing import Any, Dict, List, Tuple, Optional
+
+# pylint: disable=too-few-public-methods
+
+# Records kept per process, after which the oldest are overwritten.
+CAPACITY = 65536
+
+# The sampling rate of a process which never calls ``enable()``, e.g. a
+# remote worker, is read from this environment variable.
+RATE_VARIABLE = "MEAD_TRACE_RATE"
+
+# Fields of a record, in order.
+FIELDS = ("time", "event", "pipe_id", "size")
+
+Record = Tuple[float, str, Any, int]
+
+
+class Tracer:
+    """
+    Records the time, event name, pipe id and size of a sample of messages
+    in a fixed ring, in place of logging their contents. Nothing is formatted
+    until ``dump()``, and while tracing is off call sites only test
+    ``active`` before skipping ``record()``.
+
+    Parameters
+    ----------
+    rate : ``float``.
+        Fraction of events recorded, from 0 (off) to 1 (every event).
+    capacity : ``int``.
+        Number of records kept.
+    """
+
+    def __init__(self, rate: float = 0.0, capacity: int = CAPACITY):
+        self.active = False
+        self.every = 0
+        self.count = 0
+        self.head = 0
+        self.records: List[Optional[Record]] = []
+        self.configure(rate, capacity)
+
+    def configure(self, rate: float, capacity: int = CAPACITY) -> None:
+        """ Sets the sampling rate and clears the ring. """
+        self.active = rate > 0
+        self.every = max(round(1 / rate), 1) if rate > 0 else 0
+        self.count = 0
+        self.head = 0
+        self.records = [None] * capacity
+
+    def record(self, event: str, pipe_id: Any, size: int) -> None:
+        """ Records one event, if it falls in the sample. """
+        self.count += 1
+        if self.count % self.every:
+            return
+        self.records[self.head] = (time.monotonic(), event, pipe_id, size)
+        self.head = (self.head + 1) % len(self.records)
+
+    def dump(self) -> List[Dict[str, Any]]:
+        """ Returns the records in the ring, oldest first. """
+        ordered = self.records[self.head :] + self.records[: self.head]
+        return [
+            dict(zip(FIELDS, (stamp, event, str(pipe_id), size)))
+            for stamp, event, pipe_id, size in filter(None, ordered)
+        ]
+
+
+TRACER = Tracer(float(os.environ.get(RATE_VARIABLE) or 0))
+
+
+def enable(rate: float = 1.0, capacity: int = CAPACITY) -> None:
+    """
+    Starts tracing a ``rate`` fraction of messages in this process, and in
+    processes it starts afterwards.
+    """
+    TRACER.configure(rate, capacity)
+
+
+def disable() -> None:
+    """ Stops tracing, keeping the records for ``dump()``. """
+    TRACER.active = False
+
+
+def dump(path: str = "") -> List[Dict[str, Any]]:
+    """
+    Returns this process's trace records, oldest first, and also writes them
+    to ``path`` as JSON lines if given. Times are ``time.monotonic()``, which
+    is comparable across processes on one machine.
+    """
+    records = TRACER.dump()
+    if path:
+        with open(path, "w") as trace_file:
+            for record in records:
+                trace_file.write(json.dumps(record) + "\n")
+    return records
@@ -5,10 +5,12 @@ import logging
 import multiprocessing as mp
 from typing import Dict, Optional
 from multiprocessing.connection import Connection
+from multiprocessing.reduction import ForkingPickler
 
-import dill
-
-from mead.classes import Parcel, _Join, _Kill, _Terminate
+from mead import cellar
+from mead.tracing import TRACER
+from mead.classes import Parcel, _Join, _Kill, _Stats, _Immediate, _Terminate
+from mead.serialization import loads
 
 
 def inject(
@@ -22,9 +24,8 @@ def inject(
     signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
 
     while 1:
-        logging.info("INJECTION: waiting.")
-        bparcel = in_spout.recv()
-        parcel = dill.loads(bparcel)
+        bparcel = in_spout.recv_bytes()
+        parcel = loads(bparcel)
 
         # Handle process signals.
         if aux_funnel and isinstance(parcel, (_Join, _Terminate, _Kill)):
@@ -32,13 +33,19 @@ def inject(
             aux_funnel.send(parcel)
             continue
 
+        # Workers' counters go to ``mead.stats()`` on the head node.
+        if isinstance(parcel, _Stats) and cellar.STATS_QUEUE is not None:
+            cellar.STATS_QUEUE.put(parcel)
+            continue
+
         # If the received object is not a signal, it ought to be a parcel.
         if not isinstance(parcel, Parcel):
-            logging.info("INJECTION: Error: obj not a Parcel: %s", str(parcel))
+            logging.info("INJECTION: Error: not a Parcel: %s", type(parcel).__name__)
             continue
 
         assert not isinstance(parcel.obj, Parcel)
-        logging.info("INJECTION: parcel: %s for pipe: %s", str(parcel), parcel.pipe_id)
+        if TRACER.active:
+            TRACER.record("inject", parcel.pipe_id, len(bparcel))
         injection_funnels[parcel.pipe_id].send(parcel.obj)
 
 
@@ -49,8 +56,15 @@ def extract(pipe_id: str, out_queue: mp.Queue, extraction_spout: Connection) ->
     signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
 
     while 1:
-        obj = extraction_spout.recv()
-        logging.info("EXTRACTION: obj: %s", str(obj))
+        bobj = extraction_spout.recv_bytes()
+        if TRACER.active:
+            TRACER.record("extract", pipe_id, len(bobj))
+        obj = ForkingPickler.loads(bobj)
         assert not isinstance(obj, Parcel)
         parcel = Parcel(pipe_id, obj)
-        out_queue.put(parcel)
+
+        # Tell the client not to hold latency-sensitive messages back.
+        if pipe_id in cellar.NO_COALESCE:
+            out_queue.put(_Immediate(parcel))
+        else:
+            out_queue.put(parcel)
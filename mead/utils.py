@@ -4,7 +4,6 @@ import socket
 import struct
 from typing import List, Tuple
 
-import dill
 from gevent import joinall
 from paramiko import SSHConfig
 from pssh.clients import ParallelSSHClient
@@ -25,6 +24,18 @@ def bytes2addr(bytes_address: bytes) -> Tuple[Tuple[str, int], int]:
     return target, nat_type_id
 
 
+def is_local_host(hostname: str) -> bool:
+    """ Whether ``hostname`` names the machine we are running on. """
+    if hostname in ("localhost", socket.gethostname(), socket.getfqdn()):
+        return True
+    try:
+        address = socket.gethostbyname(hostname)
+        _, _, local = socket.gethostbyname_ex(socket.gethostname())
+    except OSError:
+        return False
+    return address.startswith("127.") or address in local
+
+
 def get_available_hostnames_from_sshconfig(config_file: str = "") -> List[str]:
     """
     Parses user's OpenSSH config for per hostname configuration for
@@ -68,24 +79,6 @@ def get_available_hostnames_from_sshconfig(config_file: str = "") -> List[str]:
     return hostnames
 
 
-def get_length_message_pair(obj: object) -> bytes:
-    """ Pickles an object and returns bytes of a length+message pair. """
-    message: bytes = dill.dumps(obj)
-
-    # Get representation of then length of ``message`` in bytes.
-    length = str(len(message)).encode("ascii")
-    assert len(length) <= 16
-
-    # Compute the pad so that prefix is a 16-byte sequence.
-    padsize = 16 - len(length)
-    pad = ("0" * padsize).encode("ascii")
-
-    # Concatenate prefix and message.
-    parcel = pad + length + message
-
-    return parcel
-
-
 def scp_recv(
     client: ParallelSSHClient,
     remote_file: str,
@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 # coding:utf-8
-""" Starts a UDP server listening for connecting clients. """
-import sys
+""" Starts a UDP server introducing clients which ask for the same channel. """
+import json
+import time
 import socket
 import struct
-from typing import Dict, Tuple
-from collections import namedtuple
+import asyncio
+import logging
+import argparse
+from typing import Any, Dict, Tuple, Optional
+from collections import OrderedDict
 
 # pylint: disable=invalid-name
 
@@ -16,109 +20,216 @@ SymmetricNAT = "Symmetric NAT"  # 3
 UnknownNAT = "Unknown NAT"  # 4
 NATTYPE = (FullCone, RestrictNAT, RestrictPortNAT, SymmetricNAT, UnknownNAT)
 
+# Seconds a client has to confirm its request, and then to be joined by a
+# partner on its channel, before it is forgotten.
+TTL = 30.0
 
-def addr2bytes(addr: Tuple[str, int], nat_type_id: str) -> bytes:
-    """ Convert an address-NATtype pair to a hash. """
-    host, port = addr
-    try:
-        host = socket.gethostbyname(host)
-    except (socket.gaierror, socket.error):
-        raise ValueError("invalid host")
-    try:
-        port = int(port)
-    except ValueError:
-        raise ValueError("invalid port")
-    try:
-        nat_type_idx = int(nat_type_id)
-    except ValueError:
-        raise ValueError("invalid NAT type")
-    byte_address = socket.inet_aton(host)
-    byte_address += struct.pack("H", port)
-    byte_address += struct.pack("H", nat_type_idx)
-    return byte_address
-
-
-def main() -> None:
-    """ Starts a UDP server listening for connecting clients. """
-    port = int(sys.argv[1])
-
-    sockfd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sockfd.bind(("", port))
-    print("listening on *:%d (udp)" % port)
-
-    ClientInfo = namedtuple("ClientInfo", "addr, nat_type_id")
-    channel_map: Dict[str, ClientInfo] = {}
-
-    connection_stages: Dict[Tuple[str, int], Tuple[str, str]] = {}
-    addr: Tuple[str, int]
-
-    while True:
-
-        # At this pout, ``data`` could be a channel, NAT-type pair, or an ok.
-        data_bytes, addr = sockfd.recvfrom(1024)
-        data = data_bytes.decode("ascii")
-        if data == "RESET":
-            connection_stages = {}
-            channel_map = {}
-            reset = "RESET_COMPLETED"
-            breset = reset.encode("ascii")
-            sockfd.sendto(breset, addr)
-            continue
-
-        # Retrieve the connection stage of this address.
-        stage, channel = connection_stages.get(addr, ("initial", ""))
+# Most clients kept at each stage. Past this the oldest are forgotten first,
+# so that a flood of requests which are never completed cannot exhaust memory.
+MAX_ENTRIES = 100000
 
-        # Receive a channel and NAT type from a client.
-        if stage == "initial":
-            channel, nat_type_id = data.strip().split()
-            print("connection from %s:%d" % addr)
+# Seconds between sweeps for expired clients while no requests come in.
+SWEEP_INTERVAL = 1.0
 
-            # Tell the client ``ok``, it is connected to the channel.
-            ok_msg_bytes = ("ok %s" % channel).encode("ascii")
-            sockfd.sendto(ok_msg_bytes, addr)
+# Socket receive buffer, so that bursts of requests are queued, not dropped.
+RCVBUF = 4 * 2 ** 20
 
-            # Display channel and NAT type.
-            nat_type = NATTYPE[int(nat_type_id)]
-            print("channel=%s, nat_type=%s, ok sent to client" % (channel, nat_type))
+Address = Tuple[str, int]
 
-            # Update the connection stage.
-            connection_stages[addr] = ("confirm", channel)
-            continue
 
-        # Wait until the client confirms it received the ``ok``.
-        if stage == "confirm":
-            if data != "ok":
-                continue
-
-        print("request received for channel:", channel)
-
-        # Attempt to match client with an already-connected client on same channel.
-        if channel in channel_map:
-
-            # Get addresses of peers.
-            addr_a = channel_map[channel].addr
-            addr_b = addr
-
-            # Get NAT types of peers.
-            nat_type_id_a = channel_map[channel].nat_type_id
-            nat_type_id_b = nat_type_id
-
-            sockfd.sendto(addr2bytes(addr_a, nat_type_id_a), addr_b)
-            sockfd.sendto(addr2bytes(addr_b, nat_type_id_b), addr_a)
-            print("linked", channel)
+def addr2bytes(addr: Address, nat_type_id: int) -> bytes:
+    """
+    Packs an address and NAT type for ``mead.utils.bytes2addr()``. The host
+    is numeric, as the socket reports it, so there is nothing to look up.
+    """
+    host, port = addr
+    return socket.inet_aton(host) + struct.pack("HH", port, nat_type_id)
+
+
+class Rendezvous(asyncio.DatagramProtocol):
+    """
+    Pairs clients over UDP. A client sends its channel and NAT type, is
+    answered ``ok <channel>``, and confirms with ``ok``. The first client to
+    confirm on a channel waits there, and the second is sent the address of
+    the first, and the first that of the second, after which the server
+    forgets both. Clients which share a socket, and so an address, confirm
+    with ``ok <channel>`` instead, and have the channel appended to the
+    address they are sent. ``RESET`` forgets every client, and ``STATS`` is
+    answered with the counters and the number of clients at each stage, as
+    JSON.
+
+    Each datagram takes constant work. Clients at each stage are kept oldest
+    first, so those past their deadline are dropped from the front as
+    datagrams come in, and by a sweep while none do.
+
+    Parameters
+    ----------
+    ttl : ``float``.
+        Seconds a client is kept at each stage.
+    max_entries : ``int``.
+        Most clients kept at each stage.
+    """
+
+    def __init__(self, ttl: float = TTL, max_entries: int = MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.sweeper: Optional[asyncio.TimerHandle] = None
+
+        # Clients yet to confirm, with their deadline and NAT type, by address
+        # and channel, and the channel each address last asked for, which a
+        # bare ``ok`` confirms.
+        self.requests: "OrderedDict[Tuple[Address, str], Tuple[float, int]]"
+        self.requests = OrderedDict()
+        self.latest: "OrderedDict[Address, Tuple[float, str]]" = OrderedDict()
+
+        # Clients waiting for a partner, with their deadline, address, NAT type
+        # and whether they confirmed with their channel, by channel.
+        self.waiting: "OrderedDict[str, Tuple[float, Address, int, bool]]"
+        self.waiting = OrderedDict()
+
+        self.counts: Dict[str, int] = {
+            "requests": 0,
+            "pairs": 0,
+            "expired": 0,
+            "evicted": 0,
+            "invalid": 0,
+        }
+
+    def connection_made(self, transport: Any) -> None:
+        """ Keeps the transport, and starts sweeping. """
+        self.transport = transport
+        self.sweep()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        """ Stops sweeping. """
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+
+    def sweep(self) -> None:
+        """ Drops expired clients, and runs again after ``SWEEP_INTERVAL``. """
+        self.expire(time.monotonic())
+        loop = asyncio.get_event_loop()
+        self.sweeper = loop.call_later(SWEEP_INTERVAL, self.sweep)
+
+    def datagram_received(self, data: bytes, addr: Address) -> None:
+        """ Advances the client at ``addr`` by one stage. """
+        now = time.monotonic()
+        self.expire(now)
+        if data == b"RESET":
+            self.requests.clear()
+            self.latest.clear()
+            self.waiting.clear()
+            self.send(b"RESET_COMPLETED", addr)
+            return
+        if data == b"STATS":
+            stats = dict(self.counts, requested=len(self.requests))
+            stats["waiting"] = len(self.waiting)
+            self.send(json.dumps(stats).encode("ascii"), addr)
+            return
+
+        # Anything but a confirmation starts over, e.g. from a restarted client.
+        tagged = data[:3] == b"ok "
+        if tagged:
+            channel = data[3:].decode("ascii", "replace")
+        else:
+            latest = self.latest.pop(addr, None) if data == b"ok" else None
+            channel = latest[1] if latest is not None else ""
+        request = self.requests.pop((addr, channel), None)
+        if request is not None:
+            self.confirm(channel, addr, request[1], now, tagged)
+        else:
+            self.request(data, addr, now)
+
+    def request(self, data: bytes, addr: Address, now: float) -> None:
+        """ Answers a request for a channel, which the client must confirm. """
+        try:
+            channel, nat_type = data.decode("ascii").split()
+            nat_type_id = int(nat_type)
+        except ValueError:
+            nat_type_id = -1
+        if not 0 <= nat_type_id < len(NATTYPE):
+            self.counts["invalid"] += 1
+            return
+        self.counts["requests"] += 1
+        logging.debug("channel=%s, nat_type=%s from %s:%d", channel, nat_type, *addr)
+        self.send(("ok %s" % channel).encode("ascii"), addr)
+
+        # Entries go to the back, which keeps each dict ordered by deadline.
+        self.requests[(addr, channel)] = (now + self.ttl, nat_type_id)
+        self.requests.move_to_end((addr, channel))
+        self.latest[addr] = (now + self.ttl, channel)
+        self.latest.move_to_end(addr)
+        self.bound(self.requests)
+        self.bound(self.latest)
+
+    def confirm(
+        self, channel: str, addr: Address, nat_type_id: int, now: float, tagged: bool
+    ) -> None:
+        """ Pairs a client with the one waiting on its channel, or makes it wait. """
+        waiting = self.waiting.pop(channel, None)
+        if waiting is None or waiting[1] == addr:
+            self.waiting[channel] = (now + self.ttl, addr, nat_type_id, tagged)
+            self.bound(self.waiting)
+            return
+        _, other, other_nat_type_id, other_tagged = waiting
+        tag = channel.encode("ascii")
+        self.send(addr2bytes(other, other_nat_type_id) + tag * tagged, addr)
+        self.send(addr2bytes(addr, nat_type_id) + tag * other_tagged, other)
+        self.counts["pairs"] += 1
+        logging.debug("linked %s", channel)
+
+    def expire(self, now: float) -> None:
+        """ Drops the clients whose deadline has passed, oldest first. """
+        stages: Tuple[Any, ...] = (self.requests, self.latest, self.waiting)
+        for entries in stages:
+            while entries and next(iter(entries.values()))[0] <= now:
+                entries.popitem(last=False)
+                self.counts["expired"] += 1
+
+    def bound(self, entries: "OrderedDict[Any, Any]") -> None:
+        """ Drops the oldest clients past ``max_entries``. """
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self.counts["evicted"] += 1
+
+    def send(self, data: bytes, addr: Address) -> None:
+        """ Sends a datagram to a client. """
+        assert self.transport is not None
+        self.transport.sendto(data, addr)
+
+
+async def serve(port: int, ttl: float = TTL, max_entries: int = MAX_ENTRIES) -> None:
+    """ Runs a ``Rendezvous`` server on ``port`` until cancelled. """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF)
+    sock.bind(("", port))
+
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: Rendezvous(ttl, max_entries), sock=sock
+    )
+    print("listening on *:%d (udp)" % port, flush=True)
+    try:
+        await loop.create_future()
+    finally:
+        transport.close()
 
-            # Safely remove channel from queue.
-            channel_map.pop(channel, None)
 
-        # Otherwise, add client to the channel_map on its requested channel.
-        else:
-            channel_map[channel] = ClientInfo(addr, nat_type_id)
+def main() -> None:
+    """ Starts a UDP server listening for connecting clients. """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("port", type=int)
+    parser.add_argument("--ttl", type=float, default=TTL)
+    parser.add_argument("--max-entries", type=int, default=MAX_ENTRIES)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    try:
+        asyncio.run(serve(args.port, args.ttl, args.max_entries))
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("usage: server.py port")
-        sys.exit()
-    else:
-        assert sys.argv[1].isdigit(), "port should be a number!"
-        main()
+    main()
@@ -0,0 +1,40 @@
+""" Tests for coalescing and sending on a link. """
+import socket
+from typing import Any, List, cast
+
+from mead.client import Client
+from mead.framing import DATA, BATCH, pack_header, unpack_header
+
+
+class _Socket:
+    """ Records the datagrams a client sends. """
+
+    def __init__(self) -> None:
+        self.sent: List[bytes] = []
+
+    def sendmsg(self, segments: List[Any], *_: Any) -> int:
+        self.sent.append(b"".join(segments))
+        return len(self.sent[-1])
+
+
+def test_coalesced_messages_go_out_on_flush() -> None:
+    client = Client("127.0.0.1", 9, "worker", options={"coalesce": True})
+    sock = _Socket()
+    for pipe_id in range(3):
+        client.queue(DATA, pipe_id, [b"small"], coalesce=True)
+    assert not client.backlog
+
+    # Flushing does not wait for more company.
+    assert client.flush(cast(socket.socket, sock), 0.0) is None
+    assert [unpack_header(datagram).msg_type for datagram in sock.sent] == [BATCH]
+    assert not client.batch
+
+
+def test_datagrams_from_the_handshake_are_kept() -> None:
+    client = Client("127.0.0.1", 9, "worker")
+    client.early.append(pack_header(DATA, 7, 0, 5) + b"early")
+    messages = client.on_early(cast(socket.socket, _Socket()), 0.0)
+    assert [(header.pipe_id, bytes(message)) for header, message in messages] == [
+        (7, b"early")
+    ]
+    assert not client.early
@@ -0,0 +1,58 @@
+""" Tests for adaptive compression and bounded decompression. """
+from typing import List
+
+import pytest
+
+from mead.framing import Buffer
+from mead.compression import ORIGINAL, Compressor
+
+LIMIT = 2 ** 24
+
+
+def _compress(algorithm: str, data: bytes) -> List[Buffer]:
+    """ Returns the compressed segments of a message on a fresh pipe. """
+    flag, segments = Compressor(algorithm, threshold=1).compress(0, [data], 1e3)
+    assert flag
+    return segments
+
+
+@pytest.mark.parametrize("algorithm", ["zlib", "lzma"])
+@pytest.mark.parametrize("size", [100, 1000, 65536, 2 ** 20])
+def test_round_trip(algorithm: str, size: int) -> None:
+    data = (b"mead" * size)[:size]
+    segments = _compress(algorithm, data)
+    flag = Compressor(algorithm).flag
+    assert bytes(Compressor.decompress(flag, b"".join(segments), LIMIT)) == data
+
+
+def test_uncompressed_messages_pass_through() -> None:
+    message = memoryview(b"plain")
+    assert Compressor.decompress(0, message, 0) is message
+
+
+def test_incompressible_messages_are_sent_as_they_are() -> None:
+    compressor = Compressor("zlib", threshold=1)
+    data = bytes(range(256))
+    assert compressor.compress(0, [data], 1e3) == (0, [data])
+
+
+@pytest.mark.parametrize("algorithm", ["zlib", "lzma"])
+def test_bad_messages_are_rejected(algorithm: str) -> None:
+    flag = Compressor(algorithm).flag
+    message = b"".join(_compress(algorithm, b"x" * 100000))
+    body = message[ORIGINAL.size :]
+    bad = [
+        message[:4],
+        message[:-4],
+        message + b"trailing",
+        ORIGINAL.pack(1000) + body,
+        ORIGINAL.pack(200000) + body,
+        ORIGINAL.pack(100000) + b"not compressed at all",
+    ]
+    for each in bad:
+        with pytest.raises(ValueError):
+            Compressor.decompress(flag, each, LIMIT)
+
+    # A message may not claim more than the limit, whatever it holds.
+    with pytest.raises(ValueError):
+        Compressor.decompress(flag, message, 99999)
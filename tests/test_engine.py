@@ -0,0 +1,93 @@
+""" Tests for message dispatch in the transport engine. """
+import os
+import pickle
+import socket
+import selectors
+import multiprocessing as mp
+from typing import Any, List, Tuple
+
+from mead.client import Client
+from mead.engine import SIZE, Engine
+from mead.classes import Parcel, _Handover
+from mead.framing import CONTROL, NO_PIPE, Buffer, Header
+from mead.metrics import FAILURES
+from mead.serialization import dumps
+
+PICKLE = pickle.dumps("relayed")
+
+
+def _message(obj: Any) -> Tuple[Header, Buffer]:
+    """ Returns a control message as the client hands it to the engine. """
+    payload = b"".join(dumps(obj))
+    return Header(CONTROL, NO_PIPE, 0, len(payload)), payload
+
+
+def test_bad_messages_do_not_stop_the_loop() -> None:
+    received: List[Any] = []
+
+    def on_control(channel: str, obj: Any) -> None:
+        if obj == "raise":
+            raise RuntimeError("handler failed")
+        received.append((channel, obj))
+
+    engine = Engine(on_control)
+    client = Client("127.0.0.1", 9, "worker")
+    engine.clients["worker"] = client
+    garbage = Header(CONTROL, NO_PIPE, 0, 7), b"garbage"
+    messages = [_message("first"), garbage, _message("raise"), _message("last")]
+    engine._dispatch("worker", messages)  # pylint: disable=protected-access
+    assert received == [("worker", "first"), ("worker", "last")]
+    assert client.metrics.values[FAILURES] == 2
+
+
+def test_callbacks_changed_within_a_batch_are_not_run_stale() -> None:
+    engine = Engine()
+    calls: List[str] = []
+    first, first_peer = socket.socketpair()
+    second, second_peer = socket.socketpair()
+    third, third_peer = socket.socketpair()
+
+    def reroute() -> None:
+        calls.append("reroute")
+        selector = engine.selector
+        selector.modify(second, selectors.EVENT_READ, lambda: calls.append("new"))
+        selector.unregister(third)
+        engine.running = False
+
+    # The sockets become ready in order, so the first one reroutes the rest.
+    for sock, callback in ((first, reroute), (second, lambda: calls.append("old"))):
+        engine.selector.register(sock, selectors.EVENT_READ, callback)
+    engine.selector.register(third, selectors.EVENT_READ, lambda: calls.append("gone"))
+    for peer in (first_peer, second_peer, third_peer):
+        peer.send(b"x")
+    engine.run()
+    assert "old" not in calls and "gone" not in calls
+    for sock in (first, first_peer, second, second_peer, third, third_peer):
+        sock.close()
+
+
+def test_a_partial_message_does_not_hold_up_a_handover() -> None:
+    engine = Engine()
+    client = Client("127.0.0.1", 9, "receiver")
+    submitted: List[Any] = []
+    client.submit = lambda obj, *args: submitted.append(obj)  # type: ignore
+    engine.clients["receiver"] = client
+    funnel, spout = mp.Pipe()
+    engine._attach(
+        "receiver", {}, {"5": spout}, None, ""
+    )  # pylint: disable=protected-access
+
+    # Half of a message is in the pipe, and only the head's process has the rest.
+    handover = _Handover("5", "link")
+    frame = SIZE.pack(len(PICKLE)) + PICKLE
+    os.write(funnel.fileno(), frame[:6])
+    engine._handover("sender", handover)  # pylint: disable=protected-access
+    assert not submitted
+
+    os.write(funnel.fileno(), frame[6:])
+    engine.selector.get_key(spout).data()
+    assert len(submitted) == 2
+    assert isinstance(submitted[0], Parcel) and submitted[0].obj == "relayed"
+    assert submitted[1] is handover
+    funnel.close()
+    spout.close()
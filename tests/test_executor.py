@@ -0,0 +1,61 @@
+""" Tests for the bookkeeping of the executor. """
+import time
+from types import SimpleNamespace
+from threading import Condition
+from collections import deque
+from concurrent.futures import Future, BrokenExecutor
+
+import pytest
+
+from mead.executor import Executor, _Call, _Batch, _Worker
+
+
+def _executor(workers: int) -> Executor:
+    """ Returns an executor with idle workers and no processes behind them. """
+    executor = Executor.__new__(Executor)
+    executor.queue = deque()
+    executor.condition = Condition()
+    executor.speculate = False
+    executor.timeout = None
+    executor.workers = [
+        _Worker("host", None, None, None)  # type: ignore
+        for _ in range(workers)
+    ]
+    return executor
+
+
+def test_losing_the_last_worker_fails_every_call() -> None:
+    executor = _executor(1)
+    worker = executor.workers[0]
+    calls = [_Call(Future(), print, (), {}) for _ in range(3)]
+    executor.queue.extend(calls)
+    batch = executor._next_batch(worker, False)  # pylint: disable=protected-access
+    assert isinstance(batch, _Batch)
+    worker.outstanding.append((0, batch))
+
+    # A call never sent is still pending, and may have been cancelled.
+    queued = _Call(Future(), print, (), {})
+    cancelled = _Call(Future(), print, (), {})
+    cancelled.future.cancel()
+    executor.queue.extend([queued, cancelled])
+
+    executor._fail(worker)  # pylint: disable=protected-access
+    for call in calls + [queued]:
+        with pytest.raises(BrokenExecutor):
+            call.future.result(timeout=0)
+    assert cancelled.future.cancelled()
+    assert not executor.queue
+
+
+def test_a_batch_held_past_the_timeout_loses_the_worker() -> None:
+    executor = _executor(1)
+    executor.timeout = 5.0
+    worker = executor.workers[0]
+    worker.process = SimpleNamespace(local=False)  # type: ignore
+    batch = _Batch([_Call(Future(), print, (), {})])
+    worker.outstanding.append((0, batch))
+
+    batch.started = time.monotonic()
+    assert executor._lost(worker) is None  # pylint: disable=protected-access
+    batch.started -= 10.0
+    assert executor._lost(worker) is not None  # pylint: disable=protected-access
@@ -0,0 +1,167 @@
+""" Tests for the wire header, fragmentation, batching and reassembly. """
+import struct
+from typing import List, Tuple, Optional, Sequence
+
+import pytest
+
+from mead import framing
+from mead.framing import (
+    DATA,
+    HEADER,
+    BATCH,
+    CONTROL,
+    Buffer,
+    Header,
+    Reassembler,
+    batch,
+    unbatch,
+    fragment,
+    pack_header,
+    unpack_header,
+)
+
+
+class _Clock:
+    """ A stand-in for ``time.monotonic()`` which only moves when told. """
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _datagrams(message: bytes, chunk_size: int, seq: int = 7) -> List[bytes]:
+    """ Fragments a message and returns the datagrams as they go on the wire. """
+    datagrams = []
+    for header, pieces in fragment(DATA, 3, seq, [message], chunk_size):
+        datagrams.append(pack_header(*header) + b"".join(pieces))
+    return datagrams
+
+
+def _add(reassembler: Reassembler, datagram: bytes) -> Optional[Buffer]:
+    """ Passes a datagram's chunk to the reassembler, as the client does. """
+    return reassembler.add(unpack_header(datagram), datagram[HEADER.size :])
+
+
+def test_header_round_trip() -> None:
+    header = Header(CONTROL, 12, 34, 5000, 1000, framing.RAW, 56, 2)
+    datagram = pack_header(*header) + bytes(100)
+    assert unpack_header(datagram) == header
+
+
+def test_header_rejects_bad_datagrams() -> None:
+    with pytest.raises(ValueError):
+        unpack_header(b"short")
+    bad_magic = struct.pack("!H", 0x1234) + pack_header(DATA, 0, 0, 0)[2:]
+    with pytest.raises(ValueError):
+        unpack_header(bad_magic)
+    with pytest.raises(ValueError):
+        unpack_header(pack_header(DATA, 0, 0, 10, 5) + bytes(6))
+
+
+def test_fragment_covers_message_without_copies() -> None:
+    segments: List[Buffer] = [b"abc", bytearray(b"defgh"), memoryview(b"ijklmnop")]
+    message = b"abcdefghijklmnop"
+    chunks = list(fragment(DATA, 1, 2, segments, chunk_size=5))
+    assert [header.offset for header, _ in chunks] == [0, 5, 10, 15]
+    assert all(header.length == len(message) for header, _ in chunks)
+    assert all(isinstance(piece, memoryview) for _, ps in chunks for piece in ps)
+    assert b"".join(bytes(p) for _, pieces in chunks for p in pieces) == message
+
+
+def test_fragment_empty_message() -> None:
+    chunks = list(fragment(DATA, 1, 2, [b""]))
+    assert len(chunks) == 1
+    assert chunks[0][0].length == 0
+    assert chunks[0][1] == []
+
+
+def test_single_chunk_passes_through() -> None:
+    (datagram,) = _datagrams(b"hello", 100)
+    whole = _add(Reassembler(), datagram)
+    assert whole is not None and bytes(whole) == b"hello"
+
+
+def test_reassembles_out_of_order_and_ignores_duplicates() -> None:
+    message = bytes(range(256)) * 10
+    datagrams = _datagrams(message, 100)
+    reassembler = Reassembler()
+    results = [_add(reassembler, d) for d in reversed(datagrams[1:])]
+    assert results == [None] * (len(datagrams) - 1)
+    assert _add(reassembler, datagrams[-1]) is None
+    whole = _add(reassembler, datagrams[0])
+    assert whole is not None and bytes(whole) == message
+    assert reassembler.used == 0
+
+    # A late duplicate of a completed message is discarded.
+    assert _add(reassembler, datagrams[3]) is None
+    assert not reassembler.partials
+
+
+def test_message_over_budget_is_refused() -> None:
+    reassembler = Reassembler(budget=500)
+    assert _add(reassembler, _datagrams(bytes(1000), 100)[0]) is None
+    assert not reassembler.partials
+    assert reassembler.used == 0
+
+
+def test_budget_evicts_least_recently_active() -> None:
+    reassembler = Reassembler(budget=2500)
+    first = _datagrams(bytes(1000), 100, seq=1)
+    second = _datagrams(bytes(1000), 100, seq=2)
+    third = _datagrams(bytes(1000), 100, seq=3)
+    _add(reassembler, first[0])
+    _add(reassembler, second[0])
+    _add(reassembler, first[1])
+    _add(reassembler, third[0])
+    assert list(reassembler.partials) == [1, 3]
+    assert reassembler.abandoned == 1
+    assert reassembler.used == 2000
+
+
+def test_idle_messages_time_out(monkeypatch: pytest.MonkeyPatch) -> None:
+    clock = _Clock()
+    monkeypatch.setattr(framing.time, "monotonic", clock)
+    reassembler = Reassembler(timeout=10.0)
+    stale = _datagrams(bytes(300), 100, seq=1)
+    fresh = _datagrams(bytes(300), 100, seq=2)
+    _add(reassembler, stale[0])
+    clock.now += 8
+    _add(reassembler, fresh[0])
+    clock.now += 5
+    reassembler.expire()
+    assert list(reassembler.partials) == [2]
+    assert reassembler.abandoned == 1
+    assert reassembler.used == 300
+    clock.now += 10
+    reassembler.expire()
+    assert not reassembler.partials
+    assert reassembler.used == 0
+
+
+def test_batch_round_trip() -> None:
+    entries: List[Tuple[int, int, Sequence[Buffer], int, int]] = [
+        (DATA, 1, [b"ab", b"cd"], framing.RAW, 2),
+        (CONTROL, framing.NO_PIPE, [b""], 0, 0),
+        (DATA, 5, [memoryview(b"xyz")], 0, 1),
+    ]
+    message = b"".join(bytes(segment) for segment in batch(entries))
+    header = Header(BATCH, framing.NO_PIPE, 9, len(message))
+    unpacked = unbatch(header, message)
+    assert [bytes(body) for _, body in unpacked] == [b"abcd", b"", b"xyz"]
+    assert [(h.msg_type, h.pipe_id, h.flags, h.codec) for h, _ in unpacked] == [
+        (DATA, 1, framing.RAW, 2),
+        (CONTROL, framing.NO_PIPE, 0, 0),
+        (DATA, 5, 0, 1),
+    ]
+    assert all(h.seq == 9 for h, _ in unpacked)
+
+
+def test_unbatch_rejects_truncated_entries() -> None:
+    message = b"".join(bytes(s) for s in batch([(DATA, 1, [b"abcdef"], 0, 0)]))
+    header = Header(BATCH, framing.NO_PIPE, 0, len(message))
+    with pytest.raises(ValueError):
+        unbatch(header, message[:-1])
+    with pytest.raises(ValueError):
+        unbatch(header, message[:3])
@@ -0,0 +1,33 @@
+""" Tests for STUN discovery on the head's sockets. """
+import socket
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from mead import cellar, initialization
+from mead.mux import Mux
+from mead.initialization import discover
+
+
+def test_shared_sockets_are_looked_up_through_themselves(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    lookups: List[Tuple[socket.socket, int, Any]] = []
+
+    def get_nat_type(
+        sock: socket.socket, _: str, port: int
+    ) -> Tuple[str, Dict[str, Any]]:
+        lookups.append((sock, port, sock.gettimeout()))
+        return "Full Cone", {"ExternalIP": "203.0.113.1", "ExternalPort": 4000}
+
+    monkeypatch.setattr(initialization.stun, "get_nat_type", get_nat_type, False)
+    monkeypatch.setattr(cellar, "STUN_CACHE", {})
+    mux = Mux()
+    try:
+        port = mux.sock.getsockname()[1]
+        assert discover(port, mux.sock) == ("203.0.113.1", 4000)
+        assert discover(port, mux.sock) == ("203.0.113.1", 4000)
+        assert lookups == [(mux.sock, port, initialization.STUN_TIMEOUT)]
+        assert mux.sock.gettimeout() is None
+    finally:
+        mux.sock.close()
@@ -0,0 +1,138 @@
+""" Tests for the sliding-window ARQ and the round-trip estimator. """
+import pytest
+
+from mead.reliability import (
+    SERIAL,
+    SACK_BITS,
+    DUPTHRESH,
+    ACK_EVERY,
+    ACK_DELAY,
+    SendWindow,
+    RttEstimator,
+    ReceiveWindow,
+    seq_add,
+    seq_diff,
+)
+
+
+def test_serial_arithmetic_wraps() -> None:
+    assert seq_add(SERIAL - 1, 1) == 0
+    assert seq_add(SERIAL - 2, 5) == 3
+    assert seq_diff(2, SERIAL - 3) == 5
+    assert seq_diff(SERIAL - 3, 2) == -5
+    assert seq_diff(7, 7) == 0
+
+
+def test_receive_in_order_delays_acks() -> None:
+    window = ReceiveWindow()
+    delivered, now = window.receive(0, "a", 1.0)
+    assert delivered == ["a"] and not now
+    assert window.ack_deadline == 1.0 + ACK_DELAY
+    for packet in range(1, ACK_EVERY):
+        delivered, now = window.receive(packet, packet, 1.0)
+    assert now
+    assert window.ack() == (ACK_EVERY, 0)
+    assert window.ack_deadline is None
+
+
+def test_receive_reorders_and_reports_gaps() -> None:
+    window = ReceiveWindow()
+    assert window.receive(2, "c", 0.0) == ([], True)
+    assert window.receive(4, "e", 0.0) == ([], True)
+    assert window.ack() == (0, 0b1010)
+    assert window.receive(0, "a", 0.0) == (["a"], False)
+    assert window.receive(1, "b", 0.0) == (["b", "c"], True)
+    assert window.ack() == (3, 0b1)
+
+
+def test_receive_drops_duplicates_and_far_packets() -> None:
+    window = ReceiveWindow(size=8)
+    window.receive(0, "a", 0.0)
+    assert window.receive(0, "a", 0.0) == ([], True)
+    assert window.receive(9, "far", 0.0) == ([], True)
+    assert not window.buffered
+
+
+def test_receive_across_wraparound() -> None:
+    window = ReceiveWindow()
+    window.expected = SERIAL - 2
+    assert window.receive(0, "c", 0.0) == ([], True)
+    assert window.receive(SERIAL - 2, "a", 0.0) == (["a"], False)
+    assert window.receive(SERIAL - 1, "b", 0.0) == (["b", "c"], True)
+    assert window.expected == 1
+
+
+def test_sack_bitmap_is_bounded() -> None:
+    window = ReceiveWindow(size=SACK_BITS * 2)
+    window.receive(SACK_BITS, "last", 0.0)
+    window.receive(SACK_BITS + 1, "beyond", 0.0)
+    assert window.ack() == (0, 1 << (SACK_BITS - 1))
+
+
+def test_send_window_fills_and_drains() -> None:
+    window = SendWindow(size=4)
+    for _ in range(4):
+        assert not window.full()
+        window.track(["x"], 0.0)
+    assert window.full()
+    acked, samples, lost = window.on_ack(2, 0, 0.5)
+    assert (acked, samples, lost) == (2, [0.5, 0.5], [])
+    assert not window.full()
+    assert window.full(limit=2)
+
+
+def test_send_window_sack_and_fast_retransmit() -> None:
+    window = SendWindow()
+    for _ in range(6):
+        window.track([], 0.0)
+
+    # Packet 1 is missing; 2 to 1 + DUPTHRESH are selectively acked.
+    bitmap = (1 << DUPTHRESH) - 1
+    acked, _, lost = window.on_ack(1, bitmap, 1.0)
+    assert acked == 1 + DUPTHRESH
+    assert lost == [1]
+
+    # A packet is only fast-retransmitted once.
+    assert window.on_ack(1, bitmap, 1.0)[2] == []
+    assert window.resend(1, 2.0) == []
+    assert window.inflight[1].retransmits == 1
+
+
+def test_send_window_across_wraparound() -> None:
+    window = SendWindow(size=4)
+    window.next_packet = SERIAL - 2
+    packets = [window.track([], 0.0) for _ in range(4)]
+    assert packets == [SERIAL - 2, SERIAL - 1, 0, 1]
+    assert window.full()
+    acked, _, _ = window.on_ack(1, 0, 1.0)
+    assert acked == 3
+    assert list(window.inflight) == [1]
+
+
+def test_retransmitted_packets_give_no_samples() -> None:
+    window = SendWindow()
+    window.track([], 0.0)
+    window.resend(0, 1.0)
+    assert window.on_ack(1, 0, 2.0) == (1, [], [])
+
+
+def test_timeouts() -> None:
+    window = SendWindow()
+    assert window.next_deadline(1.0) is None
+    window.track([], 0.0)
+    window.track([], 0.5)
+    assert window.next_deadline(1.0) == 1.0
+    assert window.expired(0.9, 1.0) == []
+    assert window.expired(1.0, 1.0) == [0, 1]
+
+
+def test_rtt_estimator() -> None:
+    estimator = RttEstimator(rto=1.0, min_rto=0.2, max_rto=4.0)
+    estimator.update(0.1)
+    assert estimator.srtt == 0.1
+    assert estimator.rto == pytest.approx(0.3)
+    for _ in range(5):
+        estimator.backoff()
+    assert estimator.rto == 4.0
+    estimator.reset()
+    assert estimator.rto == pytest.approx(0.3)
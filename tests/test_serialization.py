@@ -0,0 +1,112 @@
+""" Tests for tiered serialization, out-of-band buffers and the codec registry. """
+from typing import Any, List
+
+import numpy as np
+import pytest
+
+from mead import serialization
+from mead.framing import Buffer
+from mead.serialization import (
+    DILL,
+    PICKLE,
+    OOB_THRESHOLD,
+    FIRST_USER_CODEC,
+    Codec,
+    dumps,
+    loads,
+    codec_of,
+    register_codec,
+)
+
+LARGE = OOB_THRESHOLD * 4
+
+
+def _sizes(segments: List[Buffer]) -> List[int]:
+    """ Returns the size in bytes of each segment. """
+    return [memoryview(segment).nbytes for segment in segments]
+
+
+def _join(segments: List[Buffer]) -> bytes:
+    """ Concatenates segments as the receiving side sees them. """
+    return b"".join(memoryview(segment).cast("B") for segment in segments)
+
+
+@pytest.mark.parametrize("kind", [bytes, bytearray])
+def test_large_byte_strings_are_out_of_band(kind: Any) -> None:
+    payload = kind(b"x" * LARGE)
+    segments = dumps(payload)
+    assert _sizes(segments)[2:] == [LARGE]
+    assert memoryview(segments[2]).obj is payload
+    result = loads(_join(segments))
+    assert type(result) is kind
+    assert result == payload
+
+
+def test_nested_byte_strings_are_out_of_band() -> None:
+    first, second = b"a" * LARGE, bytearray(b"b" * LARGE)
+    obj = {"first": first, "rest": [second, (first, 1)], "small": b"c" * 10}
+    segments = dumps(obj)
+
+    # The same object is sent once, and small ones stay in-band.
+    assert sorted(_sizes(segments)[2:]) == [LARGE, LARGE]
+    result = loads(_join(segments))
+    assert result == obj
+    assert result["first"] is result["rest"][1][0]
+
+
+def test_arrays_are_out_of_band_and_share_memory() -> None:
+    array = np.arange(LARGE, dtype=np.uint8)
+    segments = dumps({"array": array})
+    assert _sizes(segments)[2:] == [LARGE]
+    message = bytearray(_join(segments))
+    result = loads(message)["array"]
+    np.testing.assert_array_equal(result, array)
+    result[0] = 255
+    assert 255 in message
+
+
+def test_small_objects_are_one_stream() -> None:
+    segments = dumps({"a": [1, 2.5, "three", b"four"]})
+    assert len(segments) == 2
+    assert codec_of(segments[0]) == PICKLE
+    assert loads(_join(segments)) == {"a": [1, 2.5, "three", b"four"]}
+
+
+def test_dill_handles_what_pickle_cannot() -> None:
+    offset = 3
+    segments = dumps(lambda x: x + offset)
+    assert codec_of(segments[0]) == DILL
+    assert loads(_join(segments))(1) == 4
+
+
+def test_dill_keeps_byte_strings_out_of_band() -> None:
+    payload = b"d" * LARGE
+    segments = dumps((lambda: None, payload))
+    assert codec_of(segments[0]) == DILL
+    assert _sizes(segments)[2:] == [LARGE]
+    assert loads(_join(segments))[1] == payload
+
+
+class _Reverse(Codec):
+    """ A codec which sends byte strings backwards. """
+
+    def dumps(self, obj: Any) -> List[Buffer]:
+        return [obj[::-1]]
+
+    def loads(self, message: memoryview) -> Any:
+        return bytes(message)[::-1]
+
+
+def test_registered_codec_round_trip(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(serialization, "CODECS", {})
+    register_codec(FIRST_USER_CODEC, _Reverse())
+    segments = dumps(b"abc", FIRST_USER_CODEC)
+    assert codec_of(segments[0]) == FIRST_USER_CODEC
+    assert _join(segments)[1:] == b"cba"
+    assert loads(_join(segments)) == b"abc"
+
+
+@pytest.mark.parametrize("tag", [PICKLE, DILL, FIRST_USER_CODEC - 1, 256])
+def test_reserved_codec_tags_are_refused(tag: int) -> None:
+    with pytest.raises(ValueError):
+        register_codec(tag, _Reverse())
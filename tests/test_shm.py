@@ -0,0 +1,49 @@
+""" Tests for the shared-memory ring. """
+import pytest
+
+from mead import Pipe, Spout, Funnel, Process, cellar
+from mead.shm import LENGTH, SharedRing
+
+
+def test_messages_wrap_around_the_ring() -> None:
+    ring = SharedRing(capacity=64)
+    try:
+        assert not ring.poll()
+
+        # Sizes which do not divide the ring move the positions across its end.
+        for size in range(1, 64 - LENGTH.size, 3):
+            message = bytes(range(size))
+            ring.send_bytes(message)
+            assert ring.poll()
+            assert ring.recv_bytes() == message
+        ring.send({"a": 1})
+        assert ring.recv() == {"a": 1}
+    finally:
+        ring.unlink()
+
+
+def _echo(spout: Spout, funnel: Funnel) -> None:
+    funnel.send(spout.recv())
+
+
+def test_only_pipes_local_at_both_ends_move_to_rings() -> None:
+    inbound, inbound_end = Pipe()
+    outbound_end, outbound = Pipe()
+
+    # The outbound pipe also reaches another host, so it keeps its pipe.
+    Process(target=_echo, hostname="remote.invalid", args=(outbound,))
+
+    # Messages sent before the start reach the child through its ring.
+    inbound.send("early")
+    process = Process(
+        target=_echo, hostname="localhost", args=(inbound_end, outbound_end)
+    )
+    process.start()
+    assert outbound.recv() == "early"
+    process.join()
+    assert isinstance(cellar.SPOUTS[inbound_end.pipe_id].connection, SharedRing)
+    assert not isinstance(cellar.SPOUTS[outbound.pipe_id].connection, SharedRing)
+
+    # A pipe carried by a ring cannot be given to another host afterwards.
+    with pytest.raises(ValueError):
+        Process(target=_echo, hostname="remote.invalid", args=(inbound_end,))